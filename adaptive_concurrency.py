@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+
+# Requests in flight per host: where the window starts, its floor and its ceiling
+INITIAL_WINDOW = float(os.getenv('HTTP_INITIAL_WINDOW', 4))
+MIN_WINDOW = float(os.getenv('HTTP_MIN_WINDOW', 1))
+MAX_WINDOW = float(os.getenv('HTTP_MAX_WINDOW', os.getenv('HTTP_POOL_SIZE', 32)))
+# Back off when the smoothed latency goes above this multiple of the best latency seen lately
+LATENCY_FACTOR = float(os.getenv('HTTP_LATENCY_FACTOR', 2.5))
+
+# Answers that mean "slow down": rate limited, IP banned (Binance 418), server trouble
+THROTTLE_STATUSES = {418, 429}
+
+
+def is_throttle(status):
+    return status is None or status in THROTTLE_STATUSES or status >= 500
+
+
+# Additive-increase / multiplicative-decrease limit on the requests in flight to one host, like TCP's
+# congestion window: +1 per window's worth of healthy answers, halved on throttling or on latency rising
+# well above its baseline. At most one decrease per round trip, so a burst of 429s from the same window
+# counts once.
+class AIMDController:
+
+    def __init__(self, host, initial=INITIAL_WINDOW, minimum=MIN_WINDOW, maximum=MAX_WINDOW,
+                 decrease=0.5, latency_factor=LATENCY_FACTOR):
+        self.host = host
+        self.window = min(max(initial, minimum), maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.latency = None
+        self.base_latency = None
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.peak_in_flight = 0
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.window):
+                self.condition.wait()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    # status None is a connection error or timeout
+    def release(self, status, latency=None):
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            now = time.monotonic()
+            if latency is not None:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                # Baseline creeps up slowly so a permanently slower host doesn't look congested forever
+                if self.base_latency is None or latency < self.base_latency:
+                    self.base_latency = latency
+                else:
+                    self.base_latency *= 1.001
+
+            if is_throttle(status):
+                self.throttled += 1
+                self.back_off(now)
+            elif self.latency is not None and self.latency > self.latency_factor * self.base_latency:
+                self.back_off(now)
+            else:
+                self.window = min(self.maximum, self.window + 1 / self.window)
+            self.condition.notify_all()
+
+    def back_off(self, now):
+        if now - self.last_decrease < (self.latency or 0.0):
+            return
+        self.window = max(self.minimum, self.window * self.decrease)
+        self.last_decrease = now
+        self.decreases += 1
+
+    # Throttling reported inside an otherwise successful answer (e.g. Kraken's EAPI:Rate limit exceeded)
+    def report_throttle(self):
+        with self.condition:
+            self.throttled += 1
+            self.back_off(time.monotonic())
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+                "base_latency_ms": round(self.base_latency * 1000, 1) if self.base_latency is not None else None,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "decreases": self.decreases,
+            }
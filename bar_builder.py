@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from termcolor import colored
+
+from trade_dataset import as_datetime, get_dataset, to_ms
+
+BARS_ROOT = os.getenv('BARS_ROOT')
+BAR_INTERVALS = os.getenv('BAR_INTERVALS', '1s,1m,1h').split(',')
+# Trades are read and reduced this much at a time, so a monthly archive never sits in memory whole
+BAR_CHUNK = timedelta(days=1)
+BAR_COMPRESSION = os.getenv('BAR_COMPRESSION', 'zstd')
+BAR_COLUMNS = ("time", "open", "high", "low", "close", "volume", "quote_volume", "buy_volume", "sell_volume",
+               "count", "vwap")
+TRADE_COLUMNS = ("time", "price", "qty", "is_buyer_maker")
+UNITS = {"s": 1000, "m": 60000, "h": 3600000, "d": 86400000}
+EPOCH = datetime(2010, 1, 1)
+
+
+def interval_ms(interval):
+    return int(interval[:-1]) * UNITS[interval[-1]]
+
+
+# Next to the Parquet trade dataset, <root>/bars/exchange=/market=/symbol=/interval=/YYYY-MM.parquet
+def bars_root(adapter):
+    return BARS_ROOT or os.path.join(os.path.dirname(os.path.dirname(adapter.storage_path)), "bars")
+
+
+def bars_dir(adapter, market, pair, interval):
+    return os.path.join(bars_root(adapter), f"exchange={adapter.exchange}", f"market={market}",
+                        f"symbol={adapter.trading_pair(pair)}", f"interval={interval}")
+
+
+# Rows of equal time // interval merged into one bar, time ordered. Works on trades (open = high = low =
+# close = price, count = 1) and on bars alike, so finer bars roll up into coarser ones the same way.
+def reduce_bars(time_ms, open_, high, low, close, volume, quote_volume, buy_volume, count, interval):
+    import numpy as np
+
+    if len(time_ms) > 1 and (np.diff(time_ms) < 0).any():
+        # Bitstamp snapshots come newest first
+        order = np.argsort(time_ms, kind="stable")
+        time_ms, open_, high, low, close, volume, quote_volume, buy_volume, count = (
+            column[order] for column in (time_ms, open_, high, low, close, volume, quote_volume, buy_volume, count))
+    if not len(time_ms):
+        return empty_bars()
+    bucket = time_ms // interval * interval
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    ends = np.append(starts[1:], len(bucket)) - 1
+    volume_sum = np.add.reduceat(volume, starts)
+    quote_sum = np.add.reduceat(quote_volume, starts)
+    buy_sum = np.add.reduceat(buy_volume, starts)
+    close_at_end = close[ends]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vwap = np.where(volume_sum > 0, quote_sum / volume_sum, close_at_end)
+    return {
+        "time": bucket[starts].astype(np.int64),
+        "open": open_[starts],
+        "high": np.maximum.reduceat(high, starts),
+        "low": np.minimum.reduceat(low, starts),
+        "close": close_at_end,
+        "volume": volume_sum,
+        "quote_volume": quote_sum,
+        "buy_volume": buy_sum,
+        "sell_volume": volume_sum - buy_sum,
+        "count": np.add.reduceat(count, starts).astype(np.int64),
+        "vwap": vwap,
+    }
+
+
+def empty_bars():
+    import numpy as np
+
+    return {name: np.empty(0, np.int64 if name in ("time", "count") else np.float64) for name in BAR_COLUMNS}
+
+
+# Taker buys are the trades where the buyer is not the maker
+def trade_bars(trades, interval):
+    import numpy as np
+
+    time_ms = trades["time"].to_numpy()
+    price = trades["price"].to_numpy().astype(np.float64)
+    qty = trades["qty"].to_numpy().astype(np.float64)
+    buy = np.where(trades["is_buyer_maker"].to_numpy(zero_copy_only=False), 0.0, qty)
+    return reduce_bars(time_ms, price, price, price, price, qty, price * qty, buy, np.ones(len(time_ms), np.int64), interval)
+
+
+def merge_bars(parts, interval):
+    import numpy as np
+
+    parts = [part for part in parts if len(part["time"])]
+    if not parts:
+        return empty_bars()
+    joined = {name: np.concatenate([part[name] for part in parts]) for name in BAR_COLUMNS}
+    return reduce_bars(*(joined[name] for name in BAR_COLUMNS[:-3]), joined["count"], interval)
+
+
+def read_part(path):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    return {name: table[name].to_numpy() for name in BAR_COLUMNS}
+
+
+def write_part(path, bars):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(pa.table({name: bars[name] for name in BAR_COLUMNS}), temp, compression=BAR_COMPRESSION)
+    os.replace(temp, path)
+
+
+def from_ms(ms):
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(ms))
+
+
+def month_of(ms):
+    return from_ms(ms).strftime('%Y-%m')
+
+
+def month_start_ms(month):
+    return to_ms(datetime.strptime(month, '%Y-%m'))
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Materialized bars of one (exchange, market, symbol, interval): a Parquet part per month plus state.json
+# holding the watermark (end of the last file reduced, ms) and the catalog digest of every period reduced.
+# update() reduces only the files past the watermark; a period that appeared or changed size behind it
+# (a backfill, a re-download) rebuilds from its month on.
+class BarCache:
+
+    def __init__(self, dataset, exchange, market, symbol, interval):
+        self.dataset = dataset
+        self.exchange = exchange
+        self.market = market
+        self.pair = symbol.replace('/', '')
+        self.interval = interval
+        self.interval_ms = interval_ms(interval)
+        self.directory = bars_dir(dataset.feeds[exchange][0], market, self.pair, interval)
+        self.state_path = os.path.join(self.directory, "state.json")
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {"watermark": 0, "periods": {}}
+
+    def save_state(self, state):
+        temp = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(temp, 'w') as file:
+            json.dump(state, file)
+        os.replace(temp, self.state_path)
+
+    def part_path(self, month):
+        return os.path.join(self.directory, f"{month}.parquet")
+
+    def months(self):
+        try:
+            return sorted(name[:7] for name in os.listdir(self.directory) if name.endswith(".parquet"))
+        except OSError:
+            return []
+
+    # Drops the parts from a month on and the periods reduced into them
+    def truncate(self, state, month):
+        for existing in self.months():
+            if existing >= month:
+                os.remove(self.part_path(existing))
+        start_ms = month_start_ms(month)
+        state["watermark"] = min(state["watermark"], start_ms)
+        state["periods"] = {period: digest for period, digest in state["periods"].items() if digest[2] < start_ms}
+        self.save_state(state)
+
+    # Extends the bars with every file past the watermark. Returns the number of files reduced.
+    def update(self):
+        os.makedirs(self.directory, exist_ok=True)
+        state = self.load_state()
+        files = self.dataset.files(EPOCH, datetime.now() + timedelta(days=2), self.exchange, self.market,
+                                   self.pair).get((self.exchange, self.market, self.pair), [])
+
+        # A file not seen before is a backfill only if it lies wholly behind the watermark: one reaching
+        # past it (every new Bitstamp snapshot starts a day or an hour back) just extends the bars. A seen
+        # one is stale when its size changed, unless its codec did too (recompressed or kept compressed).
+        def changed(found):
+            seen = state["periods"].get(found.period)
+            if seen is None:
+                return to_ms(found.end) <= state["watermark"]
+            return seen[1] == found.digest[1] and seen[0] != found.digest[0]
+
+        stale = [found for found in files if to_ms(found.start) < state["watermark"] and changed(found)]
+        if stale:
+            self.truncate(state, min(found.start for found in stale).strftime('%Y-%m'))
+
+        resumed_from = state["watermark"]
+        pending = {}
+        reduced = 0
+        for found in files:
+            end_ms = to_ms(found.end)
+            if end_ms <= state["watermark"]:
+                continue
+            window = max(found.start, from_ms(state["watermark"]))
+            while window < found.end:
+                window_end = min(window + BAR_CHUNK, found.end)
+                bars = trade_bars(found.read(to_ms(window), to_ms(window_end), TRADE_COLUMNS), self.interval_ms)
+                if len(bars["time"]):
+                    for month in {month_of(bars["time"][0]), month_of(bars["time"][-1])}:
+                        pending.setdefault(month, []).append(bars)
+                window = window_end
+            state["periods"][found.period] = [found.digest[0], found.digest[1], to_ms(found.start)]
+            state["watermark"] = max(state["watermark"], end_ms)
+            reduced += 1
+            # A part is rewritten once its month is done, not once per file
+            keep = month_of(state["watermark"] - 1)
+            if any(month != keep for month in pending):
+                self.flush(pending, keep)
+                self.checkpoint(state, resumed_from, keep)
+        self.flush(pending)
+        self.save_state(state)
+        return reduced
+
+    # Saves how far the parts on disk go. The month still filling isn't written yet, so the watermark saved
+    # is its start, unless its part already held bars from before this run.
+    def checkpoint(self, state, resumed_from, keep):
+        watermark = max(resumed_from, min(state["watermark"], month_start_ms(keep)))
+        self.save_state({"watermark": watermark,
+                         "periods": {period: digest for period, digest in state["periods"].items() if digest[2] < watermark}})
+
+    # Writes the pending months' bars into their parts, except `keep`, which is still being filled
+    def flush(self, pending, keep=None):
+        for month in sorted(pending):
+            if month == keep:
+                continue
+            parts = pending.pop(month)
+            start_ms = month_start_ms(month)
+            end_ms = month_start_ms(month_of(start_ms + 32 * 86400000))
+            # A chunk can straddle two months, each part only takes its own bars
+            parts = [{name: bars[name][(bars["time"] >= start_ms) & (bars["time"] < end_ms)] for name in BAR_COLUMNS}
+                     for bars in parts]
+            path = self.part_path(month)
+            if os.path.exists(path):
+                parts.insert(0, read_part(path))
+            bars = merge_bars(parts, self.interval_ms)
+            if len(bars["time"]):
+                write_part(path, bars)
+
+    # Bars in [start, end) as {column: array}
+    def read(self, start, end):
+        import numpy as np
+
+        start_ms, end_ms = to_ms(as_datetime(start)), to_ms(as_datetime(end))
+        first, last = month_of(start_ms), month_of(end_ms - 1)
+        parts = [read_part(self.part_path(month)) for month in self.months() if first <= month <= last]
+        if not parts:
+            return empty_bars()
+        bars = {name: np.concatenate([part[name] for part in parts]) for name in BAR_COLUMNS}
+        inside = (bars["time"] >= start_ms) & (bars["time"] < end_ms)
+        return {name: column[inside] for name, column in bars.items()}
+
+
+# Materialized intervals of a symbol, finest first
+def cached_intervals(dataset, exchange, market, symbol):
+    directory = os.path.dirname(bars_dir(dataset.feeds[exchange][0], market, symbol.replace('/', ''), "1s"))
+    try:
+        names = [name.partition('=')[2] for name in os.listdir(directory) if name.startswith("interval=")]
+    except OSError:
+        return []
+    return sorted(names, key=interval_ms)
+
+
+# Bars of one symbol in [start, end) as a DataFrame or, with as_numpy, a {column: array} dict. An interval
+# that isn't materialized is rolled up from the coarsest materialized one that divides it.
+def load_bars(exchange, market, symbol, interval, start, end, as_numpy=False, storage_root=None):
+    import pandas as pd
+
+    dataset = get_dataset(exchange, storage_root)
+    target = interval_ms(interval)
+    sources = [name for name in cached_intervals(dataset, exchange, market, symbol) if target % interval_ms(name) == 0]
+    if not sources:
+        raise ValueError(f"No materialized bars of {exchange} {market} {symbol} to build {interval} from, "
+                         f"run bar_builder.py first")
+    bars = BarCache(dataset, exchange, market, symbol, sources[-1]).read(start, end)
+    if sources[-1] != interval:
+        bars = reduce_bars(*(bars[name] for name in BAR_COLUMNS[:-3]), bars["count"], target)
+    return bars if as_numpy else pd.DataFrame(bars)
+
+
+# Extends every materialized (symbol, interval) of an exchange, for after an ingest run
+def refresh_bars(exchange, storage_root=None):
+    dataset = get_dataset(exchange, storage_root)
+    root = os.path.join(bars_root(dataset.feeds[exchange][0]), f"exchange={exchange}")
+    reduced = 0
+    for directory, _, files in os.walk(root):
+        if "state.json" not in files:
+            continue
+        parts = dict(part.partition('=')[::2] for part in os.path.relpath(directory, root).split(os.sep))
+        reduced += BarCache(dataset, exchange, parts["market"], parts["symbol"], parts["interval"]).update()
+    return reduced
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    from exchange_adapters import ADAPTERS
+
+    parser = argparse.ArgumentParser(description="Build or extend the materialized OHLCV bars of symbols.")
+    parser.add_argument("exchange", help=f"Exchange of the feeds: {', '.join(ADAPTERS)}")
+    parser.add_argument("market", nargs="?")
+    parser.add_argument("symbols", nargs="*")
+    parser.add_argument("--intervals", nargs="+", default=BAR_INTERVALS, help="Bar intervals, e.g. 1s 1m 1h.")
+    parser.add_argument("--refresh", action="store_true", help="Extend every materialized symbol of the exchange.")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    args = parser.parse_args()
+
+    started = time.time()
+    if args.refresh:
+        reduced = refresh_bars(args.exchange, args.storage_root)
+        print(colored(f"{args.exchange}: {reduced} files reduced in {time.time() - started:.1f}s", 'green'))
+    else:
+        if not args.market or not args.symbols:
+            parser.error("market and symbols are needed unless --refresh")
+        dataset = get_dataset(args.exchange, args.storage_root)
+        for symbol in args.symbols:
+            for interval in args.intervals:
+                cache = BarCache(dataset, args.exchange, args.market, symbol, interval)
+                reduced = cache.update()
+                print(colored(f"{args.exchange} {args.market} {symbol} {interval}: {reduced} files reduced, "
+                              f"{len(cache.months())} months in {time.time() - started:.1f}s", 'green'))
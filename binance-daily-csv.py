@@ -1,14 +1,20 @@
-import subprocess
 import os
-import requests
-import zipfile
 from termcolor import colored
+from catalog_backend import get_catalog
+from compressed_files import plain_name
+from negative_cache import get_negative_cache
+from symbol_lifecycle import SymbolLifecycle
+from symbol_universe import fetch_json, compact_binance_exchange_info
 from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
 
+# requests and numpy (coverage_index) are imported where they are used,
+# importing this module does no I/O and stays cheap for cron runs
+
 # Constants
 STORAGE_PATH = "/Volumes/rawPriceData/binance/daily"
 DATABASE_NAME = "binance_csvs"
+EXCHANGE = "binance"
 BASE_URL = "https://data.binance.vision/data"
 
 MARKET_TYPES = {
@@ -19,39 +25,22 @@ MARKET_TYPES = {
 
 # Function to run SQL commands and return the result
 def run_sql_command(sql_command):
-    cmd = [
-        "mysql",
-        "--login-path=client",
-        "-e",
-        sql_command,
-        DATABASE_NAME
-    ]
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print("MySQL error:", e.stderr)
-        raise  # Optionally re-raise the error if you want to stop the script
+    return get_catalog(DATABASE_NAME).run_sql(sql_command)
 
 
-#-----------------------------------------------------------------------------------------------------------#
+# Day coverage of the daily and monthly tables, built once per run and kept current on insert
+COVERAGE = None
 
+def get_coverage():
+    global COVERAGE
+    if COVERAGE is None:
+        from coverage_index import CoverageIndex
+        COVERAGE = CoverageIndex.from_catalog(get_catalog(DATABASE_NAME), EXCHANGE)
+    return COVERAGE
 
-# Function to get the list of downloaded records from the database
-def get_downloaded_records_from_db():
-    sql_command = "SELECT market, trading_pair, date FROM daily;"
-    downloaded_records = run_sql_command(sql_command)
-    # Parse the output into a list of tuples (market, trading_pair, date)
-    return [tuple(line.split("\t")) for line in downloaded_records.split("\n")[1:]]
 
-# Function to delete the database record for files not found
-def delete_record_from_db(market, trading_pair, date_str):
-    sql_command = f"""
-    DELETE FROM daily
-    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND date = '{date_str}';
-    """
-    print(colored(f"Deleted from DB: {record}", 'yellow'))
-    run_sql_command(sql_command)
+#-----------------------------------------------------------------------------------------------------------#
+
 
 # Function to insert new file records into the database
 def insert_new_file_record(market, trading_pair, date_str):
@@ -61,12 +50,15 @@ def insert_new_file_record(market, trading_pair, date_str):
     """
     print(colored(f"Data inserted {market}, {trading_pair}, {date_str}", 'cyan'))
     run_sql_command(sql_command)
+    if COVERAGE is not None:
+        COVERAGE.add_days((EXCHANGE, market, trading_pair), [date_str])
 
 # Function to scan the storage path and create a list of files
 def scan_storage_for_csv_files(storage_path):
     files_info = []  # Holds information about the files
     for root, dirs, files in os.walk(storage_path):
-        for file in files:
+        # Kept archives and recompressed files count as the CSV they hold
+        for file in map(plain_name, files):
             if file.endswith('.csv'):
                 parts = file.replace('-trades', '').split('-')
                 symbol = parts[0]
@@ -101,14 +93,10 @@ def collect_download_tasks():
     for market_type in MARKET_TYPES.keys():
         symbols = get_all_symbols(market_type)
         for symbol in symbols:
-            downloaded_dates = get_downloaded_dates_for_symbol(market_type, symbol)
-            current_date = date.today().replace(day=1)
+            start_date = date.today().replace(day=1)
             end_date = date.today() - timedelta(days=1)
-            while current_date <= end_date:
-                date_str = current_date.strftime('%Y-%m-%d')
-                if date_str not in downloaded_dates:
-                    tasks.append((symbol, market_type, date_str))
-                current_date += timedelta(days=1)
+            for missing_date in get_coverage().missing_days((EXCHANGE, market_type, symbol.replace("/", "")), start_date, end_date):
+                tasks.append((symbol, market_type, missing_date.strftime('%Y-%m-%d')))
     return tasks
 
 
@@ -116,11 +104,12 @@ def collect_download_tasks():
 
 
 def get_all_symbols(market_type):
+    import requests
+
     print(f"Fetching symbols for {market_type} market...")
     try:
-        response = requests.get(MARKET_TYPES[market_type])
-        response.raise_for_status()  # Raises a HTTPError if the HTTP request returned an unsuccessful status code
-        data = response.json()
+        # Cached and shared with the other scripts, raises a HTTPError if the request was unsuccessful
+        data = fetch_json(MARKET_TYPES[market_type], extract=compact_binance_exchange_info)
 
         symbols = []
         if market_type == "spot":
@@ -148,15 +137,18 @@ def get_all_symbols(market_type):
 
 
 def download_file(symbol, market, date_str):
+    import zipfile
+    import http_pool
 
-    # Check if the file has already been downloaded by querying the database
-    downloaded_records = get_downloaded_records_from_db()
-    record = (market, symbol, date_str)
-
-    if record in [(r[0], r[1], r[2]) for r in downloaded_records]:
+    # Check if the file has already been downloaded against the catalog coverage
+    if get_coverage().is_covered((EXCHANGE, market, symbol), date_str):
         print(f"Data for {symbol} on {date_str} has already been downloaded.")
         return "Data already downloaded"
 
+    # Skip archives Binance already told us it doesn't have
+    if get_negative_cache().is_known_missing(EXCHANGE, market, symbol, date_str):
+        return "No data"
+
     # Determine the market URL based on the market type
     market_url_suffix = ""
     if market == "usdm":
@@ -171,15 +163,15 @@ def download_file(symbol, market, date_str):
     zip_file_path = os.path.join(STORAGE_PATH, market, symbol, f"{symbol}-trades-{date_str}.zip")
 
     os.makedirs(os.path.dirname(zip_file_path), exist_ok=True)
-    response = requests.get(zip_file_url, stream=True)
-
-
-    if response.status_code == 200:
-        with open(zip_file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-
+    # The host slot is held until the body is on disk, extraction runs outside it
+    with http_pool.stream(zip_file_url) as response:
+        status_code = response.status_code
+        if status_code == 200:
+            with open(zip_file_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+
+    if status_code == 200:
         # Extract the zip file
         with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
             zip_ref.extractall(os.path.dirname(zip_file_path))
@@ -190,7 +182,11 @@ def download_file(symbol, market, date_str):
         insert_new_file_record(market, symbol, date_str)
         return "Data downloaded and database updated"
     else:
-        print(colored(f"No data found at {zip_file_url} (HTTP status code: {response.status_code})", 'red'))
+        print(colored(f"No data found at {zip_file_url} (HTTP status code: {status_code})", 'red'))
+        if status_code != 404:
+            # Throttled or a server error, not evidence the archive doesn't exist
+            return "Request failed"
+        get_negative_cache().record_missing(EXCHANGE, market, symbol, date_str, status_code)
         return "No data"
 
 
@@ -200,21 +196,39 @@ def download_file(symbol, market, date_str):
 # Function to process the symbols with threading
 def process_symbols(market_type, executor):
     symbols = get_all_symbols(market_type)
+    lifecycle = SymbolLifecycle(get_catalog(DATABASE_NAME))
+    lifecycle.observe(market_type, symbols)
+    coverage = get_coverage()
     tasks = []
-    for symbol in symbols:
-        downloaded_dates = get_downloaded_dates_for_symbol(market_type, symbol)
-        current_date = date.today().replace(day=1)
+    final_backfills = []
+    failed = set()
+    for symbol, last_day in lifecycle.plan(market_type, symbols):
+        start_date = date.today().replace(day=1)
         end_date = date.today() - timedelta(days=1)
-        while current_date <= end_date:
-            date_str = current_date.strftime('%Y-%m-%d')
-            if date_str not in downloaded_dates:
-                # Schedule the download task
-                tasks.append(executor.submit(download_file, symbol, market_type, date_str))
-            current_date += timedelta(days=1)
+        if last_day:
+            # Delisted: one last pass up to the day it was last seen. With nothing of it in this month's
+            # window the days belong to the monthly archives, whose script closes the backfill instead.
+            end_date = min(last_day, end_date)
+            if start_date <= end_date:
+                final_backfills.append(symbol)
+        for missing_date in coverage.missing_days((EXCHANGE, market_type, symbol), start_date, end_date):
+            # Schedule the download task
+            tasks.append((symbol, executor.submit(download_file, symbol, market_type, missing_date.strftime('%Y-%m-%d'))))
 
     # Wait for all tasks to complete
-    for task in tasks:
-        task.result()
+    for symbol, task in tasks:
+        try:
+            result = task.result()
+        except Exception as e:
+            print(colored(f"Download failed for {symbol}: {e}", 'red'))
+            result = "Request failed"
+        if result == "Request failed":
+            failed.add(symbol)
+
+    # Only once every day was fetched or is definitively missing (404), the final pass can't run again
+    for symbol in final_backfills:
+        if symbol not in failed:
+            lifecycle.finish_backfill(market_type, symbol)
 
 
 #-----------------------------------------------------------------------------------------------------------#
@@ -226,20 +240,13 @@ if __name__ == "__main__":
     # Get the list of downloaded files from the storage
     files_in_storage = scan_storage_for_csv_files(STORAGE_PATH)
 
-    # Get the list of downloaded records from the database
-    downloaded_records_db = get_downloaded_records_from_db()
-
-    # Delete records from the database that are not present in storage
-    for record in downloaded_records_db:
-        if (record[0], record[1], record[2]) not in [(f[0], f[1], f[2]) for f in files_in_storage]:
-            delete_record_from_db(*record)
-
-    # Insert new records for files present in storage but not in the database
-    for file_info in files_in_storage:
-        if (file_info[0], file_info[1], file_info[2]) not in [(r[0], r[1], r[2]) for r in downloaded_records_db]:
-            insert_new_file_record(*file_info)
+    # Bring the database in line with the files present in storage
+    inserted, deleted = get_catalog(DATABASE_NAME).reconcile("daily", files_in_storage)
+    print(colored(f"Reconciled daily records: {inserted} inserted, {deleted} deleted", 'yellow'))
 
     # Use threading to download files
     with ThreadPoolExecutor(max_workers=15) as executor:
         for market_type in MARKET_TYPES.keys():
             process_symbols(market_type, executor)
+
+    get_negative_cache().report()
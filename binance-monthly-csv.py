@@ -1,17 +1,22 @@
-import subprocess
 import os
-import requests
-import zipfile
-import json
 from termcolor import colored
+from catalog_backend import get_catalog
+from compressed_files import find_stored, plain_name
+from negative_cache import get_negative_cache
+from symbol_lifecycle import SymbolLifecycle
+from symbol_universe import fetch_json, compact_binance_exchange_info
 from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
 from dateutil.relativedelta import relativedelta
 import logging
 
+# requests and numpy (coverage_index) are imported where they are used,
+# importing this module does no I/O and stays cheap for cron runs
+
 # Constants
 STORAGE_PATH = "/Volumes/rawPriceData/binance/monthly"
 DATABASE_NAME = "binance_csvs"
+EXCHANGE = "binance"
 BASE_URL = "https://data.binance.vision/data"
 
 MARKET_TYPES = {
@@ -20,49 +25,23 @@ MARKET_TYPES = {
     "coinm": "https://dapi.binance.com/dapi/v1/exchangeInfo"
 }
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
-
 # Function to run SQL commands and return the result
 def run_sql_command(sql_command):
-    cmd = [
-        "mysql",
-        "--login-path=client",
-        "-e",
-        sql_command,
-        DATABASE_NAME
-    ]
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        logging.error("MySQL error: %s", e.stderr)
-        raise
+    return get_catalog(DATABASE_NAME).run_sql(sql_command)
 
 
-#-----------------------------------------------------------------------------------------------------------#
-
+# Month coverage of the monthly table, built once per run and kept current on insert
+COVERAGE = None
 
-# Function to get the list of downloaded records from the database
-def get_downloaded_records_from_db():
-    sql_command = "SELECT market, trading_pair, date FROM monthly;"
-    downloaded_records = run_sql_command(sql_command)
-    if downloaded_records:
-        # Parse the output into a list of tuples (market, trading_pair, date)
-        return [tuple(line.split("\t")) for line in downloaded_records.split("\n")[1:] if line]
-    else:
-        logging.info("No records fetched from the database.")
-        return []
+def get_coverage():
+    global COVERAGE
+    if COVERAGE is None:
+        from coverage_index import CoverageIndex
+        COVERAGE = CoverageIndex.from_catalog(get_catalog(DATABASE_NAME), EXCHANGE, tables=("monthly",))
+    return COVERAGE
 
 
-# Function to delete the database record for files not found
-def delete_record_from_db(market, trading_pair, date_str):
-    sql_command = f"""
-    DELETE FROM monthly
-    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND date = '{date_str}';
-    """
-    run_sql_command(sql_command)
-    print(colored(f"Deleted from DB: {record}", 'yellow'))
+#-----------------------------------------------------------------------------------------------------------#
 
 
 # Function to insert new file records into the database
@@ -72,6 +51,8 @@ def insert_new_file_record(market, trading_pair, date_str):
     VALUES ('{market}', '{trading_pair}', '{date_str}');
     """
     run_sql_command(sql_command)
+    if COVERAGE is not None:
+        COVERAGE.add_months((EXCHANGE, market, trading_pair), [date_str])
     print(colored(f"Inserted into DB: {market}, {trading_pair}, {date_str}", 'cyan'))
 
 # Function to scan the storage path and create a list of files
@@ -79,7 +60,8 @@ def scan_storage_for_csv_files(storage_path):
     files_info = []  # Holds information about the files
     try:
         for root, dirs, files in os.walk(storage_path):
-            for file in files:
+            # Kept archives and recompressed files count as the CSV they hold
+            for file in map(plain_name, files):
                 if file.endswith('.csv'):
                     parts = file.replace('-trades', '').split('-')
                     symbol = parts[0]
@@ -157,14 +139,14 @@ def record_exists(market, symbol, date_str):
 #-----------------------------------------------------------------------------------------------------------#
 
 
-def first_csv(symbol, market):
+def first_csv(symbol, market, last_day=None):
     print(colored(f"Processing first_csv for {symbol} in {market} market.", 'magenta'))
 
     # Check if first_csv is already marked
     first_csv_check_command = """
     SELECT first_csv FROM monthly
     WHERE trading_pair = '{}' AND market = '{}'
-    ORDER BY date ASC
+    ORDER BY period_start ASC
     LIMIT 1;
     """.format(symbol, market)
     first_csv_check_result = run_sql_command(first_csv_check_command).split("\n")
@@ -181,8 +163,10 @@ def first_csv(symbol, market):
     oldest_date_result = run_sql_command(oldest_date_command).split("\n")
     has_existing_data = len(oldest_date_result) >= 2 and oldest_date_result[1] != 'NULL'
 
-    # Determine start date for downloading data
+    # Determine start date for downloading data, a delisted symbol from the month it was last seen in
     current_date = datetime.now() - relativedelta(months=1)
+    if last_day:
+        current_date = min(current_date, datetime(last_day.year, last_day.month, 1))
     current_year, current_month = current_date.year, current_date.month
 
     # Flag to indicate if any new data has been downloaded
@@ -219,7 +203,8 @@ def first_csv(symbol, market):
 #-----------------------------------------------------------------------------------------------------------#
 
 
-def fill_gaps(symbol, market):
+# Returns False if any month failed to download (not a 404), so the pass should run again
+def fill_gaps(symbol, market, last_day=None):
     print(colored(f"Starting to fill gaps for {symbol} in {market} market.", 'blue'))
 
     # Get the first CSV date
@@ -249,26 +234,33 @@ def fill_gaps(symbol, market):
     # Convert dates to datetime objects
     first_date = datetime.strptime(first_csv_date, '%Y-%m')
     recent_date = datetime.strptime(recent_csv_date, '%Y-%m')
+    if last_day:
+        # Delisted: one last pass over every month up to the one it was last seen in, past the newest archive
+        last_month = datetime.now() - relativedelta(months=1)
+        recent_date = datetime(*min((last_day.year, last_day.month), (last_month.year, last_month.month)), 1)
 
     # Fill in the gaps
+    complete = True
     current_date = first_date
     while current_date <= recent_date:
         year_month_str = current_date.strftime('%Y-%m')
         logging.info(f"Checking for {symbol} in {market} for date {year_month_str}.")
-        if not record_exists(market, symbol, year_month_str):
+        if not get_coverage().is_month_covered((EXCHANGE, market, symbol), year_month_str):
             download_result = download_file(symbol, market, current_date.year, current_date.month)
             if download_result == "Data downloaded":
                 insert_new_file_record(market, symbol, year_month_str)
                 logging.info(f"Downloaded and inserted record for {symbol} {year_month_str} in {market}.")
             elif download_result == "No data":
                 logging.info(f"No data available for {symbol} {year_month_str} in {market}.")
+            elif download_result != "Data already downloaded":
+                complete = False
         current_date += relativedelta(months=1)
 
-    # Check for new data
-    while current_date < datetime.now() - relativedelta(months=1):
+    # Check for new data, a delisted symbol has none past its last month
+    while not last_day and current_date < datetime.now() - relativedelta(months=1):
         year_month_str = current_date.strftime('%Y-%m')
         logging.info(f"Checking for new data for {symbol} in {market} for date {year_month_str}.")
-        if not record_exists(market, symbol, year_month_str):
+        if not get_coverage().is_month_covered((EXCHANGE, market, symbol), year_month_str):
             download_result = download_file(symbol, market, current_date.year, current_date.month)
             if download_result == "Data downloaded":
                 insert_new_file_record(market, symbol, year_month_str)
@@ -279,19 +271,20 @@ def fill_gaps(symbol, market):
         current_date += relativedelta(months=1)
 
     print(colored(f"Completed filling gaps for {symbol} in {market} market.", 'blue'))
+    return complete
 
 
 #-----------------------------------------------------------------------------------------------------------#
 
 
-# Function to get all symbols
+# Function to get all symbols, as (trading, inactive)
 def get_all_symbols(market_type):
+    import requests
+
     print(f"Fetching symbols for {market_type} market...")
     try:
-        # Fetch symbols from API
-        response = requests.get(MARKET_TYPES[market_type])
-        response.raise_for_status()
-        data = response.json()
+        # Fetch symbols from API, through the shared symbol cache
+        data = fetch_json(MARKET_TYPES[market_type], extract=compact_binance_exchange_info)
 
         fetched_symbols = []
         if market_type == "spot":
@@ -301,25 +294,36 @@ def get_all_symbols(market_type):
         elif market_type == "coinm":
             fetched_symbols = [symbol['symbol'] for symbol in data['symbols']]
 
+        # Halted and settled symbols stay in exchangeInfo, only TRADING ones count as listed
+        trading_set = {
+            symbol['symbol'] for symbol in data['symbols']
+            if symbol.get('contractStatus', symbol.get('status')) == 'TRADING'
+        }
+        trading_symbols = [symbol for symbol in fetched_symbols if symbol in trading_set]
+        inactive_symbols = [symbol for symbol in fetched_symbols if symbol not in trading_set]
 
         print(f"Found {len(fetched_symbols)} trading symbols for {market_type} market.")
-        return fetched_symbols
+        return trading_symbols, inactive_symbols
 
     except requests.RequestException as e:
         print(f"Error fetching symbols for {market_type}: {e}")
-        return []
+        return [], []
     except KeyError as e:
         print(f"KeyError encountered while fetching symbols for {market_type}. Data may be missing or structured differently than expected.")
-        return []
+        return [], []
     except FileNotFoundError:
         print("JSON file with manual symbols not found.")
-        return fetched_symbols  # Return only API fetched symbols if JSON file is not found
+        return fetched_symbols, []  # Return only API fetched symbols if JSON file is not found
 
 
 #-----------------------------------------------------------------------------------------------------------#
 
 
 def download_file(symbol, market, year, month):
+    import zipfile
+    import requests
+    import http_pool
+
     csv_file_name = f"{symbol}-trades-{year}-{month:02}.csv"
     zip_file_dir = os.path.join(STORAGE_PATH, market, symbol)
     zip_file_path = os.path.join(zip_file_dir, f"{symbol}-trades-{year}-{month:02}.zip")
@@ -334,26 +338,30 @@ def download_file(symbol, market, year, month):
     # Ensure the directory for the zip file exists
     os.makedirs(zip_file_dir, exist_ok=True)
 
-    if os.path.isfile(os.path.join(zip_file_dir, csv_file_name)):
+    if find_stored(os.path.join(zip_file_dir, csv_file_name)):
         print(f"Data already downloaded for {symbol} {year}-{month}.")
         return "Data already downloaded"
 
+    # Skip archives Binance already told us it doesn't have
+    if get_negative_cache().is_known_missing(EXCHANGE, market, symbol, f"{year}-{month:02}"):
+        return "No data"
+
     url = f"{BASE_URL}/{market_url}/monthly/trades/{symbol}/{symbol}-trades-{year}-{month:02}.zip"
     print(f"URL for download: {url}")
 
     try:
-        response = requests.get(url, stream=True)
-        print(f"Response status code: {response.status_code}")
-        print(f"Response Content-Type: {response.headers.get('Content-Type')}")
-
-        if response.status_code == 200:
-            content_type = response.headers.get('Content-Type', '')
-            print(f"Content-Type: {content_type}")
-
-            with open(zip_file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
+        # The host slot is held until the body is on disk, extraction runs outside it
+        with http_pool.stream(url) as response:
+            status_code = response.status_code
+            print(f"Response status code: {status_code}")
+            print(f"Response Content-Type: {response.headers.get('Content-Type')}")
+
+            if status_code == 200:
+                with open(zip_file_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        f.write(chunk)
+
+        if status_code == 200:
             if zipfile.is_zipfile(zip_file_path):
                 with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
                     zip_ref.extractall(zip_file_dir)
@@ -363,9 +371,13 @@ def download_file(symbol, market, year, month):
             else:
                 print(f"Invalid ZIP file: {zip_file_path}")
                 os.remove(zip_file_path)
-                return "Invalid zip file" if response.status_code != 200 else "No data"
+                return "Invalid zip file" if status_code != 200 else "No data"
         else:
-            print(colored(f"No ZIP data found for {symbol} {year}-{month}, response code {response.status_code}", 'red'))
+            print(colored(f"No ZIP data found for {symbol} {year}-{month}, response code {status_code}", 'red'))
+            if status_code != 404:
+                # Throttled or a server error, not evidence the archive doesn't exist
+                return "Request failed"
+            get_negative_cache().record_missing(EXCHANGE, market, symbol, f"{year}-{month:02}", status_code)
             return "No data"
     except requests.RequestException as e:
         print(f"Request error for {symbol} {year}-{month}: {e}")
@@ -383,29 +395,28 @@ def download_file(symbol, market, year, month):
 
 # Main logic
 if __name__ == "__main__":
+      # Setup logging
+      logging.basicConfig(level=logging.INFO)
+
       # Get the list of downloaded files from the storage
       files_in_storage = scan_storage_for_csv_files(STORAGE_PATH)
 
-      # Get the list of downloaded records from the database
-      downloaded_records_db = get_downloaded_records_from_db()
-
-      # Delete records from the database that are not present in storage
-      for record in downloaded_records_db:
-          if (record[0], record[1], record[2]) not in [(f[0], f[1], f[2]) for f in files_in_storage]:
-              delete_record_from_db(*record)
-
-
-      # Insert new records for files present in storage but not in the database
-      for file_info in files_in_storage:
-          if (file_info[0], file_info[1], file_info[2]) not in [(r[0], r[1], r[2]) for r in downloaded_records_db]:
-              insert_new_file_record(*file_info)
+      # Bring the database in line with the files present in storage
+      inserted, deleted = get_catalog(DATABASE_NAME).reconcile("monthly", files_in_storage)
+      print(colored(f"Reconciled monthly records: {inserted} inserted, {deleted} deleted", 'yellow'))
 
 
       # Process symbols for each market type
       logging.info("Starting the CSV download and gap filling process.")
       for market_type in MARKET_TYPES.keys():
-          symbols = get_all_symbols(market_type)
-          for symbol in symbols:
-              first_csv(symbol, market_type)
-              fill_gaps(symbol, market_type)
+          symbols, inactive_symbols = get_all_symbols(market_type)
+          lifecycle = SymbolLifecycle(get_catalog(DATABASE_NAME))
+          lifecycle.observe(market_type, symbols, inactive_symbols=inactive_symbols)
+          for symbol, last_day in lifecycle.plan(market_type, symbols + inactive_symbols):
+              first_csv(symbol, market_type, last_day)
+              complete = fill_gaps(symbol, market_type, last_day)
+              if last_day and complete:
+                  # Delisted symbols get this one pass and are left alone afterwards, unless part of it failed
+                  lifecycle.finish_backfill(market_type, symbol)
+      get_negative_cache().report()
       logging.info("Process completed.")
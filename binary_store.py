@@ -0,0 +1,171 @@
+import os
+import time
+import bisect
+import argparse
+import threading
+from datetime import datetime
+from termcolor import colored
+
+from seek_index import iter_blocks, parse_block
+from trade_normalizer import parquet_path
+
+# Bits of the flags byte
+FLAG_BUYER_MAKER = 1
+
+
+# 33 bytes per trade, packed. Little-endian so the files move between machines as they are.
+def trade_dtype():
+    import numpy as np
+
+    return np.dtype([("trade_id", "<i8"), ("time", "<i8"), ("price", "<f8"), ("qty", "<f8"), ("flags", "u1")])
+
+
+# Next to the record's Parquet copy, same Hive partition
+def binary_path(adapter, market, pair, period):
+    return os.path.splitext(parquet_path(adapter, market, pair, period))[0] + ".npy"
+
+
+def to_records(table):
+    import numpy as np
+
+    records = np.empty(table.num_rows, dtype=trade_dtype())
+    for name in ("trade_id", "time", "price", "qty"):
+        records[name] = table[name].to_numpy()
+    records["flags"] = table["is_buyer_maker"].to_numpy().astype(np.uint8) * FLAG_BUYER_MAKER
+    return records
+
+
+# Common schema table of one record, from its Parquet copy when there is one, else block by block from the CSV
+def iter_tables(adapter, market, pair, period):
+    import pyarrow.parquet as pq
+
+    source = parquet_path(adapter, market, pair, period)
+    if os.path.exists(source):
+        parquet = pq.ParquetFile(source)
+        for group in range(parquet.num_row_groups):
+            yield parquet.read_row_group(group)
+        return
+    row = 0
+    for position, block in iter_blocks(adapter.find_file(market, pair, period) or adapter.file_path(market, pair, period)):
+        table = parse_block(block, adapter.exchange, market, row)
+        row += table.num_rows
+        yield table
+
+
+# Writes the record's trades as a time-sorted .npy. Returns the number of trades.
+def convert(adapter, market, pair, period):
+    import numpy as np
+
+    target = binary_path(adapter, market, pair, period)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    parts = [to_records(table) for table in iter_tables(adapter, market, pair, period)]
+    records = np.concatenate(parts) if parts else np.empty(0, dtype=trade_dtype())
+    if len(records) > 1 and (np.diff(records["time"]) < 0).any():
+        # Bitstamp snapshots come newest first
+        records = records[np.argsort(records["time"], kind="stable")]
+    with open(temp, 'wb') as file:
+        np.save(file, records)
+    os.replace(temp, target)
+    return len(records)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# A .npy trade file opened with np.memmap, nothing parsed or copied: slices are views into the page cache
+class BinaryTrades:
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.path = path
+        self.trades = np.load(path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.trades)
+
+    # Trades in [start_ms, end_ms), by binary search on the sorted time column. bisect rather than
+    # np.searchsorted, which copies the strided column out of the map first: this touches ~log2(n) pages.
+    def slice(self, start_ms, end_ms):
+        times = self.trades["time"]
+        first = bisect.bisect_left(times, start_ms)
+        last = bisect.bisect_left(times, end_ms, lo=first)
+        return self.trades[first:last]
+
+
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+# Memory maps stay open for the process, reopened when the file was rewritten
+def open_binary(path):
+    mtime = os.stat(path).st_mtime_ns
+    with _opened_lock:
+        opened = _opened.get(path)
+        if opened is None or opened[0] != mtime:
+            opened = _opened[path] = (mtime, BinaryTrades(path))
+        return opened[1]
+
+
+# Like load_trades, from the binary copies: one structured array (a zero-copy view when the range lies in
+# one file). Records without a binary copy are skipped, convert them first.
+def load_binary_trades(exchange, market, symbol, start, end, storage_root=None):
+    import numpy as np
+    from trade_dataset import as_datetime, get_dataset, overlapping, to_ms
+
+    start, end = as_datetime(start), as_datetime(end)
+    dataset = get_dataset(exchange, storage_root)
+    files = dataset.files(start, end, exchange, market, symbol).get((exchange, market, symbol.replace('/', '')), [])
+    start_ms, end_ms = to_ms(start), to_ms(end)
+    slices = []
+    for found in files:
+        path = binary_path(found.adapter, found.market, found.pair, found.period)
+        if os.path.exists(path):
+            slices.append(open_binary(path).slice(start_ms, end_ms))
+    if not slices:
+        return np.empty(0, dtype=trade_dtype())
+    if len(slices) == 1:
+        return slices[0]
+    trades = np.concatenate(slices)
+    if overlapping(files):
+        _, first = np.unique(trades["trade_id"], return_index=True)
+        trades = trades[np.sort(first)]
+        trades = trades[np.argsort(trades["time"], kind="stable")]
+    return trades
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    from exchange_adapters import ADAPTERS, select_adapters
+
+    parser = argparse.ArgumentParser(description="Write memory-mappable binary copies of hot symbols' trades.")
+    parser.add_argument("exchange", help=f"Exchange or feed: {', '.join(ADAPTERS)}")
+    parser.add_argument("market")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--start", help="Only periods from this YYYY-MM-DD on.")
+    parser.add_argument("--end", help="Only periods before this YYYY-MM-DD.")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    args = parser.parse_args()
+
+    for adapter_class in select_adapters([args.exchange]):
+        adapter = adapter_class(args.storage_root)
+        for symbol in args.symbols:
+            pair = adapter.trading_pair(symbol)
+            started = time.time()
+            converted = trades = 0
+            for period in sorted(adapter.catalog.get_dates_for_symbol(adapter.table, args.market, pair)):
+                period_start, period_end = adapter.period_span(period)
+                if (args.start and period_end <= datetime.fromisoformat(args.start)) or \
+                        (args.end and period_start >= datetime.fromisoformat(args.end)):
+                    continue
+                try:
+                    trades += convert(adapter, args.market, pair, period)
+                    converted += 1
+                except FileNotFoundError:
+                    continue
+            print(colored(f"{adapter.name} {args.market} {pair}: {converted} files, {trades} trades "
+                          f"in {time.time() - started:.1f}s", 'green'))
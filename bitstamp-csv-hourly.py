@@ -1,14 +1,15 @@
 #!/opt/homebrew/bin/python3
-import requests
-import pandas as pd
 import os
 import subprocess
 from datetime import datetime
 from termcolor import colored
-from dotenv import load_dotenv
+from catalog_backend import get_catalog
+from compressed_files import plain_name
+from symbol_lifecycle import SymbolLifecycle
+from symbol_universe import fetch_json, compact_bitstamp_pairs
 
-# Load the environment variables from your profile
-os.system('source ~/.bash_profile')
+# pandas, requests and dotenv are imported where they are used,
+# importing this module does no I/O and stays cheap for cron runs
 
 # Constants
 STORAGE_PATH = "/Volumes/rawPriceData/bitstamp/hourly"
@@ -17,31 +18,38 @@ BASE_URL = "https://www.bitstamp.net"
 MARKET_TYPES = {"spot"}
 
 
-load_dotenv()  # Load environment variables from .env file
+# MySQL credentials, read from .env on first use
+MYSQL_CONFIG = None
 
-MYSQL_HOST = os.getenv('MYSQL_HOST')
-MYSQL_USER = os.getenv('MYSQL_USER')
-MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
-MYSQL_DATABASE = os.getenv('MYSQL_DATABASE')
+def get_mysql_config():
+    global MYSQL_CONFIG
+    if MYSQL_CONFIG is None:
+        from dotenv import load_dotenv
+        load_dotenv()  # Load environment variables from .env file
+        MYSQL_CONFIG = {
+            "host": os.getenv('MYSQL_HOST'),
+            "user": os.getenv('MYSQL_USER'),
+            "password": os.getenv('MYSQL_PASSWORD'),
+            "database": os.getenv('MYSQL_DATABASE'),
+        }
+    return MYSQL_CONFIG
+
+
+# Catalog connection using the credentials from .env. MYSQL_DATABASE only picks the MySQL schema,
+# the catalog stays bitstamp_csvs so its snapshot times keep their DATETIME handling.
+def get_bitstamp_catalog():
+    config = get_mysql_config()
+    return get_catalog(
+        DATABASE_NAME,
+        mysql_path="/opt/homebrew/bin/mysql",
+        connection_args=["-h", config["host"], "-u", config["user"], "-p" + (config["password"] or "")],  # Note: no space between -p and password
+        schema=config["database"]
+    )
 
 
 # Function to run SQL commands and return the result
 def run_sql_command(sql_command):
-    mysql_path = "/opt/homebrew/bin/mysql"
-    cmd = [
-        mysql_path,
-        "-h", MYSQL_HOST,
-        "-u", MYSQL_USER,
-        "-p" + MYSQL_PASSWORD,  # Note: no space between -p and password
-        "-e", sql_command,
-        MYSQL_DATABASE
-    ]
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print("MySQL error:", e.stderr)
-        raise  # Optionally re-raise the error if you want to stop the script
+    return get_bitstamp_catalog().run_sql(sql_command)
 
 
 #-----------------------------------------------------------------------------------------------------------#
@@ -86,7 +94,8 @@ def insert_new_file_record(market, trading_pair, date_str):
 def scan_storage_for_csv_files(storage_path):
     files_info = []
     for root, dirs, files in os.walk(storage_path):
-        for file in files:
+        # Kept archives and recompressed files count as the CSV they hold
+        for file in map(plain_name, files):
             if file.endswith('.csv'):
                 try:
                     # Extracting symbol, date, and time from the filename
@@ -112,22 +121,24 @@ def scan_storage_for_csv_files(storage_path):
 
 
 def get_all_symbols(market_type):
+    import requests
+
     url = "https://www.bitstamp.net/api/v2/trading-pairs-info/"
-    response = requests.get(url)
-    if response.status_code == 200:
-        trading_pairs_info = response.json()
-        # Fetch all symbols where trading is enabled
-        symbols = [pair['url_symbol'] for pair in trading_pairs_info if pair['trading'] == "Enabled"]
-        return symbols
-    else:
-        print(f"Failed to retrieve data: {response.status_code}")
-        print("Response:", response.text)
+    try:
+        trading_pairs_info = fetch_json(url, extract=compact_bitstamp_pairs)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Failed to retrieve data: {e}")
         return None
+    # Fetch all symbols where trading is enabled
+    symbols = [pair['url_symbol'] for pair in trading_pairs_info if pair['trading'] == "Enabled"]
+    return symbols
 
 
 def fetch_data(symbol, time_frame):
+    import http_pool
+
     url = f"{BASE_URL}/api/v2/transactions/{symbol}/?time={time_frame}"
-    response = requests.get(url)
+    response = http_pool.get(url)
     if response.status_code == 200:
         return response.json()
     else:
@@ -136,6 +147,8 @@ def fetch_data(symbol, time_frame):
 
 
 def process_and_store_data(data, symbol, time_frame, market):
+    import pandas as pd
+
     # Capitalize the symbol for the folder name
     capitalized_symbol = symbol.upper()
 
@@ -175,22 +188,15 @@ if __name__ == "__main__":
     files_in_storage = scan_storage_for_csv_files(STORAGE_PATH)
     print(f"Files in storage: {files_in_storage}")
 
-    downloaded_records_db = get_downloaded_records_from_db()
-    print(f"Downloaded records from DB: {downloaded_records_db}")
-
-    # Delete records from the database that are not present in storage
-    for record in downloaded_records_db:
-        if (record[0], record[1], record[2]) not in [(f[0], f[1], f[2]) for f in files_in_storage]:
-            delete_record_from_db(*record)
-
-    # Insert new records for files present in storage but not in the database
-    for file_info in files_in_storage:
-        if (file_info[0], file_info[1], file_info[2]) not in [(r[0], r[1], r[2]) for r in downloaded_records_db]:
-            insert_new_file_record(*file_info)
+    # Bring the database in line with the files present in storage
+    inserted, deleted = get_bitstamp_catalog().reconcile("hourly", files_in_storage)
+    print(colored(f"Reconciled hourly records: {inserted} inserted, {deleted} deleted", 'yellow'))
 
     for market_type in MARKET_TYPES:
         symbols = get_all_symbols(market_type)
         print(f"Fetched symbols for {market_type}: {symbols}")
+        # Files are stored under the upper-cased symbol, track the lifecycle the same way
+        SymbolLifecycle(get_bitstamp_catalog()).observe(market_type, [symbol.upper() for symbol in symbols or []])
         if symbols:
             for symbol in symbols:
                 time_frame = 'hour'
@@ -1,20 +1,22 @@
-import subprocess
-import pandas as pd
-import requests
 import os
-import gzip
-import shutil
 from termcolor import colored
+from catalog_backend import get_catalog
+from compressed_files import find_stored, plain_name
+from negative_cache import get_negative_cache
+from symbol_lifecycle import SymbolLifecycle
+from symbol_universe import fetch_json, compact_bybit_tickers
 from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
-import json
 import time
-import glob
+
+# pandas, requests and numpy (coverage_index) are imported where they are used,
+# importing this module does no I/O and stays cheap for cron runs
 
 
 # Constants
 STORAGE_PATH = "/Volumes/rawPriceData/bybit/daily"
 DATABASE_NAME = "bybit_csvs"
+EXCHANGE = "bybit"
 
 
 MARKET_TYPES = {
@@ -25,46 +27,22 @@ MARKET_TYPES = {
 
 # Function to run SQL commands and return the result
 def run_sql_command(sql_command):
-    cmd = [
-        "mysql",
-        "--login-path=client",
-        "-e",
-        sql_command,
-        DATABASE_NAME
-    ]
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print("MySQL error:", e.stderr)
-        raise  # Optionally re-raise the error if you want to stop the script
+    return get_catalog(DATABASE_NAME).run_sql(sql_command)
 
 
-#-----------------------------------------------------------------------------------------------------------#
-
+# Day coverage of the daily and monthly tables, built once per run and kept current on insert
+COVERAGE = None
 
-# Returns all monthlys which are dailys that have been aggregated
-def get_aggregated_monthly_records():
-    sql_command = "SELECT market, trading_pair, date FROM monthly;"
-    aggregated_records = run_sql_command(sql_command)
-    return [tuple(line.split("\t")) for line in aggregated_records.split("\n")[1:]]
+def get_coverage():
+    global COVERAGE
+    if COVERAGE is None:
+        from coverage_index import CoverageIndex
+        COVERAGE = CoverageIndex.from_catalog(get_catalog(DATABASE_NAME), EXCHANGE)
+    return COVERAGE
 
 
-# Function to get the list of downloaded records from the database
-def get_downloaded_records_from_db():
-    sql_command = "SELECT market, trading_pair, date FROM daily;"
-    downloaded_records = run_sql_command(sql_command)
-    # Parse the output into a list of tuples (market, trading_pair, date)
-    return [tuple(line.split("\t")) for line in downloaded_records.split("\n")[1:]]
+#-----------------------------------------------------------------------------------------------------------#
 
-# Function to delete the database record for files not found
-def delete_record_from_db(market, trading_pair, date_str):
-    sql_command = f"""
-    DELETE FROM daily
-    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND date = '{date_str}';
-    """
-    print(colored(f"Deleted from DB: {record}", 'yellow'))
-    run_sql_command(sql_command)
 
 # Function to insert new file records into the database
 def insert_new_file_record(market, trading_pair, date_str):
@@ -77,6 +55,8 @@ def insert_new_file_record(market, trading_pair, date_str):
     """
     print(colored(f"Data inserted {market}, {formatted_trading_pair}, {date_str}", 'cyan'))
     run_sql_command(sql_command)
+    if COVERAGE is not None:
+        COVERAGE.add_days((EXCHANGE, market, formatted_trading_pair), [date_str])
 
 
 # Update first_csv boolean to true
@@ -84,7 +64,7 @@ def update_first_csv(market, trading_pair):
     find_oldest_sql = f"""
     SELECT date FROM daily
     WHERE market = '{market}' AND trading_pair = '{trading_pair}'
-    ORDER BY date ASC
+    ORDER BY period_start ASC
     LIMIT 1;
     """
     oldest_date_result = run_sql_command(find_oldest_sql)
@@ -108,7 +88,8 @@ def update_first_csv(market, trading_pair):
 def scan_storage_for_csv_files(storage_path):
     files_info = []  # Holds information about the files
     for root, dirs, files in os.walk(storage_path):
-        for file in files:
+        # Kept archives and recompressed files count as the CSV they hold
+        for file in map(plain_name, files):
             if file.endswith('.csv'):
                 # Splitting by underscore and dash to extract the symbol and date
                 parts = file.split('_')
@@ -133,6 +114,8 @@ def scan_storage_for_csv_files(storage_path):
 
 
 def load_csv_to_dataframe(file_path):
+    import pandas as pd
+
     try:
         # Read the first row to determine if it's a header
         with open(file_path, 'r') as file:
@@ -177,15 +160,18 @@ def get_first_csv_daily(market, symbol):
     sql_command = f"""
     SELECT date FROM daily
     WHERE market = '{market}' AND trading_pair = '{symbol}' AND first_csv = '1'
-    ORDER BY date ASC
+    ORDER BY period_start ASC
     LIMIT 1;
     """
     result = run_sql_command(sql_command)
     return result.split('\n')[1].strip() if result else None
 
 
-def get_first_csv_monthly():
-    sql_command = "SELECT date FROM monthly WHERE first_csv = '1' ORDER BY date ASC LIMIT 1;"
+def get_first_csv_monthly(market, symbol):
+    sql_command = f"""SELECT date FROM monthly
+    WHERE market = '{market}' AND trading_pair = '{symbol}' AND first_csv = '1'
+    ORDER BY period_start ASC
+    LIMIT 1;"""
     result = run_sql_command(sql_command)
     return result.split('\n')[1].strip() if result else None
 
@@ -193,7 +179,7 @@ def get_first_csv_monthly():
 # Function to get the earliest 'first_csv' date from both daily and monthly datasets
 def get_all_first_csv_dates(market, symbol):
     daily_first_csv_date = get_first_csv_daily(market, symbol)
-    monthly_first_csv_date = get_first_csv_monthly()
+    monthly_first_csv_date = get_first_csv_monthly(market, symbol)
 
     # Parse dates and find the earliest
     daily_date = datetime.strptime(daily_first_csv_date, '%Y-%m-%d') if daily_first_csv_date else None
@@ -224,14 +210,10 @@ def collect_download_tasks():
     for market_type in MARKET_TYPES.keys():
         symbols = get_all_symbols(market_type)
         for symbol in symbols:
-            downloaded_dates = get_downloaded_dates_for_symbol(market_type, symbol)
-            current_date = date.today().replace(day=1)
+            start_date = date.today().replace(day=1)
             end_date = date.today() - timedelta(days=1)
-            while current_date <= end_date:
-                date_str = current_date.strftime('%Y-%m-%d')
-                if date_str not in downloaded_dates:
-                    tasks.append((symbol, market_type, date_str))
-                current_date += timedelta(days=1)
+            for missing_date in get_coverage().missing_days((EXCHANGE, market_type, symbol.replace("/", "")), start_date, end_date):
+                tasks.append((symbol, market_type, missing_date.strftime('%Y-%m-%d')))
     return tasks
 
 
@@ -240,74 +222,70 @@ def collect_download_tasks():
 
 def get_all_symbols(category):
     """Fetch all tickers for a given category using the provided API endpoint."""
+    import requests
+
     url = f"https://api-testnet.bybit.com/v5/market/tickers?category={category}"
 
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            if 'retCode' in data and data['retCode'] == 0:
-                if 'result' in data and 'list' in data['result']:
-                    symbols = [item['symbol'] for item in data['result']['list']]
-                    return sorted(symbols)  # Sort the symbols alphabetically
-                else:
-                    print(f"Unexpected JSON structure in 'result': {data}")
-            else:
-                print(f"API returned error: {data.get('retMsg', 'No error message')}")
-        else:
-            print(f"Unsuccessful response from server: {response.status_code}")
-            print(response.text)
+        # Shared symbol cache, error answers from the API raise ValueError
+        data = fetch_json(url, extract=compact_bybit_tickers)
+        symbols = [item['symbol'] for item in data['result']['list']]
+        return sorted(symbols)  # Sort the symbols alphabetically
     except requests.exceptions.RequestException as e:
         print(f"An error occurred: {e}")
-    except json.JSONDecodeError as json_error:
-        print(f"Failed to parse JSON: {json_error}")
+    except ValueError as error:
+        print(f"Failed to parse tickers: {error}")
 
     return None  # Return None in case of any failure
 
-# Fetch and sort tickers for each category
-categories = ["spot", "linear", "inverse"]
-all_tickers = {category: get_all_symbols(category) for category in categories}
+# Fetch and print sorted tickers for each category, the symbol cache makes the later per-market fetch free
+def print_all_tickers(categories=("spot", "linear", "inverse")):
+    all_tickers = {category: get_all_symbols(category) for category in categories}
 
-print(colored("All Tickers for BYBIT:", 'magenta'))
-for category, symbols in all_tickers.items():
-    print(f"{category}: {symbols}")
-
-# Convert to JSON string if needed
-json_output = json.dumps(all_tickers, indent=4)
+    print(colored("All Tickers for BYBIT:", 'magenta'))
+    for category, symbols in all_tickers.items():
+        print(f"{category}: {symbols}")
+    return all_tickers
 
 
 #-----------------------------------------------------------------------------------------------------------#
 
 
 def download_file(symbol, market, date_str):
+    import gzip
+    import shutil
+    import http_pool
 
-    # Check if the file has already been downloaded by querying the database
-    downloaded_records = get_downloaded_records_from_db()
-    record = (market, symbol, date_str)
-
-    if record in [(r[0], r[1], r[2]) for r in downloaded_records]:
+    # Check if the file has already been downloaded against the catalog coverage
+    if get_coverage().is_covered((EXCHANGE, market, symbol), date_str):
         print(f"Data for {symbol} on {date_str} has already been downloaded.")
         return "Data already downloaded"
 
+    # Skip archives the exchange already told us it doesn't have
+    if get_negative_cache().is_known_missing(EXCHANGE, market, symbol, date_str):
+        return "Known missing"
 
     file_url = f"{MARKET_TYPES[market]}/{symbol}/{symbol}_{date_str}.csv.gz"
     file_path = os.path.join(STORAGE_PATH, market, symbol, f"{symbol}_{date_str}.csv")
 
-    # Check if the uncompressed file already exists to avoid re-downloading
-    if os.path.exists(file_path):
+    # Check if the file already exists, extracted or kept compressed, to avoid re-downloading
+    if find_stored(file_path):
         print(f"Data for {symbol} on {date_str} has already been downloaded and extracted.")
         return "Failed to download data"
 
     # Ensure directory exists
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-    # Download the gzip file
-    response = requests.get(file_url, stream=True)
-    if response.status_code == 200:
-        gzip_file_path = file_path + '.gz'
-        with open(gzip_file_path, 'wb') as f:
-            f.write(response.content)
+    # Download the gzip file. The host slot is held until the body is on disk, decompression runs outside it
+    gzip_file_path = file_path + '.gz'
+    with http_pool.stream(file_url) as response:
+        status_code = response.status_code
+        if status_code == 200:
+            with open(gzip_file_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
 
+    if status_code == 200:
         # Decompress the gzip file
         with gzip.open(gzip_file_path, 'rb') as f_in:
             with open(file_path, 'wb') as f_out:
@@ -325,7 +303,10 @@ def download_file(symbol, market, date_str):
         insert_new_file_record(market, symbol, date_str)
         return "Data downloaded and saved"
     else:
-        print(colored(f"No data found at {file_url} (HTTP status code: {response.status_code})", 'red'))
+        print(colored(f"No data found at {file_url} (HTTP status code: {status_code})", 'red'))
+        if status_code != 404:
+            return "Request failed"
+        get_negative_cache().record_missing(EXCHANGE, market, symbol, date_str, status_code)
         return "No new data"
 
 
@@ -334,73 +315,86 @@ def download_file(symbol, market, date_str):
 
 # Function to process the symbols with threading
 def process_symbols(market_type, executor):
-    symbols = get_all_symbols(market_type)
-    aggregated_monthly_records = get_aggregated_monthly_records()
-    aggregated_months = {(record[0], record[1], record[2][:7]) for record in aggregated_monthly_records}
-
-    for symbol in symbols:
-        earliest_first_csv_date_str = get_all_first_csv_dates(market_type, symbol.replace("/", ""))
-        earliest_first_csv_date = datetime.strptime(earliest_first_csv_date_str, '%Y-%m-%d') if earliest_first_csv_date_str else None
-        current_date = datetime.combine(date.today() - timedelta(days=1), datetime.min.time())
+    from coverage_index import EPOCH as COVERAGE_EPOCH
+
+    symbols = get_all_symbols(market_type) or []
+    lifecycle = SymbolLifecycle(get_catalog(DATABASE_NAME))
+    lifecycle.observe(market_type, symbols)
+    coverage = get_coverage()
+
+    for symbol, last_day in lifecycle.plan(market_type, symbols):
+        trading_pair = symbol.replace("/", "")
+        earliest_first_csv_date_str = get_all_first_csv_dates(market_type, trading_pair)
+        # Walk back no further than the first csv, or the start of the coverage bitmaps
+        start_date = datetime.strptime(earliest_first_csv_date_str, '%Y-%m-%d').date() if earliest_first_csv_date_str else COVERAGE_EPOCH
+        end_date = date.today() - timedelta(days=1)
+        if last_day:
+            # Final pass for a delisted symbol, bounded to the weeks before it disappeared
+            end_date = min(last_day, end_date)
+            start_date = max(start_date, lifecycle.backfill_start(last_day))
         no_new_data_days = 0
-        downloaded_dates = set(get_downloaded_dates_for_symbol(market_type, symbol.replace("/", "")))
+        failed = False
 
-        while True:
+        # Newest first. Downloaded days and aggregated months are already set in the bitmap.
+        missing_dates = coverage.missing_days((EXCHANGE, market_type, trading_pair), start_date, end_date)
+        for current_date in reversed(missing_dates):
             date_str = current_date.strftime('%Y-%m-%d')
-            month_str = current_date.strftime('%Y-%m')
 
-            # Skip processing for dates earlier than the earliest first_csv date
-            if earliest_first_csv_date and current_date < earliest_first_csv_date:
-                break
-
-            if (market_type, symbol.replace("/", ""), month_str) in aggregated_months:
-                print(f"Skipping {date_str} for {symbol} as monthly data already aggregated.")
-                current_date = current_date.replace(day=1) - timedelta(days=1)
-                continue
-
-            if date_str not in downloaded_dates:
-                retry_count = 0
-                while retry_count < 2:
-                    result = download_file(symbol, market_type, date_str)
-
-                    if result == "No new data":
-                        print('a.1')
-                        time.sleep(3)  # Wait for 3 seconds before retrying
-                        retry_count += 1
-
-                    elif result == "Data downloaded and saved":
-                        print('b')
+            retry_count = 0
+            request_failures = 0
+            while retry_count < 2:
+                result = download_file(symbol, market_type, date_str)
+
+                if result == "Known missing":
+                    retry_count = 2  # Nothing to retry, counts as a day without data
+                    break
+
+                elif result == "No new data":
+                    print('a.1')
+                    time.sleep(3)  # Wait for 3 seconds before retrying
+                    retry_count += 1
+
+                elif result == "Data downloaded and saved":
+                    print('b')
+                    no_new_data_days = 0
+                    break
+
+                elif result == "Failed to download data":
+                    time.sleep(3)  # Wait for 3 seconds
+                    print('c')
+                    result = download_file(symbol, market_type, date_str)  # Retry download
+                    if result == "Data downloaded and saved":
                         no_new_data_days = 0
-                        downloaded_dates.add(date_str)
                         break
+                    elif result == "No new data":
+                        print('a.2')
+                        retry_count += 1
 
-                    elif result == "Failed to download data":
-                        time.sleep(3)  # Wait for 3 seconds
-                        print('c')
-                        result = download_file(symbol, market_type, date_str)  # Retry download
-                        if result == "Data downloaded and saved":
-                            no_new_data_days = 0
-                            downloaded_dates.add(date_str)
-                            break
-                        elif result == "No new data":
-                            print('a.2')
-                            retry_count += 1
-
-                    else:
-                        print('d')
+                elif result == "Request failed":
+                    # Throttled or a server error, which says nothing about whether the day has data
+                    request_failures += 1
+                    if request_failures == 2:
                         break
+                    time.sleep(3)
 
-                if retry_count == 2:
-                    no_new_data_days += 1
-                    if no_new_data_days >= 3:
-                        # Update the first CSV flag if three consecutive days with no new data
-                        update_first_csv(market_type, symbol.replace("/", ""))
-                        break
+                else:
+                    print('d')
+                    break
+
+            if result == "Request failed":
+                failed = True
+                continue
 
-            current_date -= timedelta(days=1)
+            if retry_count == 2:
+                no_new_data_days += 1
+                if no_new_data_days >= 3:
+                    # Update the first CSV flag if three consecutive days with no new data
+                    update_first_csv(market_type, trading_pair)
+                    break
 
-            if current_date < datetime.strptime('2000-01-01', '%Y-%m-%d'):  # Safety check
-                break
+        # A failed day would be skipped for good once the backfill is closed
+        if last_day and not failed:
+            lifecycle.finish_backfill(market_type, symbol)
 
 
 #-----------------------------------------------------------------------------------------------------------#
@@ -409,23 +403,18 @@ def process_symbols(market_type, executor):
 
 # Main logic
 if __name__ == "__main__":
+    print_all_tickers()
+
     # Get the list of downloaded files from the storage
     files_in_storage = scan_storage_for_csv_files(STORAGE_PATH)
 
-    # Get the list of downloaded records from the database
-    downloaded_records_db = get_downloaded_records_from_db()
-
-    # Delete records from the database that are not present in storage
-    for record in downloaded_records_db:
-        if (record[0], record[1], record[2]) not in [(f[0], f[1], f[2]) for f in files_in_storage]:
-            delete_record_from_db(*record)
-
-    # Insert new records for files present in storage but not in the database
-    for file_info in files_in_storage:
-        if (file_info[0], file_info[1], file_info[2]) not in [(r[0], r[1], r[2]) for r in downloaded_records_db]:
-            insert_new_file_record(*file_info)
+    # Bring the database in line with the files present in storage
+    inserted, deleted = get_catalog(DATABASE_NAME).reconcile("daily", files_in_storage)
+    print(colored(f"Reconciled daily records: {inserted} inserted, {deleted} deleted", 'yellow'))
 
     # Use threading to download files
     with ThreadPoolExecutor(max_workers=15) as executor:
         for market_type in MARKET_TYPES.keys():
             process_symbols(market_type, executor)
+
+    get_negative_cache().report()
@@ -0,0 +1,536 @@
+import subprocess
+import sqlite3
+import threading
+import calendar
+import os
+import time
+import argparse
+import tempfile
+from termcolor import colored
+
+from catalog_schema import CATALOG_TABLES, DATETIME_DATABASES, LIFECYCLE_TABLE, SHARD_LEASE_TABLE, TRADE_ID_GAP_TABLE
+
+# Which backend get_catalog() hands out: "mysql" (default) or "sqlite"
+CATALOG_BACKEND = os.getenv('CATALOG_BACKEND', 'mysql')
+CATALOG_SQLITE_DIR = os.getenv('CATALOG_SQLITE_DIR', os.path.expanduser("~/.readysetliqd"))
+
+INSERT_BATCH_SIZE = 1000
+
+
+# Common interface for the CSV catalogs. Subclasses provide query/execute/run_sql,
+# everything the scripts do with the catalog is built on top of those.
+class CatalogBackend:
+    insert_ignore = "INSERT IGNORE"
+
+    def __init__(self, database_name):
+        self.database_name = database_name
+        # Bitstamp's periods are snapshot times, bounds on them need a time of day
+        self.datetime_periods = database_name in DATETIME_DATABASES
+
+    def query(self, sql, params=()):
+        raise NotImplementedError
+
+    def execute(self, sql, params=()):
+        raise NotImplementedError
+
+    def execute_many(self, statements):
+        raise NotImplementedError
+
+    # Run raw SQL and return it formatted like `mysql -e` output (header line, tab separated rows)
+    def run_sql(self, sql_command):
+        raise NotImplementedError
+
+    #-------------------------------------------------------------------------------------------------------#
+
+    def get_records(self, table, columns=("market", "trading_pair", "date")):
+        return self.query(f"SELECT {', '.join(columns)} FROM {table};")
+
+    def record_exists(self, table, market, trading_pair, date_str):
+        rows = self.query(
+            f"SELECT COUNT(*) FROM {table} WHERE market = ? AND trading_pair = ? AND date = ?;",
+            (market, trading_pair, date_str))
+        return int(rows[0][0]) > 0
+
+    def get_dates_for_symbol(self, table, market, trading_pair):
+        rows = self.query(
+            f"SELECT date FROM {table} WHERE market = ? AND trading_pair = ?;",
+            (market, trading_pair))
+        return [row[0] for row in rows]
+
+    # Oldest and newest date held for a symbol, optionally only among first_csv rows
+    def get_date_bounds(self, table, market, trading_pair, first_csv_only=False):
+        first_csv_filter = " AND first_csv = 1" if first_csv_only else ""
+        rows = self.query(
+            f"SELECT MIN(date), MAX(date) FROM {table} WHERE market = ? AND trading_pair = ?{first_csv_filter};",
+            (market, trading_pair))
+        return rows[0] if rows else (None, None)
+
+    def get_first_csv(self, table, market, trading_pair):
+        rows = self.query(
+            f"""SELECT date FROM {table}
+            WHERE market = ? AND trading_pair = ? AND first_csv = 1
+            ORDER BY period_start ASC LIMIT 1;""",
+            (market, trading_pair))
+        return rows[0][0] if rows else None
+
+    # Flag the given date (or the oldest one on record) as the symbol's first csv
+    def mark_first_csv(self, table, market, trading_pair, date_str=None):
+        if date_str is None:
+            date_str = self.get_date_bounds(table, market, trading_pair)[0]
+            if date_str is None:
+                return None
+        self.execute(
+            f"UPDATE {table} SET first_csv = 1 WHERE market = ? AND trading_pair = ? AND date = ?;",
+            (market, trading_pair, date_str))
+        return date_str
+
+    # Records are (market, trading_pair, date) with an optional fourth file size in bytes and fifth codec
+    # of the stored file (None for a plain CSV)
+    def insert_records(self, table, records, first_csv=False):
+        statements = []
+        records = list(records)
+        for start in range(0, len(records), INSERT_BATCH_SIZE):
+            batch = records[start:start + INSERT_BATCH_SIZE]
+            values = ", ".join("(?, ?, ?, 0, 0, 0, ?, ?, ?)" for _ in batch)
+            params = []
+            for record in batch:
+                market, trading_pair, date_str = record[:3]
+                size = record[3] if len(record) > 3 else None
+                codec = record[4] if len(record) > 4 else None
+                params.extend((market, trading_pair.replace('/', ''), date_str, int(first_csv), size, codec))
+            statements.append((
+                f"{self.insert_ignore} INTO {table} "
+                f"(market, trading_pair, date, normalized, inserted_to_psql, is_delisted, first_csv, size_bytes, codec) "
+                f"VALUES {values};", params))
+        self.execute_many(statements)
+
+    # Records still without a file size
+    def get_unsized(self, table):
+        return self.query(f"SELECT market, trading_pair, date FROM {table} WHERE size_bytes IS NULL;")
+
+    # (market, trading_pair, date, size) for rows whose file size is now known
+    def set_sizes(self, table, records):
+        statements = [
+            (f"UPDATE {table} SET size_bytes = ? WHERE market = ? AND trading_pair = ? AND date = ?;",
+             (size, market, trading_pair, date_str))
+            for market, trading_pair, date_str, size in records
+        ]
+        for start in range(0, len(statements), INSERT_BATCH_SIZE):
+            self.execute_many(statements[start:start + INSERT_BATCH_SIZE])
+
+    # Records not stored as zstd yet whose period started before a 'YYYY-MM-DD' day, oldest first
+    def get_cold_records(self, table, before):
+        return self.query(
+            f"SELECT market, trading_pair, date FROM {table} "
+            f"WHERE (codec IS NULL OR codec <> 'zstd') AND period_start < ? ORDER BY period_start;", (before,))
+
+    # (market, trading_pair, date, codec, size) for files rewritten in another stored form
+    def set_codecs(self, table, records):
+        statements = [
+            (f"UPDATE {table} SET codec = ?, size_bytes = ? WHERE market = ? AND trading_pair = ? AND date = ?;",
+             (codec, size, market, trading_pair, date_str))
+            for market, trading_pair, date_str, codec, size in records
+        ]
+        for start in range(0, len(statements), INSERT_BATCH_SIZE):
+            self.execute_many(statements[start:start + INSERT_BATCH_SIZE])
+
+    # (market, trading_pair, date, normalized, size_bytes, codec) of the records whose period starts between two 'YYYY-MM-DD'
+    # days, inclusive, oldest first. With market and trading_pair given it is a (market, trading_pair,
+    # period_start) index range, and on year-partitioned MySQL tables only the years in range are read.
+    def get_records_between(self, table, start, end, market=None, trading_pair=None):
+        if self.datetime_periods:
+            start, end = f"{start} 00:00:00", f"{end} 23:59:59"
+        conditions, params = [], []
+        for column, value in (("market", market), ("trading_pair", trading_pair)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        conditions.append("period_start BETWEEN ? AND ?")
+        return self.query(
+            f"SELECT market, trading_pair, date, normalized, size_bytes, codec FROM {table} "
+            f"WHERE {' AND '.join(conditions)} ORDER BY period_start;", (*params, start, end))
+
+    # Records whose file has no normalized Parquet copy yet
+    def get_unnormalized(self, table):
+        return self.query(f"SELECT market, trading_pair, date FROM {table} WHERE normalized IS NULL OR normalized = 0;")
+
+    # Flip `normalized` for (market, trading_pair, date) records
+    def set_normalized(self, table, records, normalized=True):
+        statements = [
+            (f"UPDATE {table} SET normalized = ? WHERE market = ? AND trading_pair = ? AND date = ?;",
+             (int(normalized), market, trading_pair, date_str))
+            for market, trading_pair, date_str in records
+        ]
+        for start in range(0, len(statements), INSERT_BATCH_SIZE):
+            self.execute_many(statements[start:start + INSERT_BATCH_SIZE])
+
+    # Records whose trade ids were never checked (id_continuity.py), oldest first
+    def get_unchecked_ids(self, table):
+        return self.query(
+            f"SELECT market, trading_pair, date FROM {table} WHERE id_breaks IS NULL ORDER BY period_start;")
+
+    # (market, trading_pair, date, first_id, last_id, id_breaks) of checked files, ids None for a file without trades
+    def set_id_checks(self, table, records):
+        statements = [
+            (f"UPDATE {table} SET first_id = ?, last_id = ?, id_breaks = ? "
+             f"WHERE market = ? AND trading_pair = ? AND date = ?;",
+             (first_id, last_id, breaks, market, trading_pair, date_str))
+            for market, trading_pair, date_str, first_id, last_id, breaks in records
+        ]
+        for start in range(0, len(statements), INSERT_BATCH_SIZE):
+            self.execute_many(statements[start:start + INSERT_BATCH_SIZE])
+
+    # (date, first_id, last_id) of a pair's checked files that hold trades, oldest first
+    def get_id_ranges(self, table, market, trading_pair):
+        return self.query(
+            f"SELECT date, first_id, last_id FROM {table} "
+            f"WHERE market = ? AND trading_pair = ? AND first_id IS NOT NULL ORDER BY period_start;",
+            (market, trading_pair))
+
+    # Average file size per (market, trading_pair), a proxy for how much a symbol trades
+    def get_volumes(self, table):
+        rows = self.query(
+            f"SELECT market, trading_pair, AVG(size_bytes) FROM {table} "
+            f"WHERE size_bytes IS NOT NULL GROUP BY market, trading_pair;")
+        return {(row[0], row[1]): float(row[2]) for row in rows}
+
+    def delete_records(self, table, records):
+        statements = []
+        records = list(records)
+        for start in range(0, len(records), INSERT_BATCH_SIZE):
+            batch = records[start:start + INSERT_BATCH_SIZE]
+            values = ", ".join("(?, ?, ?)" for _ in batch)
+            params = [value for record in batch for value in record[:3]]
+            statements.append((f"DELETE FROM {table} WHERE (market, trading_pair, date) IN ({values});", params))
+        self.execute_many(statements)
+
+    # Set of (market, trading_pair, 'YYYY-MM') held in a table
+    def get_months(self, table):
+        return {(row[0], row[1], row[2][:7]) for row in self.get_records(table)}
+
+    # Replace a month of daily rows by one monthly row in a single transaction
+    def rollup_month(self, market, trading_pair, month, first_csv=False):
+        trading_pair = trading_pair.replace('/', '')
+        start_date = f"{month}-01"
+        end_date = f"{month}-{calendar.monthrange(int(month[:4]), int(month[5:]))[1]}"
+        if self.datetime_periods:
+            end_date += " 23:59:59"
+        self.execute_many([
+            (f"{self.insert_ignore} INTO monthly "
+             "(market, trading_pair, date, normalized, inserted_to_psql, is_delisted, first_csv, size_bytes) "
+             "SELECT ?, ?, ?, 0, 0, 0, ?, SUM(size_bytes) FROM daily "
+             "WHERE market = ? AND trading_pair = ? AND period_start BETWEEN ? AND ?;",
+             (market, trading_pair, month, int(first_csv), market, trading_pair, start_date, end_date)),
+            ("DELETE FROM daily WHERE market = ? AND trading_pair = ? AND period_start BETWEEN ? AND ?;",
+             (market, trading_pair, start_date, end_date)),
+        ])
+
+    # Bring the table in line with what is on disk; returns (inserted, deleted). With delete=False rows
+    # without a file are kept, for storage that only holds part of what the catalog describes.
+    def reconcile(self, table, files_in_storage, delete=True):
+        on_disk = {tuple(f[:3]) for f in files_in_storage}
+        in_db = {tuple(r[:3]) for r in self.get_records(table)}
+        stale = in_db - on_disk if delete else set()
+        missing = on_disk - in_db
+        if stale:
+            self.delete_records(table, sorted(stale))
+        if missing:
+            self.insert_records(table, sorted(missing))
+        return len(missing), len(stale)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def quote_mysql(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+# Catalog reached through the mysql client, exactly like the scripts always did. `schema` is the MySQL
+# database to connect to when the server names it differently from the catalog (Bitstamp's MYSQL_DATABASE).
+class MySQLCatalog(CatalogBackend):
+
+    def __init__(self, database_name, mysql_path="mysql", connection_args=("--login-path=client",), schema=None):
+        super().__init__(database_name)
+        self.mysql_path = mysql_path
+        self.connection_args = list(connection_args)
+        self.schema = schema or database_name
+
+    def bind(self, sql, params):
+        if not params:
+            return sql
+        parts = sql.split("?")
+        if len(parts) - 1 != len(params):
+            raise ValueError(f"Expected {len(parts) - 1} parameters, got {len(params)}")
+        bound = [parts[0]]
+        for value, part in zip(params, parts[1:]):
+            bound.append(quote_mysql(value))
+            bound.append(part)
+        return "".join(bound)
+
+    def run_sql(self, sql_command):
+        cmd = [self.mysql_path, *self.connection_args, "-e", sql_command, self.schema]
+        try:
+            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+            return result.stdout.strip()
+        except subprocess.CalledProcessError as e:
+            print("MySQL error:", e.stderr)
+            raise
+
+    def query(self, sql, params=()):
+        output = self.run_sql(self.bind(sql, params))
+        rows = []
+        for line in output.split("\n")[1:]:
+            if line:
+                rows.append(tuple(None if value == "NULL" else value for value in line.split("\t")))
+        return rows
+
+    def execute(self, sql, params=()):
+        self.run_sql(self.bind(sql, params))
+
+    def execute_many(self, statements):
+        if not statements:
+            return
+        body = "\n".join(self.bind(sql, params) for sql, params in statements)
+        self.run_sql(f"START TRANSACTION;\n{body}\nCOMMIT;")
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def sqlite_table_ddl(table, granularity, datetime_periods=False):
+    if datetime_periods:
+        period_start = """CASE length(date)
+            WHEN 7 THEN date || '-01 00:00:00'
+            WHEN 10 THEN date || ' 00:00:00'
+            ELSE date || ':00' END"""
+    else:
+        period_start = "CASE length(date) WHEN 7 THEN date || '-01' ELSE substr(date, 1, 10) END"
+    return f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    market TEXT NULL,
+    trading_pair TEXT NULL,
+    date TEXT NULL,
+    normalized BOOLEAN NULL,
+    inserted_to_psql BOOLEAN NULL,
+    is_delisted BOOLEAN NULL,
+    first_csv BOOLEAN NULL,
+    size_bytes INTEGER NULL,
+    codec TEXT NULL,
+    first_id INTEGER NULL,
+    last_id INTEGER NULL,
+    id_breaks INTEGER NULL,
+    period TEXT NOT NULL DEFAULT '{granularity}',
+    period_start TEXT GENERATED ALWAYS AS ({period_start}) STORED,
+    UNIQUE (market, trading_pair, date)
+);
+CREATE INDEX IF NOT EXISTS idx_{table}_pair_first_period ON {table} (market, trading_pair, first_csv, period_start, date);
+CREATE INDEX IF NOT EXISTS idx_{table}_pair_period ON {table} (market, trading_pair, period_start, first_csv);
+"""
+
+
+SQLITE_LIFECYCLE_TABLE_QUERY = f"""
+CREATE TABLE IF NOT EXISTS {LIFECYCLE_TABLE} (
+    market TEXT NOT NULL,
+    trading_pair TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    status TEXT NOT NULL,
+    listed_on TEXT NULL,
+    last_seen TEXT NULL,
+    delisted_on TEXT NULL,
+    backfill_done BOOLEAN NOT NULL DEFAULT 0,
+    PRIMARY KEY (market, trading_pair)
+);
+CREATE INDEX IF NOT EXISTS idx_{LIFECYCLE_TABLE}_market_status ON {LIFECYCLE_TABLE} (market, status);
+"""
+
+SQLITE_SHARD_LEASE_TABLE_QUERY = f"""
+CREATE TABLE IF NOT EXISTS {SHARD_LEASE_TABLE} (
+    feed TEXT NOT NULL,
+    market TEXT NOT NULL,
+    trading_pair TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    completed_at REAL NULL,
+    PRIMARY KEY (feed, market, trading_pair)
+);
+CREATE INDEX IF NOT EXISTS idx_{SHARD_LEASE_TABLE}_owner ON {SHARD_LEASE_TABLE} (owner);
+"""
+
+SQLITE_TRADE_ID_GAP_TABLE_QUERY = f"""
+CREATE TABLE IF NOT EXISTS {TRADE_ID_GAP_TABLE} (
+    source_table TEXT NOT NULL,
+    market TEXT NOT NULL,
+    trading_pair TEXT NOT NULL,
+    date TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    first_id INTEGER NOT NULL,
+    last_id INTEGER NOT NULL,
+    ids INTEGER NOT NULL,
+    detected_at REAL NOT NULL,
+    PRIMARY KEY (source_table, market, trading_pair, date, kind, first_id)
+);
+"""
+
+
+def format_mysql_output(columns, rows):
+    if not rows:
+        return ""
+    lines = ["\t".join(columns)]
+    for row in rows:
+        lines.append("\t".join("NULL" if value is None else str(value) for value in row))
+    return "\n".join(lines)
+
+
+# Embedded catalog in a single SQLite file (WAL mode), no server needed
+class SQLiteCatalog(CatalogBackend):
+    insert_ignore = "INSERT OR IGNORE"
+
+    def __init__(self, database_name, path=None):
+        super().__init__(database_name)
+        self.path = path or os.path.join(CATALOG_SQLITE_DIR, f"{database_name}.sqlite3")
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.execute("PRAGMA synchronous=NORMAL;")
+        self.connection.execute("PRAGMA busy_timeout=30000;")
+        tables = CATALOG_TABLES.get(database_name, {"daily": "daily", "monthly": "monthly"})
+        for table, granularity in tables.items():
+            self.connection.executescript(sqlite_table_ddl(table, granularity, self.datetime_periods))
+            # Files created before size_bytes, codec and the trade id checks existed
+            columns = {row[1] for row in self.connection.execute(f"PRAGMA table_info({table});")}
+            if "size_bytes" not in columns:
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN size_bytes INTEGER NULL;")
+            if "codec" not in columns:
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN codec TEXT NULL;")
+            for column in ("first_id", "last_id", "id_breaks"):
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NULL;")
+        self.connection.executescript(SQLITE_LIFECYCLE_TABLE_QUERY)
+        self.connection.executescript(SQLITE_SHARD_LEASE_TABLE_QUERY)
+        self.connection.executescript(SQLITE_TRADE_ID_GAP_TABLE_QUERY)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return [tuple(row) for row in self.connection.execute(sql, tuple(params)).fetchall()]
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            self.connection.execute(sql, tuple(params))
+
+    def execute_many(self, statements):
+        with self.lock:
+            self.connection.execute("BEGIN;")
+            try:
+                for sql, params in statements:
+                    self.connection.execute(sql, tuple(params))
+                self.connection.execute("COMMIT;")
+            except Exception:
+                self.connection.execute("ROLLBACK;")
+                raise
+
+    # Mirror the mysql client's error surface so the scripts handle both backends the same way
+    def run_sql(self, sql_command):
+        with self.lock:
+            try:
+                cursor = self.connection.execute(sql_command.strip())
+                if cursor.description is None:
+                    return ""
+                columns = [column[0] for column in cursor.description]
+                return format_mysql_output(columns, cursor.fetchall())
+            except sqlite3.IntegrityError as e:
+                print("SQLite error:", e)
+                raise subprocess.CalledProcessError(1, ["sqlite3", self.path], stderr=f"Duplicate entry: {e}")
+            except sqlite3.Error as e:
+                print("SQLite error:", e)
+                raise subprocess.CalledProcessError(1, ["sqlite3", self.path], stderr=str(e))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+# Shared catalog per database, chosen by CATALOG_BACKEND. Extra kwargs go to the MySQL client.
+def get_catalog(database_name, backend=None, **kwargs):
+    backend = backend or CATALOG_BACKEND
+    with _catalogs_lock:
+        key = (backend, database_name)
+        if key not in _catalogs:
+            if backend == "sqlite":
+                _catalogs[key] = SQLiteCatalog(database_name)
+            elif backend == "mysql":
+                _catalogs[key] = MySQLCatalog(database_name, **kwargs)
+            else:
+                raise ValueError(f"Unknown catalog backend: {backend}")
+        return _catalogs[key]
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def time_operation(name, operation, count):
+    start = time.perf_counter()
+    operation()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28}{count:>10}{elapsed * 1000:>12.1f} ms{count / elapsed if elapsed else 0:>14.0f} ops/s")
+
+
+# Exercise the operations the scripts use against one backend
+def run_benchmark(catalog, symbols=200, days=365):
+    records = []
+    for index in range(symbols):
+        for day in range(days):
+            month, day_of_month = divmod(day, 28)
+            records.append(("spot", f"SYM{index:04d}USDT", f"2020-{month % 12 + 1:02d}-{day_of_month + 1:02d}"))
+    records = sorted(set(records))
+    sample = records[::max(1, len(records) // 500)]
+
+    print(f"\n{type(catalog).__name__} ({catalog.database_name})")
+    print(f"{'operation':<28}{'count':>10}{'elapsed':>15}{'rate':>18}")
+    time_operation("bulk insert", lambda: catalog.insert_records("daily", records), len(records))
+    time_operation("record_exists", lambda: [catalog.record_exists("daily", *r) for r in sample], len(sample))
+    pairs = sorted({r[:2] for r in sample})
+    time_operation("mark_first_csv", lambda: [catalog.mark_first_csv("daily", *p) for p in pairs], len(pairs))
+    time_operation("get_first_csv", lambda: [catalog.get_first_csv("daily", *p) for p in pairs], len(pairs))
+    months = sorted({(r[0], r[1], r[2][:7]) for r in sample})
+    time_operation("rollup_month", lambda: [catalog.rollup_month(*m) for m in months], len(months))
+    time_operation("full records scan", lambda: catalog.get_records("daily"), 1)
+    time_operation("bulk delete", lambda: catalog.delete_records("daily", records), len(records))
+
+
+# Main logic
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the catalog backends.")
+    parser.add_argument("--mysql", action="store_true", help="Also benchmark a scratch MySQL database.")
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sqlite_catalog = SQLiteCatalog("catalog_benchmark", os.path.join(tmp_dir, "catalog.sqlite3"))
+        run_benchmark(sqlite_catalog, args.symbols, args.days)
+        sqlite_catalog.close()
+
+    if args.mysql:
+        from catalog_schema import table_ddl, run_sql_command
+        run_sql_command("DROP DATABASE IF EXISTS catalog_benchmark; CREATE DATABASE catalog_benchmark;")
+        for table in ("daily", "monthly"):
+            run_sql_command(table_ddl("catalog_benchmark", table, table))
+        run_benchmark(MySQLCatalog("catalog_benchmark"), args.symbols, args.days)
+        print(colored("Scratch database catalog_benchmark left in place for inspection.", 'yellow'))
@@ -0,0 +1,405 @@
+import subprocess
+import os
+import time
+import random
+import argparse
+import tempfile
+from datetime import date, timedelta
+from termcolor import colored
+
+# Catalog databases and the period granularity held by each of their tables
+CATALOG_TABLES = {
+    "binance_csvs": {"daily": "daily", "monthly": "monthly"},
+    "bybit_csvs": {"daily": "daily", "monthly": "monthly"},
+    "kraken_csvs": {"daily": "daily", "monthly": "monthly"},
+    "bitstamp_csvs": {"hourly": "hourly", "daily": "daily", "monthly": "monthly"},
+}
+
+# Bitstamp stores snapshot times ('YYYY-MM-DD HH:MM'), everything else stores days or months
+DATETIME_DATABASES = {"bitstamp_csvs"}
+
+FIRST_PARTITION_YEAR = 2011
+
+# Per-catalog record of when each symbol was listed and delisted on the exchange
+LIFECYCLE_TABLE = "symbol_lifecycle"
+
+# Per-catalog leases of (feed, market, trading_pair) shards between ingest nodes
+SHARD_LEASE_TABLE = "shard_leases"
+
+# Per-catalog ranges of missing or repeated trade ids found in stored files (id_continuity.py)
+TRADE_ID_GAP_TABLE = "trade_id_gaps"
+
+
+# Function to run SQL commands and return the result
+def run_sql_command(sql_command, database_name=""):
+    cmd = [
+        "mysql",
+        "--login-path=client",
+        "--local-infile=1",
+        "-e",
+        sql_command,
+        database_name
+    ]
+    try:
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        return result.stdout.strip()
+    except subprocess.CalledProcessError as e:
+        print("MySQL error:", e.stderr)
+        raise
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Typed column derived from the legacy `date` string, so existing writers keep working unchanged
+def period_start_column(datetime_periods=False):
+    if datetime_periods:
+        return """period_start DATETIME AS (CASE CHAR_LENGTH(date)
+            WHEN 7 THEN CAST(CONCAT(date, '-01') AS DATETIME)
+            WHEN 10 THEN CAST(date AS DATETIME)
+            ELSE CAST(CONCAT(date, ':00') AS DATETIME) END) STORED"""
+    return """period_start DATE AS (CASE CHAR_LENGTH(date)
+            WHEN 7 THEN CAST(CONCAT(date, '-01') AS DATE)
+            ELSE CAST(LEFT(date, 10) AS DATE) END) STORED"""
+
+
+def period_column(granularity):
+    return f"period ENUM('hourly', 'daily', 'monthly') NOT NULL DEFAULT '{granularity}'"
+
+
+# Partition clause splitting a table into one range per year of period_start
+def partition_clause(last_year=None):
+    last_year = last_year or date.today().year + 1
+    partitions = [
+        f"PARTITION p{year} VALUES LESS THAN ({year + 1})"
+        for year in range(FIRST_PARTITION_YEAR, last_year + 1)
+    ]
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return "PARTITION BY RANGE (YEAR(period_start)) (\n    " + ",\n    ".join(partitions) + "\n)"
+
+
+# Full CREATE TABLE statement for a catalog table in the typed layout
+def table_ddl(database_name, table, granularity, datetime_periods=False, partition=False):
+    # Partitioned tables need the partition column in every unique key
+    unique_columns = "market, trading_pair, date, period_start" if partition else "market, trading_pair, date"
+    ddl = f"""
+CREATE TABLE IF NOT EXISTS {database_name}.{table} (
+    market VARCHAR(10) NULL,
+    trading_pair VARCHAR(25) NULL,
+    date VARCHAR(20) NULL,
+    normalized BOOLEAN NULL,
+    inserted_to_psql BOOLEAN NULL,
+    is_delisted BOOLEAN NULL,
+    first_csv BOOLEAN NULL,
+    size_bytes BIGINT NULL,
+    codec VARCHAR(8) NULL,
+    first_id BIGINT NULL,
+    last_id BIGINT NULL,
+    id_breaks INT NULL,
+    {period_column(granularity)},
+    {period_start_column(datetime_periods)},
+    UNIQUE INDEX idx_market_pair_date ({unique_columns}),
+    INDEX idx_pair_first_period (market, trading_pair, first_csv, period_start, date),
+    INDEX idx_pair_period (market, trading_pair, period_start, first_csv)
+)"""
+    if partition:
+        ddl += "\n" + partition_clause()
+    return ddl + ";"
+
+
+def lifecycle_table_ddl(database_name):
+    return f"""
+CREATE TABLE IF NOT EXISTS {database_name}.{LIFECYCLE_TABLE} (
+    market VARCHAR(10) NOT NULL,
+    trading_pair VARCHAR(25) NOT NULL,
+    symbol VARCHAR(25) NOT NULL,
+    status VARCHAR(10) NOT NULL,
+    listed_on DATE NULL,
+    last_seen DATE NULL,
+    delisted_on DATE NULL,
+    backfill_done BOOLEAN NOT NULL DEFAULT 0,
+    PRIMARY KEY (market, trading_pair),
+    INDEX idx_market_status (market, status)
+);"""
+
+
+def shard_lease_table_ddl(database_name):
+    return f"""
+CREATE TABLE IF NOT EXISTS {database_name}.{SHARD_LEASE_TABLE} (
+    feed VARCHAR(20) NOT NULL,
+    market VARCHAR(10) NOT NULL,
+    trading_pair VARCHAR(25) NOT NULL,
+    owner VARCHAR(100) NOT NULL,
+    expires_at DOUBLE NOT NULL,
+    heartbeat_at DOUBLE NOT NULL,
+    completed_at DOUBLE NULL,
+    PRIMARY KEY (feed, market, trading_pair),
+    INDEX idx_owner (owner)
+);"""
+
+
+def trade_id_gap_table_ddl(database_name):
+    return f"""
+CREATE TABLE IF NOT EXISTS {database_name}.{TRADE_ID_GAP_TABLE} (
+    source_table VARCHAR(10) NOT NULL,
+    market VARCHAR(10) NOT NULL,
+    trading_pair VARCHAR(25) NOT NULL,
+    date VARCHAR(20) NOT NULL,
+    kind VARCHAR(10) NOT NULL,
+    first_id BIGINT NOT NULL,
+    last_id BIGINT NOT NULL,
+    ids BIGINT NOT NULL,
+    detected_at DOUBLE NOT NULL,
+    PRIMARY KEY (source_table, market, trading_pair, date, kind, first_id)
+);"""
+
+
+# Tables every catalog has next to its period tables
+def support_table_ddl(database_name):
+    return [lifecycle_table_ddl(database_name), shard_lease_table_ddl(database_name),
+            trade_id_gap_table_ddl(database_name)]
+
+
+# Every statement that creates a catalog from scratch in the current layout, run by the *-csvs.py scripts
+def catalog_ddl(database_name, partition=False):
+    datetime_periods = database_name in DATETIME_DATABASES
+    statements = [f"CREATE DATABASE IF NOT EXISTS {database_name};"]
+    for table, granularity in CATALOG_TABLES[database_name].items():
+        statements.append(table_ddl(database_name, table, granularity, datetime_periods, partition))
+    return statements + support_table_ddl(database_name)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def get_existing_columns(database_name, table):
+    sql_command = f"""
+    SELECT COLUMN_NAME FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = '{database_name}' AND TABLE_NAME = '{table}';
+    """
+    result = run_sql_command(sql_command)
+    return set(result.split("\n")[1:]) if result else set()
+
+
+def get_existing_indexes(database_name, table):
+    sql_command = f"""
+    SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = '{database_name}' AND TABLE_NAME = '{table}';
+    """
+    result = run_sql_command(sql_command)
+    return set(result.split("\n")[1:]) if result else set()
+
+
+def is_partitioned(database_name, table):
+    sql_command = f"""
+    SELECT COUNT(*) FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = '{database_name}' AND TABLE_NAME = '{table}' AND PARTITION_NAME IS NOT NULL;
+    """
+    result = run_sql_command(sql_command)
+    return int(result.split("\n")[1]) > 0
+
+
+# Build the ALTER statements that bring a legacy VARCHAR-dated table to the typed layout
+def migration_statements(database_name, table, granularity, datetime_periods, columns, indexes,
+                         partition=False, partitioned=False):
+    changes = []
+
+    if "first_csv" not in columns:
+        changes.append("ADD COLUMN first_csv BOOLEAN NULL")
+    if "size_bytes" not in columns:
+        changes.append("ADD COLUMN size_bytes BIGINT NULL")
+    if "codec" not in columns:
+        changes.append("ADD COLUMN codec VARCHAR(8) NULL")
+    if "id_breaks" not in columns:
+        changes.append("ADD COLUMN first_id BIGINT NULL")
+        changes.append("ADD COLUMN last_id BIGINT NULL")
+        changes.append("ADD COLUMN id_breaks INT NULL")
+    if "period" not in columns:
+        changes.append(f"ADD COLUMN {period_column(granularity)}")
+    if "period_start" not in columns:
+        changes.append("MODIFY COLUMN date VARCHAR(20) NULL")
+        changes.append(f"ADD COLUMN {period_start_column(datetime_periods)}")
+    if "idx_pair_first_period" not in indexes:
+        changes.append("ADD INDEX idx_pair_first_period (market, trading_pair, first_csv, period_start, date)")
+    if "idx_pair_period" not in indexes:
+        changes.append("ADD INDEX idx_pair_period (market, trading_pair, period_start, first_csv)")
+
+    statements = []
+    if changes:
+        statements.append(f"ALTER TABLE {database_name}.{table}\n    " + ",\n    ".join(changes) + ";")
+
+    if partition and not partitioned:
+        statements.append(f"""ALTER TABLE {database_name}.{table}
+    DROP INDEX idx_market_pair_date,
+    ADD UNIQUE INDEX idx_market_pair_date (market, trading_pair, date, period_start);""")
+        statements.append(f"ALTER TABLE {database_name}.{table}\n{partition_clause()};")
+    return statements
+
+
+def migrate_table(database_name, table, partition=False, dry_run=False):
+    granularity = CATALOG_TABLES[database_name][table]
+    datetime_periods = database_name in DATETIME_DATABASES
+    columns = get_existing_columns(database_name, table)
+    if not columns:
+        print(colored(f"{database_name}.{table} does not exist, creating it.", 'yellow'))
+        statements = [table_ddl(database_name, table, granularity, datetime_periods, partition)]
+    else:
+        indexes = get_existing_indexes(database_name, table)
+        partitioned = is_partitioned(database_name, table)
+        statements = migration_statements(database_name, table, granularity, datetime_periods,
+                                          columns, indexes, partition, partitioned)
+
+    if not statements:
+        print(colored(f"{database_name}.{table} is already on the typed schema.", 'green'))
+        return
+
+    for statement in statements:
+        if dry_run:
+            print(statement)
+            continue
+        start = time.time()
+        run_sql_command(statement)
+        print(colored(f"Migrated {database_name}.{table} in {time.time() - start:.1f}s", 'cyan'))
+
+
+def migrate_catalog(databases=None, partition=False, dry_run=False):
+    for database_name in databases or CATALOG_TABLES.keys():
+        if not dry_run:
+            run_sql_command(f"CREATE DATABASE IF NOT EXISTS {database_name};")
+        for table in CATALOG_TABLES[database_name]:
+            migrate_table(database_name, table, partition, dry_run)
+        for ddl in support_table_ddl(database_name):
+            if dry_run:
+                print(ddl)
+            else:
+                run_sql_command(ddl)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+BENCHMARK_DATABASE = "catalog_benchmark"
+
+LEGACY_TABLE_QUERY = """
+CREATE TABLE {table} (
+    market VARCHAR(10) NULL,
+    trading_pair VARCHAR(25) NULL,
+    date VARCHAR(10) NULL,
+    normalized BOOLEAN NULL,
+    inserted_to_psql BOOLEAN NULL,
+    is_delisted BOOLEAN NULL,
+    first_csv BOOLEAN NULL,
+    UNIQUE INDEX idx_market_pair_date (market, trading_pair, date)
+);
+"""
+
+
+# Write a synthetic catalog of daily rows spread over markets and symbols as a TSV for LOAD DATA
+def write_synthetic_catalog(path, rows, seed=7):
+    rng = random.Random(seed)
+    markets = ["spot", "usdm", "coinm"]
+    days_per_symbol = 2500
+    symbols_needed = rows // days_per_symbol + 1
+    symbols = [f"SYM{i:05d}USDT" for i in range(symbols_needed)]
+    start = date(2017, 1, 1)
+
+    written = 0
+    with open(path, 'w') as f:
+        for index, symbol in enumerate(symbols):
+            market = markets[index % len(markets)]
+            first_day = start + timedelta(days=rng.randint(0, 400))
+            for offset in range(days_per_symbol):
+                if written >= rows:
+                    return written
+                day = (first_day + timedelta(days=offset)).strftime('%Y-%m-%d')
+                f.write(f"{market}\t{symbol}\t{day}\t0\t0\t0\t{1 if offset == 0 else 0}\n")
+                written += 1
+    return written
+
+
+def time_queries(queries, repeat=3):
+    statement = "\n".join(queries)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_sql_command(statement, BENCHMARK_DATABASE)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_queries(table, typed, symbols):
+    first_csv_order = "period_start" if typed else "date"
+    queries = {"first_csv lookup": [], "month range": []}
+    for market, symbol in symbols:
+        queries["first_csv lookup"].append(
+            f"SELECT date FROM {table} WHERE market = '{market}' AND trading_pair = '{symbol}' "
+            f"AND first_csv = '1' ORDER BY {first_csv_order} ASC LIMIT 1;")
+        if typed:
+            queries["month range"].append(
+                f"SELECT COUNT(*) FROM {table} WHERE market = '{market}' AND trading_pair = '{symbol}' "
+                f"AND period_start BETWEEN '2019-03-01' AND '2019-03-31';")
+        else:
+            queries["month range"].append(
+                f"SELECT COUNT(*) FROM {table} WHERE market = '{market}' AND trading_pair = '{symbol}' "
+                f"AND date LIKE '2019-03%';")
+    return queries
+
+
+# Load the same synthetic rows into a legacy and a typed table and time the lookups the scripts issue
+def run_benchmark(rows=5_000_000, lookups=200, partition=False):
+    run_sql_command(f"DROP DATABASE IF EXISTS {BENCHMARK_DATABASE};")
+    run_sql_command(f"CREATE DATABASE {BENCHMARK_DATABASE};")
+    run_sql_command(LEGACY_TABLE_QUERY.format(table="legacy"), BENCHMARK_DATABASE)
+    run_sql_command(table_ddl(BENCHMARK_DATABASE, "typed", "daily", partition=partition))
+
+    with tempfile.NamedTemporaryFile(suffix=".tsv", delete=False) as tmp:
+        tsv_path = tmp.name
+    try:
+        written = write_synthetic_catalog(tsv_path, rows)
+        print(colored(f"Generated {written} synthetic catalog rows.", 'cyan'))
+        for table in ("legacy", "typed"):
+            start = time.time()
+            run_sql_command(
+                f"LOAD DATA LOCAL INFILE '{tsv_path}' INTO TABLE {table} "
+                f"(market, trading_pair, date, normalized, inserted_to_psql, is_delisted, first_csv);",
+                BENCHMARK_DATABASE)
+            print(colored(f"Loaded {table} in {time.time() - start:.1f}s", 'cyan'))
+    finally:
+        os.remove(tsv_path)
+
+    result = run_sql_command("SELECT DISTINCT market, trading_pair FROM legacy;", BENCHMARK_DATABASE)
+    pairs = [tuple(line.split("\t")) for line in result.split("\n")[1:] if line]
+    sample = random.Random(11).sample(pairs, min(lookups, len(pairs)))
+
+    # Client startup is paid once per batch, measure it so it can be subtracted
+    overhead = time_queries(["SELECT 1;"] * len(sample))
+
+    print(f"\n{'query':<24}{'legacy ms/query':>18}{'typed ms/query':>18}{'speedup':>10}")
+    legacy_queries = benchmark_queries("legacy", False, sample)
+    typed_queries = benchmark_queries("typed", True, sample)
+    for name in legacy_queries:
+        legacy = max(time_queries(legacy_queries[name]) - overhead, 0) / len(sample) * 1000
+        typed = max(time_queries(typed_queries[name]) - overhead, 0) / len(sample) * 1000
+        speedup = legacy / typed if typed else float('inf')
+        print(f"{name:<24}{legacy:>18.3f}{typed:>18.3f}{speedup:>9.1f}x")
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the CSV catalogs to the typed, indexed schema.")
+    parser.add_argument("--database", action="append", choices=sorted(CATALOG_TABLES.keys()),
+                        help="Only migrate this catalog (repeatable). Defaults to all of them.")
+    parser.add_argument("--partition", action="store_true", help="Range-partition every table by year.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the statements instead of running them.")
+    parser.add_argument("--benchmark", type=int, metavar="ROWS", nargs="?", const=5_000_000,
+                        help="Benchmark legacy vs typed lookups on a synthetic catalog (default 5M rows).")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark, partition=args.partition)
+    else:
+        migrate_catalog(args.database, args.partition, args.dry_run)
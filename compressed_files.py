@@ -0,0 +1,75 @@
+import os
+
+# What happens to downloaded archives: "extract" unpacks them to CSV as the scripts always did, "keep"
+# stores Binance's .zip and Bybit's .csv.gz as downloaded and reads decompress them on demand
+STORAGE_MODE = os.getenv('STORAGE_MODE', 'extract')
+
+# Suffix of a stored raw file, and its codec
+CODECS = {".zip": "zip", ".gz": "gzip", ".zst": "zstd"}
+
+
+def codec_of(path):
+    return CODECS.get(os.path.splitext(path)[1])
+
+
+# Name of the CSV a stored file holds: X.zip, X.csv.gz and X.csv.zst are all X.csv
+def plain_name(name):
+    base, suffix = os.path.splitext(name)
+    if suffix == ".zip":
+        return base + ".csv"
+    if suffix in (".gz", ".zst") and base.endswith(".csv"):
+        return base
+    return name
+
+
+# Where the raw CSV of a record may be stored, plain first
+def stored_variants(csv_path):
+    return [csv_path, csv_path[:-4] + ".zip", csv_path + ".gz", csv_path + ".zst"]
+
+
+def find_stored(csv_path):
+    for path in stored_variants(csv_path):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# Binary file object over the CSV in a stored file, decompressed as it is read. seek() forward works for
+# every codec, by decompressing and discarding.
+def open_raw(path):
+    codec = codec_of(path)
+    if codec is None:
+        return open(path, 'rb')
+    if codec == "gzip":
+        import gzip
+        return gzip.open(path, 'rb')
+    if codec == "zip":
+        import zipfile
+        archive = zipfile.ZipFile(path)
+        # The member keeps the file open until it is closed itself
+        member = archive.open(archive.namelist()[0])
+        archive.close()
+        return member
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(f"{path}: reading .zst files needs the zstandard package")
+    from seekable_zstd import SeekableZstdFile, read_seek_table
+
+    # Recompressed files carry a frame index and seek by decompressing only the frame they land in
+    table = read_seek_table(path)
+    if table is not None:
+        return SeekableZstdFile(path, table)
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+
+
+def first_line(path):
+    with open_raw(path) as file:
+        return file.read(1 << 16).split(b"\n", 1)[0]
+
+
+def is_empty(path):
+    if codec_of(path) is None:
+        return not os.path.getsize(path)
+    with open_raw(path) as file:
+        return not file.read(1)
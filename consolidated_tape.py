@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+import heapq
+import argparse
+import resource
+from datetime import timedelta
+from termcolor import colored
+
+from trade_dataset import as_datetime, get_dataset, to_ms
+
+# Span read from each source at a time: memory is about one window of trades per source
+TAPE_WINDOW = timedelta(minutes=int(os.getenv('TAPE_WINDOW_MINUTES', 60)))
+TAPE_COLUMNS = ("trade_id", "price", "qty", "time", "is_buyer_maker")
+
+# The same asset's main pair on every exchange, as (exchange, market, symbol). Quotes are not converted:
+# USDT and USD prices are merged as they are.
+TAPE_SYMBOLS = {
+    "BTC": (("binance", "spot", "BTCUSDT"), ("bybit", "spot", "BTCUSDT"), ("kraken", "spot", "BTC/USD"),
+            ("bitstamp", "spot", "btcusd")),
+    "ETH": (("binance", "spot", "ETHUSDT"), ("bybit", "spot", "ETHUSDT"), ("kraken", "spot", "ETH/USD"),
+            ("bitstamp", "spot", "ethusd")),
+}
+
+
+# Symbols as the catalogs hold them: BTC/USD and btcusd are both BTCUSD
+def catalog_pair(symbol):
+    return symbol.replace('/', '').upper()
+
+
+# Time-sorted {column: array} windows of one source's trades in [start, end), across its stitched files.
+# Files of a feed can overlap (Bitstamp snapshots), the cursor makes sure no span is read twice.
+def source_chunks(exchange, market, symbol, start, end, storage_root=None):
+    import numpy as np
+
+    pair = catalog_pair(symbol)
+    files = get_dataset(exchange, storage_root).files(start, end, exchange, market, pair).get((exchange, market, pair), [])
+    cursor = start
+    for found in files:
+        window = max(found.start, cursor)
+        stop = min(found.end, end)
+        while window < stop:
+            window_end = min(window + TAPE_WINDOW, stop)
+            table = found.read(to_ms(window), to_ms(window_end), TAPE_COLUMNS)
+            if table.num_rows:
+                chunk = {name: table[name].to_numpy(zero_copy_only=False) for name in TAPE_COLUMNS}
+                if (np.diff(chunk["time"]) < 0).any():
+                    order = np.argsort(chunk["time"], kind="stable")
+                    chunk = {name: column[order] for name, column in chunk.items()}
+                yield chunk
+            window = window_end
+        cursor = max(cursor, stop)
+
+
+# One time-ordered stream of trades across sources, by a k-way merge of their windows. A heap holds every
+# source's current window keyed by its last trade time: everything up to the smallest key is complete on
+# all sources, so it is merged and emitted as one batch and that source moves to its next window. Trades
+# of equal time keep the order of the sources.
+class ConsolidatedTape:
+
+    def __init__(self, sources, start, end, storage_root=None):
+        self.sources = [(exchange, market, catalog_pair(symbol)) for exchange, market, symbol in sources]
+        self.start, self.end = as_datetime(start), as_datetime(end)
+        self.storage_root = storage_root
+
+    @classmethod
+    def for_asset(cls, asset, start, end, storage_root=None):
+        return cls(TAPE_SYMBOLS[asset.upper()], start, end, storage_root)
+
+    # Batches as {column: array} with a `source` column indexing self.sources
+    def __iter__(self):
+        import numpy as np
+
+        streams = [source_chunks(*source, self.start, self.end, self.storage_root) for source in self.sources]
+        current = [None] * len(streams)
+        heap = []
+
+        def advance(index):
+            current[index] = next(streams[index], None)
+            if current[index] is not None:
+                heapq.heappush(heap, (int(current[index]["time"][-1]), index))
+
+        for index in range(len(streams)):
+            advance(index)
+        while heap:
+            boundary = heap[0][0]
+            parts = []
+            for index, chunk in enumerate(current):
+                if chunk is None:
+                    continue
+                cut = int(np.searchsorted(chunk["time"], boundary, side='right'))
+                if cut:
+                    part = {name: column[:cut] for name, column in chunk.items()}
+                    part["source"] = np.full(cut, index, dtype=np.uint8)
+                    parts.append(part)
+                    current[index] = {name: column[cut:] for name, column in chunk.items()}
+            while heap and heap[0][0] == boundary:
+                advance(heapq.heappop(heap)[1])
+            if len(parts) == 1:
+                yield parts[0]
+                continue
+            batch = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+            order = np.argsort(batch["time"], kind="stable")
+            yield {name: column[order] for name, column in batch.items()}
+
+    # Everything as one DataFrame with an exchange column, for windows that fit in memory
+    def to_pandas(self):
+        import pandas as pd
+
+        frames = [pd.DataFrame(batch) for batch in self]
+        if not frames:
+            return pd.DataFrame(columns=list(TAPE_COLUMNS) + ["exchange"])
+        tape = pd.concat(frames, ignore_index=True)
+        names = [f"{exchange}:{market}:{pair}" for exchange, market, pair in self.sources]
+        tape["exchange"] = pd.Categorical.from_codes(tape.pop("source"), names)
+        return tape
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Streams the tape and reports trades/sec and peak memory, and the load-everything-and-sort way for comparison
+def benchmark(tape, compare=True):
+    import numpy as np
+    import pandas as pd
+    from trade_dataset import load_trades
+
+    started = time.time()
+    trades = batches = 0
+    last = -1
+    ordered = True
+    for batch in tape:
+        batches += 1
+        trades += len(batch["time"])
+        if len(batch["time"]):
+            ordered = ordered and batch["time"][0] >= last and not (np.diff(batch["time"]) < 0).any()
+            last = batch["time"][-1]
+    elapsed = time.time() - started
+    # ru_maxrss is in bytes on macOS, KB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1024)
+    print(colored(f"Streaming merge: {trades} trades in {batches} batches, {elapsed:.2f}s, "
+                  f"{trades / max(elapsed, 1e-9):,.0f} trades/s, peak RSS {peak_mb:.0f} MB, "
+                  f"{'ordered' if ordered else 'NOT ORDERED'}", 'green' if ordered else 'red'))
+    if compare:
+        started = time.time()
+        frames = [load_trades(exchange, market, pair, tape.start, tape.end).assign(source=index)
+                  for index, (exchange, market, pair) in enumerate(tape.sources)]
+        merged = pd.concat(frames, ignore_index=True).sort_values("time", kind="stable")
+        elapsed = time.time() - started
+        print(colored(f"Load and sort: {len(merged)} trades in {elapsed:.2f}s, "
+                      f"{len(merged) / max(elapsed, 1e-9):,.0f} trades/s", 'cyan'))
+
+
+# Main logic
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream one time-ordered tape of an asset's trades across exchanges.")
+    parser.add_argument("start", help="YYYY-MM-DD[ HH:MM]")
+    parser.add_argument("end", help="YYYY-MM-DD[ HH:MM], exclusive")
+    parser.add_argument("--asset", default="BTC", help=f"Asset of TAPE_SYMBOLS: {', '.join(TAPE_SYMBOLS)}")
+    parser.add_argument("--source", nargs="+", metavar="EXCHANGE:MARKET:SYMBOL",
+                        help="Sources instead of the asset's, e.g. binance:spot:BTCUSDT kraken:spot:BTC/USD")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    parser.add_argument("--benchmark", action="store_true", help="Measure trades/sec against loading and sorting.")
+    args = parser.parse_args()
+
+    if args.source:
+        tape = ConsolidatedTape([source.split(':', 2) for source in args.source], args.start, args.end, args.storage_root)
+    else:
+        tape = ConsolidatedTape.for_asset(args.asset, args.start, args.end, args.storage_root)
+    if args.benchmark:
+        benchmark(tape)
+    else:
+        print(tape.to_pandas())
@@ -0,0 +1,224 @@
+import threading
+import numpy as np
+from datetime import date, datetime, timedelta
+
+# Day 0 of every bitmap. Nothing we archive predates it.
+EPOCH = date(2010, 1, 1)
+EPOCH_NP = np.datetime64(EPOCH.isoformat(), 'D')
+
+# Room past today so new days can be set without growing the bitmaps
+HORIZON_DAYS = 400
+
+
+def to_day_index(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return (value - EPOCH).days
+    # 'YYYY-MM' and 'YYYY-MM-DD HH:MM' both land on their first day
+    return (np.datetime64(value[:10], 'D') - EPOCH_NP).astype(np.int64).item()
+
+
+def to_day_indexes(values):
+    values = [v.date() if isinstance(v, datetime) else v for v in values]
+    if not values:
+        return np.empty(0, dtype=np.int64)
+    if isinstance(values[0], date):
+        days = np.array(values, dtype='datetime64[D]')
+    else:
+        days = np.array([v[:10] for v in values], dtype='datetime64[D]')
+    return (days - EPOCH_NP).astype(np.int64)
+
+
+def from_day_index(index):
+    return EPOCH + timedelta(days=int(index))
+
+
+# Month starts (as day indexes) covering [start, end], plus the index one past the last month
+def month_boundaries(start_index, end_index):
+    first = np.datetime64(from_day_index(start_index).isoformat()[:7], 'M')
+    last = np.datetime64(from_day_index(end_index).isoformat()[:7], 'M')
+    months = np.arange(first, last + 2)
+    return months, (months.astype('datetime64[D]') - EPOCH_NP).astype(np.int64)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Day-granular coverage per (exchange, market, symbol), one bit per day since EPOCH,
+# with a second bitmap for days the exchange is known not to have
+class CoverageIndex:
+
+    def __init__(self, end=None):
+        end = end or date.today() + timedelta(days=HORIZON_DAYS)
+        self.days = to_day_index(end) + 1
+        self.covered = {}
+        self.unavailable = {}
+        self.lock = threading.Lock()
+
+    def _bitmap(self, store, key, create=True):
+        bitmap = store.get(key)
+        if bitmap is None and create:
+            bitmap = np.zeros((self.days + 7) // 8, dtype=np.uint8)
+            store[key] = bitmap
+        return bitmap
+
+    def _grow(self, index):
+        if index < self.days:
+            return
+        self.days = index + HORIZON_DAYS
+        size = (self.days + 7) // 8
+        for store in (self.covered, self.unavailable):
+            for key, bitmap in store.items():
+                store[key] = np.concatenate([bitmap, np.zeros(size - len(bitmap), dtype=np.uint8)])
+
+    def _set(self, store, key, indexes):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        indexes = indexes[indexes >= 0]
+        if not len(indexes):
+            return
+        with self.lock:
+            self._grow(int(indexes.max()))
+            bitmap = self._bitmap(store, key)
+            np.bitwise_or.at(bitmap, indexes >> 3, (0x80 >> (indexes & 7)).astype(np.uint8))
+
+    def _clear(self, store, key, indexes):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        with self.lock:
+            bitmap = self._bitmap(store, key, create=False)
+            if bitmap is None:
+                return
+            indexes = indexes[(indexes >= 0) & (indexes < self.days)]
+            np.bitwise_and.at(bitmap, indexes >> 3, (~(0x80 >> (indexes & 7))).astype(np.uint8))
+
+    def _mask(self, store, key, start_index, end_index):
+        bitmap = self._bitmap(store, key, create=False)
+        length = end_index - start_index + 1
+        if bitmap is None or length <= 0:
+            return np.zeros(max(length, 0), dtype=bool)
+        mask = np.zeros(length, dtype=bool)
+        low = start_index >> 3
+        high = min((end_index >> 3) + 1, len(bitmap))
+        if high <= low:
+            return mask
+        bits = np.unpackbits(bitmap[low:high]).astype(bool)[start_index - low * 8:]
+        stop = min(length, len(bits))
+        mask[:stop] = bits[:stop]
+        return mask
+
+    def _bounds(self, start, end):
+        start_index = max(to_day_index(start), 0) if start is not None else 0
+        end_index = to_day_index(end) if end is not None else self.days - 1
+        return start_index, end_index
+
+    #-------------------------------------------------------------------------------------------------------#
+
+    def add_days(self, key, days):
+        self._set(self.covered, key, to_day_indexes(list(days)))
+
+    def add_range(self, key, start, end):
+        self._set(self.covered, key, np.arange(to_day_index(start), to_day_index(end) + 1))
+
+    # Monthly files cover every day of their month
+    def add_months(self, key, months):
+        for month in months:
+            first = np.datetime64(month[:7], 'M')
+            start = (first.astype('datetime64[D]') - EPOCH_NP).astype(np.int64).item()
+            end = ((first + 1).astype('datetime64[D]') - EPOCH_NP).astype(np.int64).item()
+            self._set(self.covered, key, np.arange(start, end))
+
+    def remove_days(self, key, days):
+        self._clear(self.covered, key, to_day_indexes(list(days)))
+
+    def remove_months(self, key, months):
+        for month in months:
+            first = np.datetime64(month[:7], 'M')
+            start = (first.astype('datetime64[D]') - EPOCH_NP).astype(np.int64).item()
+            end = ((first + 1).astype('datetime64[D]') - EPOCH_NP).astype(np.int64).item()
+            self._clear(self.covered, key, np.arange(start, end))
+
+    def mark_unavailable(self, key, days):
+        self._set(self.unavailable, key, to_day_indexes(list(days)))
+
+    def keys(self):
+        return list(self.covered.keys())
+
+    #-------------------------------------------------------------------------------------------------------#
+
+    def is_covered(self, key, day):
+        bitmap = self._bitmap(self.covered, key, create=False)
+        index = to_day_index(day)
+        if bitmap is None or index < 0 or index >= self.days:
+            return False
+        return bool((bitmap[index >> 3] >> (7 - (index & 7))) & 1)
+
+    def is_month_covered(self, key, month):
+        first = np.datetime64(month[:7], 'M')
+        start = (first.astype('datetime64[D]') - EPOCH_NP).astype(np.int64).item()
+        end = ((first + 1).astype('datetime64[D]') - EPOCH_NP).astype(np.int64).item() - 1
+        return bool(self._mask(self.covered, key, start, end).all())
+
+    # Days in [start, end] that are neither held nor (optionally) known to be unavailable
+    def missing_days(self, key, start, end, include_unavailable=True):
+        start_index, end_index = self._bounds(start, end)
+        mask = self._mask(self.covered, key, start_index, end_index)
+        if include_unavailable:
+            mask |= self._mask(self.unavailable, key, start_index, end_index)
+        return (EPOCH_NP + start_index + np.flatnonzero(~mask)).tolist()
+
+    # 'YYYY-MM' strings whose every day is held (or known unavailable)
+    def complete_months(self, key, start=None, end=None, include_unavailable=False):
+        start_index, end_index = self._bounds(start, end)
+        if start is None:
+            first = self.first_covered(key)
+            if first is None:
+                return []
+            start_index = to_day_index(first)
+        months, boundaries = month_boundaries(start_index, end_index)
+        mask = self._mask(self.covered, key, boundaries[0], boundaries[-1] - 1)
+        if include_unavailable:
+            mask |= self._mask(self.unavailable, key, boundaries[0], boundaries[-1] - 1)
+        held = np.add.reduceat(mask.astype(np.int32), boundaries[:-1] - boundaries[0])
+        lengths = np.diff(boundaries)
+        return [str(month) for month in months[:-1][held == lengths]]
+
+    def first_covered(self, key):
+        bitmap = self._bitmap(self.covered, key, create=False)
+        if bitmap is None:
+            return None
+        indexes = np.flatnonzero(np.unpackbits(bitmap))
+        return from_day_index(indexes[0]) if len(indexes) else None
+
+    def last_covered(self, key):
+        bitmap = self._bitmap(self.covered, key, create=False)
+        if bitmap is None:
+            return None
+        indexes = np.flatnonzero(np.unpackbits(bitmap))
+        return from_day_index(indexes[-1]) if len(indexes) else None
+
+    #-------------------------------------------------------------------------------------------------------#
+
+    # records are (market, trading_pair, date) tuples, e.g. straight from a storage scan
+    @classmethod
+    def from_records(cls, exchange, records, index=None):
+        index = index or cls()
+        by_key = {}
+        for market, trading_pair, date_str, *_ in records:
+            if date_str:
+                by_key.setdefault((exchange, market, trading_pair), []).append(date_str)
+        for key, dates in by_key.items():
+            months = [d for d in dates if len(d) == 7]
+            days = [d for d in dates if len(d) != 7]
+            if days:
+                index.add_days(key, days)
+            if months:
+                index.add_months(key, months)
+        return index
+
+    # Build the index with one SELECT per table instead of a query per day or month
+    @classmethod
+    def from_catalog(cls, catalog, exchange, tables=("daily", "monthly")):
+        index = cls()
+        for table in tables:
+            cls.from_records(exchange, catalog.get_records(table), index)
+        return index
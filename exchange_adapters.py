@@ -0,0 +1,661 @@
+import os
+import time
+from datetime import date, datetime, timedelta
+from termcolor import colored
+
+import http_pool
+from catalog_backend import get_catalog
+from compressed_files import STORAGE_MODE, codec_of, find_stored, plain_name
+from negative_cache import get_negative_cache
+from symbol_lifecycle import DELISTED_BACKFILL_DAYS
+from symbol_universe import (
+    fetch_json, compact_binance_exchange_info, compact_bybit_tickers,
+    compact_kraken_asset_pairs, compact_bitstamp_pairs,
+)
+
+# pandas and numpy (coverage_index) are imported where they are used
+
+STORAGE_ROOT = os.getenv('STORAGE_ROOT', "/Volumes/rawPriceData")
+
+# What a single fetch ended in
+FETCHED = "fetched"      # new file on disk and in the catalog
+EMPTY = "empty"          # the exchange had the period but no trades, a placeholder was recorded
+HELD = "held"            # already on disk, only the catalog record was missing
+MISSING = "missing"      # the exchange doesn't have it (404, unknown pair, negative cache)
+FAILED = "failed"        # transient error, worth retrying
+
+
+# One feed of one exchange (e.g. Binance daily archives). The runner in ingest.py only talks to
+# adapters through discover_symbols / enumerate_periods / fetch / normalize plus the shared helpers.
+class ExchangeAdapter:
+    name = None                 # feed name on the command line
+    exchange = None             # key in the coverage index and negative cache
+    database_name = None
+    table = "daily"
+    granularity = "daily"       # storage sub directory
+    markets = ()
+    coverage_tables = ("daily", "monthly")
+    max_workers = 8             # symbols worked on concurrently, at most: the per-host AIMD window in http_pool
+                                # decides how many requests actually run
+    empty_streak_limit = None   # stop walking back after this many periods without data
+    retries = 1
+    retry_delay = 3
+
+    def __init__(self, storage_root=None):
+        self.storage_path = os.path.join(storage_root or STORAGE_ROOT, self.exchange, self.granularity)
+        self.catalog = self.make_catalog()
+        self.coverage = None
+
+    def make_catalog(self):
+        return get_catalog(self.database_name)
+
+    #-------------------------------------------------------------------------------------------------------#
+
+    # (symbols, inactive_symbols) currently listed on the market
+    def discover_symbols(self, market):
+        raise NotImplementedError
+
+    # Periods still to fetch for a symbol, newest first. last_day bounds the final pass of a delisted symbol.
+    def enumerate_periods(self, market, symbol, last_day=None):
+        raise NotImplementedError
+
+    # Download one period to file_path() and return one of FETCHED/EMPTY/MISSING/FAILED
+    def fetch(self, market, symbol, period):
+        raise NotImplementedError
+
+    # Bring a freshly fetched file into the repo's column layout, in place
+    def normalize(self, path):
+        pass
+
+    # (symbol, period) for a file name in storage, None for anything else
+    def parse_filename(self, file):
+        raise NotImplementedError
+
+    def file_path(self, market, symbol, period):
+        raise NotImplementedError
+
+    # Where the record's file actually is: the CSV, or the archive it was kept in (see compressed_files.py)
+    def find_file(self, market, symbol, period):
+        return find_stored(self.file_path(market, symbol, period))
+
+    # [start, end) datetimes of the trades a period's file holds
+    def period_span(self, period):
+        if len(period) == 7:
+            start = datetime.strptime(period, '%Y-%m')
+            return start, (start + timedelta(days=32)).replace(day=1)
+        start = datetime.strptime(period[:10], '%Y-%m-%d')
+        return start, start + timedelta(days=1)
+
+    # Whether a walk back should end, has_data is True once the symbol has any file
+    def should_stop(self, empty_streak, has_data, first_csv_known):
+        return self.empty_streak_limit is not None and empty_streak >= self.empty_streak_limit
+
+    #-------------------------------------------------------------------------------------------------------#
+
+    @staticmethod
+    def trading_pair(symbol):
+        return symbol.replace('/', '')
+
+    def scan_storage(self):
+        files_info = []
+        for root, dirs, files in os.walk(self.storage_path):
+            rel_dir = os.path.relpath(root, self.storage_path)
+            market = rel_dir.split(os.path.sep)[0]
+            for file in files:
+                parsed = self.parse_filename(plain_name(file))
+                if parsed:
+                    files_info.append((market, parsed[0], parsed[1]))
+        return files_info
+
+    def reconcile(self, delete=True):
+        inserted, deleted = self.catalog.reconcile(self.table, self.scan_storage(), delete=delete)
+        if inserted or deleted:
+            # Out-of-band changes, rebuild the coverage from the catalog on next use
+            self.coverage = None
+        self.fill_sizes()
+        return inserted, deleted
+
+    # Stat the files of rows recorded without a size, only those, so it is cheap after the first pass
+    def fill_sizes(self):
+        sizes = []
+        for market, pair, period in self.catalog.get_unsized(self.table):
+            path = self.find_file(market, pair, period)
+            if path is not None:
+                sizes.append((market, pair, period, os.path.getsize(path)))
+        if sizes:
+            self.catalog.set_sizes(self.table, sizes)
+        return len(sizes)
+
+    # Average file size per (market, trading_pair), see scheduler.py
+    def volumes(self):
+        return self.catalog.get_volumes(self.table)
+
+    def get_coverage(self):
+        if self.coverage is None and self.coverage_tables:
+            from coverage_index import CoverageIndex
+            self.coverage = CoverageIndex.from_catalog(self.catalog, self.exchange, tables=self.coverage_tables)
+        return self.coverage
+
+    def _cover(self, market, pair, period, covered=True):
+        if self.coverage is None:
+            return
+        key = (self.exchange, market, pair)
+        if len(period) == 7:
+            (self.coverage.add_months if covered else self.coverage.remove_months)(key, [period])
+        else:
+            (self.coverage.add_days if covered else self.coverage.remove_days)(key, [period[:10]])
+
+    # Pull a symbol's rows other nodes may have added into the coverage bitmaps
+    def refresh_coverage(self, market, symbol):
+        if self.coverage is None:
+            return
+        from coverage_index import CoverageIndex
+
+        pair = self.trading_pair(symbol)
+        for table in self.coverage_tables:
+            records = [(market, pair, period) for period in self.catalog.get_dates_for_symbol(table, market, pair)]
+            CoverageIndex.from_records(self.exchange, records, self.coverage)
+
+    def record(self, market, symbol, period, size=None, codec=None):
+        pair = self.trading_pair(symbol)
+        self.catalog.insert_records(self.table, [(market, pair, period, size, codec)])
+        self._cover(market, pair, period)
+
+    # Catalog and coverage update for (market, trading_pair, period[, size]) files that appeared or vanished
+    def apply_changes(self, added=(), removed=()):
+        if removed:
+            self.catalog.delete_records(self.table, removed)
+            if len(self.coverage_tables) > 1:
+                # A deleted daily file may still be covered by its monthly roll-up, rebuild instead
+                self.coverage = None
+            else:
+                for market, pair, period in removed:
+                    self._cover(market, pair, period, covered=False)
+        if added:
+            self.catalog.insert_records(self.table, added)
+            for record in added:
+                self._cover(*record[:3])
+
+    def record_missing(self, market, symbol, period, status=404):
+        get_negative_cache().record_missing(self.exchange, market, symbol, period, status)
+
+    def is_known_missing(self, market, symbol, period):
+        return get_negative_cache().is_known_missing(self.exchange, market, symbol, period)
+
+    def mark_first_csv(self, market, symbol):
+        return self.catalog.mark_first_csv(self.table, market, self.trading_pair(symbol))
+
+    # Earliest first_csv day across the daily and monthly tables
+    def first_csv_day(self, market, symbol):
+        pair = self.trading_pair(symbol)
+        days = []
+        for table in self.coverage_tables:
+            first = self.catalog.get_first_csv(table, market, pair)
+            if first:
+                days.append(date.fromisoformat(first[:10] if len(first) > 7 else f"{first}-01"))
+        return min(days) if days else None
+
+    def has_data(self, market, symbol):
+        coverage = self.get_coverage()
+        if coverage is None:
+            return False
+        return coverage.first_covered((self.exchange, market, self.trading_pair(symbol))) is not None
+
+    # Missing days in [start, end] as 'YYYY-MM-DD', newest first
+    def missing_days(self, market, symbol, start, end):
+        days = self.get_coverage().missing_days((self.exchange, market, self.trading_pair(symbol)), start, end)
+        return [day.strftime('%Y-%m-%d') for day in reversed(days)]
+
+    # Yesterday back to the first csv (or the start of the coverage bitmaps), a delisted
+    # symbol only gets the weeks before it disappeared
+    def walk_back_days(self, market, symbol, last_day=None):
+        from coverage_index import EPOCH
+
+        start = self.first_csv_day(market, symbol) or EPOCH
+        end = date.today() - timedelta(days=1)
+        if last_day:
+            end = min(last_day, end)
+            start = max(start, last_day - timedelta(days=DELISTED_BACKFILL_DAYS))
+        return self.missing_days(market, symbol, start, end)
+
+    # Written under a .part name and renamed once complete, so a kept archive is never half a download
+    def download(self, url, path):
+        with http_pool.stream(url) as response:
+            if response.status_code != 200:
+                return response.status_code, 0
+            size = 0
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".part", 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    f.write(chunk)
+                    size += len(chunk)
+        os.replace(path + ".part", path)
+        return 200, size
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+BINANCE_EXCHANGE_INFO = {
+    "spot": "https://api.binance.com/api/v3/exchangeInfo",
+    "usdm": "https://fapi.binance.com/fapi/v1/exchangeInfo",
+    "coinm": "https://dapi.binance.com/dapi/v1/exchangeInfo"
+}
+BINANCE_MARKET_URLS = {"spot": "spot", "usdm": "futures/um", "coinm": "futures/cm"}
+
+
+# Keep-compressed mode: the archive is the stored file, as long as it is one
+def keep_zip(zip_path, size):
+    import zipfile
+
+    if not zipfile.is_zipfile(zip_path):
+        print(f"Invalid ZIP file: {zip_path}")
+        os.remove(zip_path)
+        return FAILED, 0
+    return FETCHED, size
+
+
+def binance_symbols(market, data, perpetual_only=True):
+    symbols = []
+    inactive = []
+    for symbol in data['symbols']:
+        if market == "usdm" and perpetual_only and symbol.get('contractType') != 'PERPETUAL':
+            continue
+        if symbol.get('contractStatus', symbol.get('status')) == 'TRADING':
+            symbols.append(symbol['symbol'])
+        else:
+            inactive.append(symbol['symbol'])
+    return symbols, inactive
+
+
+class BinanceDailyAdapter(ExchangeAdapter):
+    name = "binance"
+    exchange = "binance"
+    database_name = "binance_csvs"
+    markets = tuple(BINANCE_EXCHANGE_INFO)
+    base_url = "https://data.binance.vision/data"
+    max_workers = 32
+
+    def discover_symbols(self, market):
+        data = fetch_json(BINANCE_EXCHANGE_INFO[market], extract=compact_binance_exchange_info)
+        return binance_symbols(market, data)
+
+    # Older days come from the monthly archives, the daily feed only fills the current month
+    def enumerate_periods(self, market, symbol, last_day=None):
+        end = date.today() - timedelta(days=1)
+        if last_day:
+            end = min(last_day, end)
+        return self.missing_days(market, symbol, date.today().replace(day=1), end)
+
+    def fetch(self, market, symbol, period):
+        import zipfile
+
+        path = self.file_path(market, symbol, period)
+        zip_path = path[:-4] + ".zip"
+        url = f"{self.base_url}/{BINANCE_MARKET_URLS[market]}/daily/trades/{symbol}/{symbol}-trades-{period}.zip"
+        status, size = self.download(url, zip_path)
+        if status == 404:
+            self.record_missing(market, symbol, period, status)
+            return MISSING, 0
+        if status != 200:
+            return FAILED, 0
+        if STORAGE_MODE == "keep":
+            return keep_zip(zip_path, size)
+        try:
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                zip_ref.extractall(os.path.dirname(zip_path))
+        except zipfile.BadZipFile:
+            return FAILED, 0
+        finally:
+            os.remove(zip_path)
+        return FETCHED, size
+
+    def parse_filename(self, file):
+        if not file.endswith('.csv'):
+            return None
+        symbol, _, period = file[:-4].partition('-trades-')
+        return (symbol, period) if len(period) == 10 else None
+
+    def file_path(self, market, symbol, period):
+        return os.path.join(self.storage_path, market, symbol, f"{symbol}-trades-{period}.csv")
+
+
+class BinanceMonthlyAdapter(BinanceDailyAdapter):
+    name = "binance-monthly"
+    table = "monthly"
+    granularity = "monthly"
+    coverage_tables = ("monthly",)
+    max_workers = 8
+    first_month = date(2017, 1, 1)
+
+    # Every uncovered month from the first csv (or 2017) up to last month
+    def enumerate_periods(self, market, symbol, last_day=None):
+        last_month = (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+        if last_day:
+            last_month = min(last_month, last_day.replace(day=1))
+        start = self.first_csv_day(market, symbol) or self.first_month
+        coverage = self.get_coverage()
+        key = (self.exchange, market, self.trading_pair(symbol))
+        periods = []
+        month = last_month
+        while month >= start:
+            period = month.strftime('%Y-%m')
+            if not coverage.is_month_covered(key, period):
+                periods.append(period)
+            month = (month - timedelta(days=1)).replace(day=1)
+        return periods
+
+    # Without a first csv, the first empty month below existing data is where the symbol starts
+    def should_stop(self, empty_streak, has_data, first_csv_known):
+        return not first_csv_known and has_data and empty_streak >= 1
+
+    def fetch(self, market, symbol, period):
+        import zipfile
+
+        path = self.file_path(market, symbol, period)
+        zip_path = path[:-4] + ".zip"
+        url = f"{self.base_url}/{BINANCE_MARKET_URLS[market]}/monthly/trades/{symbol}/{symbol}-trades-{period}.zip"
+        status, size = self.download(url, zip_path)
+        if status == 404:
+            self.record_missing(market, symbol, period, status)
+            return MISSING, 0
+        if status != 200:
+            return FAILED, 0
+        if STORAGE_MODE == "keep":
+            return keep_zip(zip_path, size)
+        try:
+            if not zipfile.is_zipfile(zip_path):
+                print(f"Invalid ZIP file: {zip_path}")
+                return FAILED, 0
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                zip_ref.extractall(os.path.dirname(zip_path))
+        finally:
+            os.remove(zip_path)
+        return FETCHED, size
+
+    def parse_filename(self, file):
+        if not file.endswith('.csv'):
+            return None
+        symbol, _, period = file[:-4].partition('-trades-')
+        return (symbol, period) if len(period) == 7 else None
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+class BybitAdapter(ExchangeAdapter):
+    name = "bybit"
+    exchange = "bybit"
+    database_name = "bybit_csvs"
+    markets = ("spot", "linear", "inverse")
+    archive_urls = {
+        "spot": "https://public.bybit.com/spot",
+        "linear": "https://public.bybit.com/trading",
+        "inverse": "https://public.bybit.com/trading"
+    }
+    max_workers = 32
+    empty_streak_limit = 3
+
+    def discover_symbols(self, market):
+        url = f"https://api-testnet.bybit.com/v5/market/tickers?category={market}"
+        data = fetch_json(url, extract=compact_bybit_tickers)
+        return sorted(item['symbol'] for item in data['result']['list']), []
+
+    def enumerate_periods(self, market, symbol, last_day=None):
+        return self.walk_back_days(market, symbol, last_day)
+
+    def fetch(self, market, symbol, period):
+        import gzip
+        import shutil
+
+        path = self.file_path(market, symbol, period)
+        gzip_path = path + '.gz'
+        status, size = self.download(f"{self.archive_urls[market]}/{symbol}/{symbol}_{period}.csv.gz", gzip_path)
+        if status == 404:
+            self.record_missing(market, symbol, period, status)
+            return MISSING, 0
+        if status != 200:
+            return FAILED, 0
+        if STORAGE_MODE == "keep":
+            # Stays in Bybit's own layout, the readers know it
+            return FETCHED, size
+        with gzip.open(gzip_path, 'rb') as f_in:
+            with open(path, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        os.remove(gzip_path)
+        return FETCHED, size
+
+    # Same reshuffle as bybit-daily-csv.py: timestamp moves to the fourth column, side becomes is-sell
+    def normalize(self, path):
+        import pandas as pd
+
+        if codec_of(path):
+            return
+        with open(path, 'r') as file:
+            first_line = file.readline()
+        header_option = None if first_line.split(',')[0].isdigit() else 0
+        df = pd.read_csv(path, header=header_option)
+        if len(df.columns) < 4:
+            print("DataFrame does not have enough columns to shift.")
+            return
+        second_column = df.iloc[:, 1]
+        df.drop(df.columns[1], axis=1, inplace=True)
+        df.insert(3, 'NewCol', second_column)
+        df[df.columns[4]] = df.iloc[:, 4] == 'sell'
+        df.to_csv(path, index=False, header=bool(header_option))
+
+    def parse_filename(self, file):
+        if not file.endswith('.csv') or '_' not in file:
+            return None
+        symbol, _, period = file[:-4].partition('_')
+        return (symbol, period) if len(period) == 10 else None
+
+    def file_path(self, market, symbol, period):
+        return os.path.join(self.storage_path, market, symbol, f"{symbol}_{period}.csv")
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+class KrakenAdapter(ExchangeAdapter):
+    name = "kraken"
+    exchange = "kraken"
+    database_name = "kraken_csvs"
+    markets = ("spot",)
+    base_url = "https://api.kraken.com/0/public"
+    # The public Trades endpoint is rate limited hard, its request budget (request_budget.py) paces the pages,
+    # a few symbols at once only overlap the parsing
+    max_workers = 3
+    empty_streak_limit = 3
+    max_errors = 3
+
+    def discover_symbols(self, market):
+        data = fetch_json(self.base_url + "/AssetPairs", extract=compact_kraken_asset_pairs)['result']
+        pairs = []
+        for pair_name, pair_info in data.items():
+            if pair_name.endswith('.d'):
+                continue
+            if 'wsname' in pair_info:
+                pairs.append(pair_info['wsname'].replace('XBT', 'BTC'))
+            else:
+                pairs.append(f"{pair_info.get('base').replace('XBT', 'BTC')}/{pair_info.get('quote').replace('XBT', 'BTC')}")
+        return pairs, []
+
+    def enumerate_periods(self, market, symbol, last_day=None):
+        return self.walk_back_days(market, symbol, last_day)
+
+    # Page through the Trades endpoint for one day, same column layout as kraken-daily-csv.py
+    def fetch(self, market, symbol, period):
+        import pandas as pd
+
+        start = int(datetime.strptime(period, '%Y-%m-%d').timestamp())
+        end = start + 86400
+        since = start
+        pages = []
+        errors = 0
+        size = 0
+        api_symbol = symbol.replace('XBT', 'BTC')
+        while errors < self.max_errors:
+            try:
+                response = http_pool.get(f"{self.base_url}/Trades?pair={api_symbol}&since={since}")
+            except Exception as e:
+                print(f"Error encountered while downloading data for {symbol} on {period}: {e}")
+                errors += 1
+                continue
+            if response.status_code != 200:
+                print(f"Error fetching data for {symbol} on {period}: {response.status_code}")
+                errors += 1
+                continue
+            size += len(response.content)
+            data = response.json()
+            if any('Unknown asset pair' in error for error in data.get('error', [])):
+                self.record_missing(market, symbol, period, response.status_code)
+                return MISSING, 0
+            if any('Rate limit' in error or 'Too many requests' in error for error in data.get('error', [])):
+                # Kraken throttles with a 200 and an error body
+                http_pool.report_throttle(self.base_url)
+                errors += 1
+                time.sleep(self.retry_delay)
+                continue
+            trades = data.get('result', {}).get(symbol)
+            if not trades:
+                break
+            df = pd.DataFrame(trades, columns=['price', 'volume', 'time', 'buy_sell', 'market_limit', 'misc', 'trade_id'])
+            df['time'] = (df['time'].astype(float) * 1000).astype('int64')
+            pages.append(df[(df['time'] >= start * 1000) & (df['time'] <= end * 1000)])
+            if df['time'].max() >= end * 1000:
+                break
+            since = int(data['result']['last'])
+        else:
+            return FAILED, 0
+
+        path = self.file_path(market, symbol, period)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not pages:
+            return FAILED, 0
+        day = pd.concat(pages, ignore_index=True)
+        if day.empty:
+            # Placeholder so the day is not asked for again
+            day.to_csv(path, index=False, header=False)
+            return EMPTY, size
+        day['isbuyermaker'] = ((day['buy_sell'] == 'b') & (day['market_limit'] == 'l')) | ((day['buy_sell'] == 's') & (day['market_limit'] == 'm'))
+        day.drop(['buy_sell', 'market_limit', 'misc'], axis=1, inplace=True)
+        day.rename(columns={'volume': 'qty'}, inplace=True)
+        day = day[['trade_id'] + [col for col in day.columns if col != 'trade_id']]
+        day.to_csv(path, index=False, header=False)
+        return FETCHED, size
+
+    def parse_filename(self, file):
+        if not file.endswith('.csv'):
+            return None
+        symbol, _, period = file[:-4].partition('-trades-')
+        return (symbol, period) if len(period) == 10 else None
+
+    def file_path(self, market, symbol, period):
+        pair = self.trading_pair(symbol)
+        return os.path.join(self.storage_path, market, pair, f"{pair}-trades-{period}.csv")
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+class BitstampAdapter(ExchangeAdapter):
+    name = "bitstamp"
+    exchange = "bitstamp"
+    database_name = "bitstamp_csvs"
+    markets = ("spot",)
+    base_url = "https://www.bitstamp.net"
+    coverage_tables = ()
+    max_workers = 4
+    time_frame = "day"
+    time_window = timedelta(days=1)
+
+    # Same .env credentials as bitstamp-daily.py, MYSQL_DATABASE only picks the MySQL schema
+    def make_catalog(self):
+        from dotenv import load_dotenv
+        load_dotenv()  # Load environment variables from .env file
+        return get_catalog(
+            self.database_name,
+            mysql_path="/opt/homebrew/bin/mysql",
+            connection_args=["-h", os.getenv('MYSQL_HOST'), "-u", os.getenv('MYSQL_USER'), "-p" + (os.getenv('MYSQL_PASSWORD') or "")],
+            schema=os.getenv('MYSQL_DATABASE')
+        )
+
+    def discover_symbols(self, market):
+        pairs = fetch_json(f"{self.base_url}/api/v2/trading-pairs-info/", extract=compact_bitstamp_pairs)
+        # Files and catalog rows use the upper-cased symbol
+        return [pair['url_symbol'].upper() for pair in pairs if pair['trading'] == "Enabled"], []
+
+    # Transactions are a rolling window, every run takes one snapshot stamped with the current minute
+    def enumerate_periods(self, market, symbol, last_day=None):
+        if last_day:
+            return []
+        return [datetime.now().strftime('%Y-%m-%d %H:%M')]
+
+    def fetch(self, market, symbol, period):
+        import pandas as pd
+
+        response = http_pool.get(f"{self.base_url}/api/v2/transactions/{symbol.lower()}/?time={self.time_frame}")
+        if response.status_code == 404:
+            return MISSING, 0
+        if response.status_code != 200:
+            print(colored(f"Failed to fetch data for {symbol} ({self.time_frame}): {response.status_code}", 'red'))
+            return FAILED, 0
+        df = pd.DataFrame(response.json())
+        if df.shape[1] >= 4:
+            # Reorder columns: 4th, 3rd, 1st, 2nd, 5th, 6th, ...
+            new_order = [3, 2] + list(range(df.shape[1]))
+            df = df.iloc[:, sorted(set(new_order), key=new_order.index)]
+        path = self.file_path(market, symbol, period)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_csv(path, index=False, header=False)
+        return FETCHED, len(response.content)
+
+    # A snapshot holds the window of transactions before it was taken
+    def period_span(self, period):
+        end = datetime.strptime(period, '%Y-%m-%d %H:%M')
+        return end - self.time_window, end
+
+    def parse_filename(self, file):
+        if not file.endswith('.csv'):
+            return None
+        symbol, _, stamp = file[:-4].partition('-trades-')
+        try:
+            return symbol, datetime.strptime(stamp, '%Y-%m-%d-%H%M').strftime('%Y-%m-%d %H:%M')
+        except ValueError:
+            return None
+
+    def file_path(self, market, symbol, period):
+        stamp = period.replace(' ', '-').replace(':', '')
+        return os.path.join(self.storage_path, market, symbol, f"{symbol}-trades-{stamp}.csv")
+
+
+class BitstampHourlyAdapter(BitstampAdapter):
+    name = "bitstamp-hourly"
+    table = "hourly"
+    granularity = "hourly"
+    time_frame = "hour"
+    time_window = timedelta(hours=1)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+ADAPTERS = {
+    adapter.name: adapter
+    for adapter in (BinanceDailyAdapter, BinanceMonthlyAdapter, BybitAdapter, KrakenAdapter,
+                    BitstampAdapter, BitstampHourlyAdapter)
+}
+
+
+# Feed names, or exchange names selecting all of their feeds
+def select_adapters(names=None):
+    if not names:
+        return list(ADAPTERS.values())
+    selected = []
+    for name in names:
+        matches = [a for a in ADAPTERS.values() if name in (a.name, a.exchange)]
+        if not matches:
+            raise ValueError(f"Unknown exchange or feed: {name} (known: {', '.join(ADAPTERS)})")
+        selected += [a for a in matches if a not in selected]
+    return selected
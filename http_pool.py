@@ -0,0 +1,126 @@
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from adaptive_concurrency import AIMDController
+from request_budget import get_budget
+
+# Connections kept open per host, shared by every thread and exchange in the process
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 32))
+HTTP_TIMEOUT = int(os.getenv('HTTP_TIMEOUT', 60))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_controllers = {}
+
+
+def host_of(url):
+    return urlsplit(url).netloc
+
+
+# One keep-alive session per host, so repeated archive downloads reuse their TLS connections
+def get_session(url):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    host = host_of(url)
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return session
+
+
+# Per-host AIMD limit on requests in flight, see adaptive_concurrency.py
+def get_controller(url):
+    host = host_of(url)
+    with _sessions_lock:
+        controller = _controllers.get(host)
+        if controller is None:
+            controller = _controllers[host] = AIMDController(host)
+        return controller
+
+
+def elapsed(response):
+    return response.elapsed.total_seconds() if getattr(response, 'elapsed', None) is not None else None
+
+
+# Charges a streamed body to the bandwidth budget as it is read, .content included
+def metered(response):
+    iter_content = response.iter_content
+    budget = get_budget()
+
+    def metered_iter_content(chunk_size=1, decode_unicode=False):
+        for chunk in iter_content(chunk_size, decode_unicode):
+            budget.consume_bytes(len(chunk))
+            yield chunk
+
+    response.iter_content = metered_iter_content
+    return response
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    budget = get_budget()
+    budget.acquire(url)
+    controller = get_controller(url)
+    controller.acquire()
+    response = None
+    try:
+        response = get_session(url).get(url, **kwargs)
+        budget.observe(url, response)
+        if kwargs.get('stream'):
+            return metered(response)
+        budget.consume_bytes(len(response.content), wait=False)
+        return response
+    finally:
+        controller.release(response.status_code if response is not None else None,
+                           elapsed(response) if response is not None else None)
+
+
+# Streamed download that holds its host slot until the body has been read and the response closed
+@contextmanager
+def stream(url, **kwargs):
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    budget = get_budget()
+    budget.acquire(url)
+    controller = get_controller(url)
+    controller.acquire()
+    response = None
+    try:
+        response = get_session(url).get(url, stream=True, **kwargs)
+        budget.observe(url, response)
+        yield metered(response)
+    finally:
+        if response is not None:
+            response.close()
+        controller.release(response.status_code if response is not None else None,
+                           elapsed(response) if response is not None else None)
+
+
+def report_throttle(url):
+    get_controller(url).report_throttle()
+    get_budget().penalize(url)
+
+
+# {host: window, in-flight, latency...} for the metrics and the daemon's status page
+def concurrency_snapshot():
+    with _sessions_lock:
+        controllers = dict(_controllers)
+    return {host: controller.snapshot() for host, controller in sorted(controllers.items())}
+
+
+def budget_snapshot():
+    return get_budget().snapshot()
+
+
+def close_all():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
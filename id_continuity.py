@@ -0,0 +1,277 @@
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from termcolor import colored
+
+from catalog_schema import TRADE_ID_GAP_TABLE
+from seek_index import index_path, iter_blocks
+
+# Raw CSV column holding the trade id, for the exchanges whose ids count up by one per trade and symbol, so
+# any jump is trades lost from the file. Bybit derivative ids are row numbers and Bitstamp's tids are shared
+# by every pair, there is nothing to check there.
+ID_COLUMNS = {"binance": "f0", "kraken": "f0"}
+# Check a file right after it is fetched, see ingest.py
+ID_CHECK_ON_WRITE = os.getenv('ID_CHECK_ON_WRITE', '1') == '1'
+ID_CHECK_WORKERS = int(os.getenv('ID_CHECK_WORKERS', 4))
+# Ranges kept per file, a file in the wrong order would otherwise fill the table. id_breaks counts them all.
+ID_BREAK_ROWS = 1000
+# Catalog rows written per batch, so an interrupted pass over the archive keeps most of its progress
+FLAG_BATCH = 500
+# Stored files moved aside for a new download get this suffix, which no adapter reads
+BAD_SUFFIX = ".bad"
+
+GAP = "gap"              # ids missing between two trades of a file
+OVERLAP = "overlap"      # ids seen again, or going backwards, within a file
+BOUNDARY = "boundary"    # ids missing between a file's last trade and the next period's first
+
+
+# Trade ids of a block of whole CSV lines, only their column parsed
+def read_ids(block, column):
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    table = pv.read_csv(
+        pa.BufferReader(block),
+        read_options=pv.ReadOptions(autogenerate_column_names=True, use_threads=False),
+        convert_options=pv.ConvertOptions(include_columns=[column], column_types={column: pa.int64()}),
+    )
+    return table[column].to_numpy()
+
+
+# (kind, first_id, last_id, ids) of every step between consecutive ids that isn't +1, `previous` being
+# the id just before them. Returns at most `keep` ranges, and how many there are.
+def find_breaks(ids, previous=None, keep=ID_BREAK_ROWS):
+    import numpy as np
+
+    if previous is not None:
+        ids = np.concatenate((np.array([previous], dtype=ids.dtype), ids))
+    at = np.flatnonzero(np.diff(ids) != 1)
+    breaks = []
+    for before, after in zip(ids[at[:keep]].tolist(), ids[at[:keep] + 1].tolist()):
+        if after > before:
+            breaks.append((GAP, before + 1, after - 1, after - before - 1))
+        else:
+            breaks.append((OVERLAP, after, before, before - after + 1))
+    return breaks, len(at)
+
+
+# (first_id, last_id, breaks, count) of a stored raw file, read INDEX_CHUNK at a time so memory stays flat
+# for multi-GB monthly files. The last id of a block is carried into the next, no break hides at a cut.
+def scan_file(path, exchange, chunk=None):
+    column = ID_COLUMNS[exchange]
+    first = last = None
+    breaks, count = [], 0
+    for _, block in iter_blocks(path, chunk):
+        ids = read_ids(block, column)
+        if not len(ids):
+            continue
+        found, found_count = find_breaks(ids, last, ID_BREAK_ROWS - len(breaks))
+        breaks += found
+        count += found_count
+        if first is None:
+            first = int(ids[0])
+        last = int(ids[-1])
+    return first, last, breaks, count
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Catalog updates for (market, trading_pair, period, first_id, last_id, breaks, count) scan results: the
+# file's range and break count on its record, its ranges in the gap table in place of earlier ones
+def save_results(adapter, results):
+    catalog = adapter.catalog
+    now = time.time()
+    statements = []
+    for market, pair, period, first, last, breaks, count in results:
+        statements.append((
+            f"DELETE FROM {TRADE_ID_GAP_TABLE} WHERE source_table = ? AND market = ? AND trading_pair = ? "
+            f"AND date = ? AND kind <> ?;", (adapter.table, market, pair, period, BOUNDARY)))
+        if breaks:
+            statements.append((
+                f"{catalog.insert_ignore} INTO {TRADE_ID_GAP_TABLE} "
+                f"(source_table, market, trading_pair, date, kind, first_id, last_id, ids, detected_at) VALUES "
+                + ", ".join("(?, ?, ?, ?, ?, ?, ?, ?, ?)" for _ in breaks) + ";",
+                [value for found in breaks for value in (adapter.table, market, pair, period, *found, now)]))
+    catalog.execute_many(statements)
+    catalog.set_id_checks(adapter.table, [
+        (market, pair, period, first, last, count) for market, pair, period, first, last, _, count in results
+    ])
+
+
+# Ids missing between the last trade of one file and the first of the next period's, from the ranges in the
+# catalog. Recorded against both files, either may be the truncated one. Repeats at a boundary are left
+# alone. Returns the number of boundaries with a gap.
+def check_boundaries(adapter, market, pair):
+    ranges = [(period, int(first), int(last)) for period, first, last in adapter.catalog.get_id_ranges(adapter.table, market, pair)]
+    found = []
+    for (before, _, before_last), (after, after_first, _) in zip(ranges, ranges[1:]):
+        if after_first > before_last + 1 and adapter.period_span(before)[1] == adapter.period_span(after)[0]:
+            for period in (before, after):
+                found.append((period, BOUNDARY, before_last + 1, after_first - 1, after_first - before_last - 1))
+    now = time.time()
+    statements = [(
+        f"DELETE FROM {TRADE_ID_GAP_TABLE} WHERE source_table = ? AND market = ? AND trading_pair = ? AND kind = ?;",
+        (adapter.table, market, pair, BOUNDARY))]
+    if found:
+        statements.append((
+            f"{adapter.catalog.insert_ignore} INTO {TRADE_ID_GAP_TABLE} "
+            f"(source_table, market, trading_pair, date, kind, first_id, last_id, ids, detected_at) VALUES "
+            + ", ".join("(?, ?, ?, ?, ?, ?, ?, ?, ?)" for _ in found) + ";",
+            [value for row in found for value in (adapter.table, market, pair, *row, now)]))
+    adapter.catalog.execute_many(statements)
+    return len(found) // 2
+
+
+# Checks one recorded file and its boundaries with the neighbouring periods. Returns the breaks found.
+def check_file(adapter, market, symbol, period):
+    pair = adapter.trading_pair(symbol)
+    path = adapter.find_file(market, pair, period)
+    if path is None:
+        raise FileNotFoundError(adapter.file_path(market, pair, period))
+    first, last, breaks, count = scan_file(path, adapter.exchange)
+    save_results(adapter, [(market, pair, period, first, last, breaks, count)])
+    return count + check_boundaries(adapter, market, pair)
+
+
+# Scans an adapter's files not checked yet (all of them with force) in parallel, then the boundaries of
+# every pair it touched. Returns (files checked, files with breaks, boundaries with gaps).
+def check_adapter(adapter, force=False, workers=ID_CHECK_WORKERS, limit=None, metrics=None):
+    if adapter.exchange not in ID_COLUMNS:
+        print(colored(f"{adapter.name}: trade ids are not continuous, nothing to check", 'yellow'))
+        return 0, 0, 0
+    if force:
+        records = adapter.catalog.get_records(adapter.table)
+    else:
+        records = adapter.catalog.get_unchecked_ids(adapter.table)
+    records = [tuple(record[:3]) for record in records][:limit]
+    if not records:
+        return 0, 0, 0
+
+    started = time.time()
+    results = []
+    checked = broken = failed = 0
+
+    def scan(market, pair, period):
+        path = adapter.find_file(market, pair, period)
+        if path is None:
+            return None
+        return scan_file(path, adapter.exchange)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(scan, *record): record for record in records}
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                scanned = future.result()
+            except Exception as e:
+                print(colored(f"{adapter.name}: could not check {' '.join(record)}: {e}", 'red'))
+                failed += 1
+                continue
+            if scanned is None:
+                continue
+            checked += 1
+            if scanned[3]:
+                broken += 1
+                print(colored(f"{adapter.name}: {' '.join(record)} has {scanned[3]} id breaks", 'red'))
+            results.append(record + scanned)
+            if len(results) >= FLAG_BATCH:
+                save_results(adapter, results)
+                results = []
+    if results:
+        save_results(adapter, results)
+
+    boundaries = sum(check_boundaries(adapter, market, pair) for market, pair in sorted({record[:2] for record in records}))
+    elapsed = time.time() - started
+    if metrics is not None:
+        metrics.incr("id_checked_files", adapter.name, value=checked)
+        metrics.incr("id_broken_files", adapter.name, value=broken)
+    print(colored(f"{adapter.name}: checked trade ids of {checked} files in {elapsed:.1f}s, {broken} with breaks, "
+                  f"{boundaries} boundary gaps, {failed} failed", 'green' if not (broken or boundaries or failed) else 'yellow'))
+    return checked, broken, boundaries
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# (market, trading_pair, date) of the recorded files with ranges in the gap table
+def broken_records(adapter):
+    return adapter.catalog.query(
+        f"SELECT DISTINCT g.market, g.trading_pair, g.date FROM {TRADE_ID_GAP_TABLE} g "
+        f"JOIN {adapter.table} r ON r.market = g.market AND r.trading_pair = g.trading_pair AND r.date = g.date "
+        f"WHERE g.source_table = ? ORDER BY g.market, g.trading_pair, g.date;", (adapter.table,))
+
+
+# Moves the broken files aside as <file>.bad, drops their catalog records and queues their periods for
+# download again: the next ingest run (or --resume) fetches them anew and checks them as they are written.
+# Their gap ranges stay until then. Returns the number of tasks queued.
+def redownload(adapter, records, queue=None):
+    from symbol_lifecycle import SymbolLifecycle
+    from work_queue import get_work_queue
+
+    lifecycle = SymbolLifecycle(adapter.catalog)
+    symbols = {}
+    tasks = []
+    for market, pair, period in records:
+        if market not in symbols:
+            # The exchange's own symbol (BTC/USD for BTCUSD on Kraken), as ingest passes it to fetch()
+            symbols[market] = {known: info["symbol"] for known, info in lifecycle.load(market).items()}
+        path = adapter.find_file(market, pair, period)
+        if path is not None:
+            os.replace(path, path + BAD_SUFFIX)
+            if os.path.exists(index_path(path)):
+                os.remove(index_path(path))
+        tasks.append((market, symbols[market].get(pair, pair), period))
+    adapter.apply_changes(removed=[tuple(record) for record in records])
+    queued = (queue or get_work_queue()).enqueue(adapter.name, tasks)
+    print(colored(f"{adapter.name}: moved {len(tasks)} broken files aside, {queued} periods queued for download", 'cyan'))
+    return queued
+
+
+# Ranges in the gap table by kind, and the files missing the most ids
+def report(adapter, top=20):
+    rows = adapter.catalog.query(
+        f"SELECT kind, COUNT(*), SUM(ids) FROM {TRADE_ID_GAP_TABLE} WHERE source_table = ? GROUP BY kind;",
+        (adapter.table,))
+    if not rows:
+        print(colored(f"{adapter.name}: no trade id breaks recorded", 'green'))
+        return
+    for kind, ranges, ids in rows:
+        print(colored(f"{adapter.name}: {ranges} {kind} ranges, {ids} ids", 'yellow'))
+    worst = adapter.catalog.query(
+        f"SELECT market, trading_pair, date, SUM(ids) AS total FROM {TRADE_ID_GAP_TABLE} WHERE source_table = ? "
+        f"GROUP BY market, trading_pair, date ORDER BY total DESC LIMIT {int(top)};", (adapter.table,))
+    for market, pair, period, ids in worst:
+        print(f"  {market} {pair} {period}: {ids} ids")
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    from exchange_adapters import ADAPTERS, select_adapters
+
+    parser = argparse.ArgumentParser(description="Check that stored trade ids run without gaps, and queue broken files again.")
+    parser.add_argument("exchanges", nargs="*",
+                        help=f"Exchanges or feeds, default those with continuous ids. Feeds: {', '.join(ADAPTERS)}")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    parser.add_argument("--force", action="store_true", help="Check every file again, not only the unchecked ones.")
+    parser.add_argument("--workers", type=int, default=ID_CHECK_WORKERS, help="Files scanned at once.")
+    parser.add_argument("--limit", type=int, help="At most this many files per feed.")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="Move files with breaks aside and queue their periods for download again.")
+    parser.add_argument("--report", action="store_true", help="Only show the recorded breaks.")
+    args = parser.parse_args()
+
+    for adapter_class in select_adapters(args.exchanges or sorted(ID_COLUMNS)):
+        adapter = adapter_class(args.storage_root)
+        if args.report:
+            report(adapter)
+            continue
+        check_adapter(adapter, force=args.force, workers=args.workers, limit=args.limit)
+        if args.enqueue:
+            records = broken_records(adapter)
+            if records:
+                redownload(adapter, records)
@@ -0,0 +1,392 @@
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from termcolor import colored
+
+import http_pool
+from compressed_files import codec_of
+from exchange_adapters import ADAPTERS, select_adapters, FETCHED, EMPTY, HELD, MISSING, FAILED
+from id_continuity import ID_CHECK_ON_WRITE, ID_COLUMNS, check_file
+from ingest_metrics import Metrics
+from negative_cache import get_negative_cache
+from scheduler import PriorityScheduler, make_units
+from seek_index import SEEK_INDEX_ON_WRITE, SeekIndex
+from shard_leases import ShardLeases
+from symbol_lifecycle import SymbolLifecycle
+import work_queue
+
+# Worker threads shared by every exchange, each adapter's max_workers caps its own share
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 32))
+# Symbols a sharded node holds per feed at once, the rest stays claimable by other nodes
+SHARD_BATCH = int(os.getenv('SHARD_BATCH', 16))
+
+# What a fetch outcome leaves the period's task in
+TASK_STATES = {
+    FETCHED: work_queue.DONE,
+    EMPTY: work_queue.DONE,
+    HELD: work_queue.DONE,
+    MISSING: work_queue.NOT_FOUND,
+    FAILED: work_queue.FAILED,
+}
+
+
+# Runs any set of exchange adapters concurrently in one process. They share the worker pool,
+# the HTTP sessions (http_pool), the catalog connections, the negative cache and the metrics.
+class Ingestor:
+
+    def __init__(self, adapters, workers=None, markets=None, dry_run=False, metrics=None, queue=None, shards=None,
+                 shard_batch=None):
+        self.adapters = adapters
+        self.markets = set(markets) if markets else None
+        self.dry_run = dry_run
+        self.metrics = metrics or Metrics()
+        # Optional work_queue.WorkQueue: planned periods are persisted, so an interrupted run can resume
+        self.queue = queue if not dry_run else None
+        self.owner = work_queue.lease_owner()
+        # Optional shard_leases.ShardLeases: symbols are claimed from the catalog so several nodes can share it
+        self.shards = shards if not dry_run else None
+        self.shard_batch = shard_batch or SHARD_BATCH
+        self.shard_condition = threading.Condition()
+        self.held = {}
+        self.run_started = {}
+        self.workers = workers or INGEST_WORKERS
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        self.lifecycles = {}
+        # Set to wind down: symbols stop after their current period, nothing new is submitted
+        self.stop_event = threading.Event()
+
+    # One period of one symbol: skip what's known, fetch with retries, normalize and record
+    def fetch_period(self, adapter, market, symbol, period):
+        labels = (adapter.name, market)
+        size = 0
+        path = adapter.find_file(market, symbol, period)
+
+        if adapter.is_known_missing(market, symbol, period):
+            outcome = MISSING
+            self.metrics.incr("known_missing", *labels)
+        elif path is not None:
+            adapter.record(market, symbol, period, os.path.getsize(path), codec_of(path))
+            outcome = HELD
+        else:
+            for attempt in range(adapter.retries + 1):
+                if attempt:
+                    time.sleep(adapter.retry_delay)
+                start = time.perf_counter()
+                try:
+                    outcome, size = adapter.fetch(market, symbol, period)
+                except Exception as e:
+                    print(colored(f"{adapter.name} {market} {symbol} {period}: {e}", 'red'))
+                    outcome, size = FAILED, 0
+                self.metrics.observe("fetch_seconds", time.perf_counter() - start, adapter.name)
+                if outcome != FAILED:
+                    break
+
+            if outcome == FETCHED:
+                # The CSV, or the archive when kept compressed
+                path = adapter.find_file(market, symbol, period)
+                adapter.normalize(path)
+                if SEEK_INDEX_ON_WRITE:
+                    try:
+                        SeekIndex.build(path, adapter.exchange, market).save(path)
+                    except Exception as e:
+                        print(colored(f"{adapter.name}: no seek index for {path}: {e}", 'yellow'))
+                adapter.record(market, symbol, period, os.path.getsize(path), codec_of(path))
+                print(colored(f"{adapter.name}: saved {market} {symbol} {period}", 'green'))
+                if ID_CHECK_ON_WRITE and adapter.exchange in ID_COLUMNS:
+                    try:
+                        breaks = check_file(adapter, market, symbol, period)
+                    except Exception as e:
+                        print(colored(f"{adapter.name}: could not check trade ids of {path}: {e}", 'yellow'))
+                    else:
+                        if breaks:
+                            self.metrics.incr("id_breaks", *labels, value=breaks)
+                            print(colored(f"{adapter.name}: {market} {symbol} {period} has {breaks} trade id breaks", 'red'))
+            elif outcome == EMPTY:
+                adapter.record(market, symbol, period, 0)
+
+        self.metrics.incr("periods", *labels, outcome)
+        if size:
+            self.metrics.incr("bytes", *labels, value=size)
+        return outcome
+
+    # Walk one unit of a symbol's periods newest first, stopping where the adapter says the history ends.
+    # The walk state is handed to the unit's backfill follow-up, which the scheduler queues next.
+    def run_unit(self, scheduler, unit):
+        adapter, market, symbol = unit.adapter, unit.market, unit.symbol
+        error = False
+        try:
+            periods = unit.periods
+            if self.dry_run:
+                print(f"{adapter.name} {market} {symbol}: {len(periods)} {unit.priority_class} periods to fetch")
+                self.metrics.incr("planned", adapter.name, market, value=len(periods))
+                return
+            if self.queue is not None:
+                # Another process may hold some of them
+                periods = self.queue.lease(adapter.name, market, symbol, self.owner, periods)
+
+            first_csv_known = adapter.first_csv_day(market, symbol) is not None
+            has_data = unit.has_data if unit.has_data is not None else adapter.has_data(market, symbol)
+            empty_streak = unit.empty_streak
+            failed = unit.failed
+            for period in periods:
+                if self.stop_event.is_set():
+                    unit.stopped = True
+                    return
+                outcome = self.fetch_period(adapter, market, symbol, period)
+                if self.queue is not None:
+                    self.queue.finish(adapter.name, market, symbol, period, TASK_STATES[outcome], self.owner)
+                if outcome in (FETCHED, HELD):
+                    has_data = True
+                    empty_streak = 0
+                elif outcome == FAILED:
+                    # Not evidence the history ended: the streak stands, the queue retries the period
+                    failed = True
+                    continue
+                else:
+                    empty_streak += 1
+                if adapter.should_stop(empty_streak, has_data, first_csv_known):
+                    if has_data:
+                        first = adapter.mark_first_csv(market, symbol)
+                        print(colored(f"{adapter.name}: first csv for {market} {symbol} is {first}", 'blue'))
+                    if self.queue is not None:
+                        self.queue.drop(adapter.name, market, symbol, self.owner, period)
+                    unit.stopped = True
+                    break
+
+            ended = unit.stopped or unit.follow_up is None
+            if unit.follow_up is not None:
+                unit.follow_up.empty_streak = empty_streak
+                unit.follow_up.has_data = has_data
+                unit.follow_up.failed = failed
+            # A delisted symbol's last pass is only over once none of it failed
+            if ended and unit.last_day and not failed:
+                self.lifecycles[adapter.name].finish_backfill(market, symbol)
+        except Exception as e:
+            print(colored(f"{adapter.name} {market} {symbol} failed: {e}", 'red'))
+            self.metrics.incr("symbol_errors", adapter.name, market)
+            unit.stopped = True
+            error = True
+        finally:
+            if self.queue is not None:
+                self.queue.release(adapter.name, market, symbol, self.owner)
+            if self.shards is not None and (unit.stopped or unit.follow_up is None):
+                self.release_shard(adapter, market, symbol, completed=not error and not self.stop_event.is_set())
+            scheduler.done(unit)
+
+    # Discover one market: [(symbol, last_day)] to work on, see SymbolLifecycle.plan
+    def plan_market(self, adapter, lifecycle, market):
+        try:
+            symbols, inactive = adapter.discover_symbols(market)
+        except Exception as e:
+            print(colored(f"{adapter.name}: could not list {market} symbols: {e}", 'red'))
+            return []
+        self.metrics.gauge("symbols", len(symbols), adapter.name, market)
+        if not self.dry_run:
+            lifecycle.observe(market, symbols, inactive_symbols=inactive)
+        return lifecycle.plan(market, symbols)
+
+    # Periods of the given symbols into units for the scheduler. With a queue the work is whatever it
+    # holds for them: this run's plan plus what interrupted runs left behind. Resuming only takes the
+    # latter. Returns the symbols that turned out to have nothing to do.
+    def schedule(self, adapter, scheduler, market, planned, volumes, resume=False):
+        work = [
+            (symbol, last_day, [] if resume else adapter.enumerate_periods(market, symbol, last_day))
+            for symbol, last_day in planned
+        ]
+        if self.queue is not None:
+            queued = self.queue.enqueue(adapter.name, [
+                (market, symbol, period) for symbol, last_day, periods in work for period in periods
+            ])
+            self.metrics.incr("enqueued", adapter.name, market, value=queued)
+            pending = self.queue.pending(adapter.name, market)
+            work = [(symbol, last_day, pending.get((market, symbol), [])) for symbol, last_day, _ in work]
+
+        idle = []
+        for symbol, last_day, periods in work:
+            # Delisted symbols with nothing left still get their backfill closed
+            if periods or last_day:
+                volume = volumes.get((market, adapter.trading_pair(symbol)))
+                scheduler.push(make_units(adapter, market, symbol, periods, last_day, volume))
+            else:
+                idle.append(symbol)
+        return idle
+
+    # Claim shards as earlier ones finish, never holding more than shard_batch of the adapter's symbols
+    def schedule_sharded(self, adapter, scheduler, market, planned, volumes, resume=False):
+        by_pair = {adapter.trading_pair(symbol): (symbol, last_day) for symbol, last_day in planned}
+        remaining = list(by_pair)
+        while remaining and not self.stop_event.is_set():
+            with self.shard_condition:
+                while self.held.get(adapter.name, 0) >= self.shard_batch and not self.stop_event.is_set():
+                    self.shard_condition.wait(5)
+                free = self.shard_batch - self.held.get(adapter.name, 0)
+            claimed, skipped = self.shards.claim(adapter.catalog, adapter.name, market, remaining, free, since=self.run_started[adapter.name])
+            done = set(claimed) | set(skipped)
+            remaining = [pair for pair in remaining if pair not in done]
+            if skipped:
+                self.metrics.incr("shards_skipped", adapter.name, market, value=len(skipped))
+            if not claimed:
+                continue
+
+            with self.shard_condition:
+                self.held[adapter.name] = self.held.get(adapter.name, 0) + len(claimed)
+            self.metrics.incr("shards_claimed", adapter.name, market, value=len(claimed))
+            for pair in claimed:
+                # Other nodes may have filled in this symbol since our coverage was built
+                adapter.refresh_coverage(market, by_pair[pair][0])
+            idle = self.schedule(adapter, scheduler, market, [by_pair[pair] for pair in claimed], volumes, resume)
+            for symbol in idle:
+                self.release_shard(adapter, market, symbol, completed=True)
+
+    def release_shard(self, adapter, market, symbol, completed):
+        self.shards.release(adapter.catalog, adapter.name, market, adapter.trading_pair(symbol), completed)
+        with self.shard_condition:
+            self.held[adapter.name] -= 1
+            self.shard_condition.notify_all()
+
+    # Planning thread of one adapter, feeds the scheduler market by market
+    def plan_adapter(self, adapter, scheduler, reconcile=True, resume=False):
+        self.run_started[adapter.name] = time.time()
+        try:
+            if reconcile and not resume and not self.dry_run:
+                # Sharded nodes may each hold part of the storage, and never delete each other's rows
+                inserted, deleted = adapter.reconcile(delete=self.shards is None)
+                print(colored(f"{adapter.name}: reconciled {adapter.table} records: {inserted} inserted, {deleted} deleted", 'yellow'))
+
+            lifecycle = self.lifecycles[adapter.name] = SymbolLifecycle(adapter.catalog)
+            volumes = adapter.volumes()
+            for market in adapter.markets:
+                if self.stop_event.is_set():
+                    break
+                if self.markets and market not in self.markets:
+                    continue
+                planned = [] if resume else self.plan_market(adapter, lifecycle, market)
+                if self.queue is not None:
+                    known = {symbol for symbol, _ in planned}
+                    planned += [
+                        (symbol, None) for _, symbol in self.queue.pending(adapter.name, market) if symbol not in known
+                    ]
+                if self.shards is not None:
+                    self.schedule_sharded(adapter, scheduler, market, planned, volumes, resume)
+                else:
+                    self.schedule(adapter, scheduler, market, planned, volumes, resume)
+        except Exception as e:
+            print(colored(f"{adapter.name} failed: {e}", 'red'))
+            self.metrics.incr("adapter_errors", adapter.name)
+        finally:
+            scheduler.producer_done()
+
+    # One pass over the given adapters (default all). Each plans in its own thread while this one hands
+    # the units to the workers in priority order, each adapter's max_workers capping its share.
+    def run_adapters(self, adapters=None, reconcile=True, resume=False):
+        adapters = adapters or self.adapters
+        scheduler = PriorityScheduler(workers=self.workers, metrics=self.metrics)
+        for adapter in adapters:
+            scheduler.set_capacity(adapter.name, adapter.max_workers)
+            scheduler.add_producer()
+        threads = [
+            threading.Thread(target=self.plan_adapter, args=(adapter, scheduler, reconcile, resume), name=f"ingest-{adapter.name}")
+            for adapter in adapters
+        ]
+        for thread in threads:
+            thread.start()
+
+        futures = []
+        while True:
+            unit = scheduler.next()
+            if unit is None:
+                break
+            if self.stop_event.is_set():
+                unit.stopped = True
+                scheduler.done(unit)
+                continue
+            futures.append(self.executor.submit(self.run_unit, scheduler, unit))
+        for thread in threads:
+            thread.join()
+        wait(futures)
+
+    # Current AIMD window and in-flight count per host, as gauges
+    def export_http_windows(self):
+        for host, state in http_pool.concurrency_snapshot().items():
+            self.metrics.gauge("http_window", state["window"], host)
+            self.metrics.gauge("http_peak_in_flight", state["peak_in_flight"], host)
+            self.metrics.gauge("http_throttled", state["throttled"], host)
+        budget = http_pool.budget_snapshot()
+        for host, state in budget["hosts"].items():
+            self.metrics.gauge("budget_wait_s", state["waited_s"], host)
+        self.metrics.gauge("downloaded_bytes", budget["bytes"])
+
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def run(self, resume=False):
+        self.run_adapters(resume=resume)
+        self.close()
+        get_negative_cache().report()
+        if self.queue is not None:
+            self.queue.report()
+        self.export_http_windows()
+        self.metrics.report()
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download trade archives for every exchange from one process.")
+    parser.add_argument("exchanges", nargs="*",
+                        help=f"Exchanges or feeds to run, default all. Feeds: {', '.join(ADAPTERS)}")
+    parser.add_argument("--markets", nargs="+", help="Only these markets, e.g. spot usdm.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Shared worker threads.")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    parser.add_argument("--reconcile-only", action="store_true", help="Only bring the catalogs in line with storage.")
+    parser.add_argument("--dry-run", action="store_true", help="List what would be fetched, change nothing.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Only finish what the work queue has left from earlier runs, skipping discovery.")
+    parser.add_argument("--no-queue", action="store_true", help="Plan in memory only, nothing to resume from.")
+    parser.add_argument("--shard", action="store_true",
+                        help="Claim symbols through the catalog's shard leases, to run several nodes against one catalog.")
+    parser.add_argument("--shard-batch", type=int, default=SHARD_BATCH, help="Symbols held per feed at once when sharding.")
+    parser.add_argument("--normalize", action="store_true", help="Convert the new files to Parquet after the run.")
+    parser.add_argument("--recompress", action="store_true", help="Recompress cold files as seekable zstd after the run.")
+    parser.add_argument("--bars", action="store_true", help="Extend the materialized bars with the new files after the run.")
+    args = parser.parse_args()
+    if args.resume and args.no_queue:
+        parser.error("--resume needs the work queue")
+
+    adapters = [adapter_class(args.storage_root) for adapter_class in select_adapters(args.exchanges)]
+    if args.reconcile_only:
+        for adapter in adapters:
+            inserted, deleted = adapter.reconcile()
+            print(colored(f"{adapter.name}: reconciled {adapter.table} records: {inserted} inserted, {deleted} deleted", 'yellow'))
+    else:
+        queue = None if args.no_queue else work_queue.get_work_queue()
+        shards = ShardLeases() if args.shard else None
+        if shards is not None:
+            shards.start()
+        try:
+            Ingestor(adapters, workers=args.workers, markets=args.markets, dry_run=args.dry_run, queue=queue,
+                     shards=shards, shard_batch=args.shard_batch).run(resume=args.resume)
+        finally:
+            if shards is not None:
+                shards.stop()
+                shards.report()
+        if args.normalize and not args.dry_run:
+            from trade_normalizer import normalize_adapter
+            for adapter in adapters:
+                normalize_adapter(adapter)
+        if args.recompress and not args.dry_run:
+            from seekable_zstd import recompress_adapter
+            for adapter in adapters:
+                recompress_adapter(adapter)
+        if args.bars and not args.dry_run:
+            from bar_builder import refresh_bars
+            for exchange in sorted({adapter.exchange for adapter in adapters}):
+                refresh_bars(exchange, args.storage_root)
+    http_pool.close_all()
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import signal
+import argparse
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from termcolor import colored
+
+import http_pool
+from exchange_adapters import ADAPTERS, select_adapters
+from ingest import Ingestor, INGEST_WORKERS
+from negative_cache import get_negative_cache
+from work_queue import get_work_queue
+from shard_leases import ShardLeases
+
+# Seconds between runs of each feed. Bitstamp snapshots are a rolling window, the archives publish once a day.
+DEFAULT_INTERVALS = {
+    "binance": 6 * 60 * 60,
+    "binance-monthly": 24 * 60 * 60,
+    "bybit": 6 * 60 * 60,
+    "kraken": 6 * 60 * 60,
+    "bitstamp": 24 * 60 * 60,
+    "bitstamp-hourly": 60 * 60,
+}
+
+# Full storage walk + reconcile. In between, the catalog only changes through the daemon itself.
+RESCAN_INTERVAL = int(os.getenv('DAEMON_RESCAN_INTERVAL', 24 * 60 * 60))
+STATUS_HOST = os.getenv('DAEMON_STATUS_HOST', "127.0.0.1")
+STATUS_PORT = int(os.getenv('DAEMON_STATUS_PORT', 8765))
+TICK_SECONDS = 5
+
+
+# Schedule state of one feed
+class Job:
+
+    def __init__(self, adapter, interval):
+        self.adapter = adapter
+        self.interval = interval
+        self.next_run = time.time()
+        self.last_rescan = None
+        self.thread = None
+        self.runs = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def status(self):
+        def stamp(value):
+            return datetime.fromtimestamp(value).isoformat(timespec='seconds') if value else None
+        return {
+            "feed": self.adapter.name,
+            "interval": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_started": stamp(self.last_started),
+            "last_finished": stamp(self.last_finished),
+            "last_duration": self.last_duration,
+            "last_rescan": stamp(self.last_rescan),
+            "next_run": stamp(self.next_run),
+        }
+
+
+# Keeps one Ingestor, its adapters (catalog connections, coverage bitmaps), the HTTP sessions,
+# the symbol cache and the negative cache alive between runs, and runs each feed on its own interval
+class IngestDaemon:
+
+    def __init__(self, adapters, intervals=None, workers=None, rescan_interval=RESCAN_INTERVAL, shards=None):
+        intervals = {**DEFAULT_INTERVALS, **(intervals or {})}
+        # With the queue a restarted daemon picks up the periods the previous process had planned
+        self.ingestor = Ingestor(adapters, workers=workers, queue=get_work_queue(), shards=shards)
+        self.shards = shards
+        self.jobs = [Job(adapter, intervals.get(adapter.name, 6 * 60 * 60)) for adapter in adapters]
+        self.rescan_interval = rescan_interval
+        self.stop_event = threading.Event()
+        self.started_at = time.time()
+        self.server = None
+        self.watcher = None
+
+    # Filesystem events keep the catalogs current, so the periodic full rescans are dropped.
+    # The watcher reconciles once itself when it starts.
+    def watch_storage(self):
+        from storage_watcher import StorageWatcher
+
+        self.watcher = StorageWatcher([job.adapter for job in self.jobs], metrics=self.ingestor.metrics)
+        self.watcher.start()
+        self.rescan_interval = float('inf')
+        for job in self.jobs:
+            job.last_rescan = time.time()
+        print(colored(f"Watching storage with {type(self.watcher.watch).__name__}, periodic rescans off", 'magenta'))
+
+    def run_job(self, job):
+        job.last_started = time.time()
+        rescan = job.last_rescan is None or job.last_started - job.last_rescan >= self.rescan_interval
+        try:
+            self.ingestor.run_adapters([job.adapter], reconcile=rescan)
+            if rescan:
+                job.last_rescan = job.last_started
+        except Exception as e:
+            job.failures += 1
+            print(colored(f"{job.adapter.name} run failed: {e}", 'red'))
+        finally:
+            job.last_finished = time.time()
+            job.last_duration = job.last_finished - job.last_started
+            job.runs += 1
+            job.next_run = job.last_started + job.interval
+            self.ingestor.metrics.observe("job_seconds", job.last_duration, job.adapter.name)
+
+    def tick(self):
+        now = time.time()
+        for job in self.jobs:
+            # A run that overruns its interval is not started twice
+            if not job.running and now >= job.next_run:
+                job.thread = threading.Thread(target=self.run_job, args=(job,), name=f"job-{job.adapter.name}", daemon=True)
+                job.thread.start()
+
+    def status(self):
+        cache = get_negative_cache()
+        return {
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            "stopping": self.stop_event.is_set(),
+            "jobs": [job.status() for job in self.jobs],
+            "negative_cache": {"known": len(cache.entries), "avoided": cache.avoided, "recorded": cache.recorded},
+            "work_queue": self.ingestor.queue.counts(),
+            "shards": {"owner": self.shards.owner, "claimed": self.shards.claimed, "lost": self.shards.lost}
+            if self.shards is not None else None,
+            "watcher": self.watcher.status() if self.watcher is not None else None,
+            "http": http_pool.concurrency_snapshot(),
+            "budget": http_pool.budget_snapshot(),
+            "metrics": self.ingestor.metrics.snapshot(),
+        }
+
+    def serve_status(self, host=STATUS_HOST, port=STATUS_PORT):
+        daemon = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path in ("/", "/status"):
+                    body, code = json.dumps(daemon.status(), indent=2).encode(), 200
+                elif self.path == "/healthz":
+                    body, code = b"ok\n", 200
+                else:
+                    body, code = b"not found\n", 404
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json" if code == 200 and self.path != "/healthz" else "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), StatusHandler)
+        threading.Thread(target=self.server.serve_forever, name="status", daemon=True).start()
+        print(colored(f"Status on http://{host}:{port}/status", 'magenta'))
+
+    def stop(self, *_):
+        print(colored("Stopping, letting in-flight periods finish...", 'yellow'))
+        self.stop_event.set()
+        self.ingestor.stop()
+
+    def run(self):
+        last_prune = time.time()
+        while not self.stop_event.is_set():
+            self.tick()
+            if time.time() - last_prune >= 60 * 60:
+                get_negative_cache().prune()
+                self.ingestor.queue.prune()
+                last_prune = time.time()
+            self.stop_event.wait(TICK_SECONDS)
+
+        for job in self.jobs:
+            if job.thread is not None:
+                job.thread.join()
+        self.ingestor.close()
+        if self.shards is not None:
+            self.shards.stop()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.server is not None:
+            self.server.shutdown()
+        http_pool.close_all()
+        self.ingestor.metrics.report()
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def parse_intervals(values):
+    intervals = {}
+    for value in values or []:
+        feed, _, seconds = value.partition("=")
+        if feed not in ADAPTERS or not seconds.isdigit():
+            raise ValueError(f"Expected <feed>=<seconds>, got {value}")
+        intervals[feed] = int(seconds)
+    return intervals
+
+
+# Main logic
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ingest feeds continuously with warm caches.")
+    parser.add_argument("exchanges", nargs="*",
+                        help=f"Exchanges or feeds to run, default all. Feeds: {', '.join(ADAPTERS)}")
+    parser.add_argument("--interval", nargs="+", metavar="FEED=SECONDS", help="Override a feed's run interval.")
+    parser.add_argument("--rescan-interval", type=int, default=RESCAN_INTERVAL, help="Seconds between full storage rescans.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Shared worker threads.")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Update the catalogs from filesystem events (inotify, or watchdog on macOS) instead of rescans.")
+    parser.add_argument("--shard", action="store_true",
+                        help="Claim symbols through the catalog's shard leases, to run several nodes against one catalog.")
+    parser.add_argument("--status-port", type=int, default=STATUS_PORT, help="Local status endpoint port, 0 to disable.")
+    args = parser.parse_args()
+
+    adapters = [adapter_class(args.storage_root) for adapter_class in select_adapters(args.exchanges)]
+    shards = ShardLeases() if args.shard else None
+    if shards is not None:
+        shards.start()
+    daemon = IngestDaemon(adapters, parse_intervals(args.interval), workers=args.workers,
+                          rescan_interval=args.rescan_interval, shards=shards)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    if args.watch:
+        daemon.watch_storage()
+    if args.status_port:
+        daemon.serve_status(port=args.status_port)
+    daemon.run()
@@ -0,0 +1,65 @@
+import threading
+import time
+from termcolor import colored
+
+
+# Counters and timings shared by every adapter and worker of an ingest run.
+# Keys are a metric name plus a tuple of labels, e.g. ("periods", ("binance", "spot", "fetched")).
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+
+    def incr(self, name, *labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Tracks count, total and max of a duration
+    def observe(self, name, seconds, *labels):
+        key = (name, labels)
+        with self.lock:
+            count, total, peak = self.timings.get(key, (0, 0.0, 0.0))
+            self.timings[key] = (count + 1, total + seconds, max(peak, seconds))
+
+    def gauge(self, name, value, *labels):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def counter(self, name, *labels):
+        with self.lock:
+            return self.counters.get((name, labels), 0)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "uptime": time.time() - self.started_at,
+                "counters": [
+                    {"name": name, "labels": list(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "timings": [
+                    {"name": name, "labels": list(labels), "count": count, "total": total,
+                     "mean": total / count if count else 0.0, "max": peak}
+                    for (name, labels), (count, total, peak) in sorted(self.timings.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": list(labels), "value": value}
+                    for (name, labels), value in sorted(self.gauges.items())
+                ],
+            }
+
+    def report(self):
+        snapshot = self.snapshot()
+        print(colored(f"Ingest metrics after {snapshot['uptime']:.1f}s:", 'magenta'))
+        for counter in snapshot["counters"]:
+            print(f"  {counter['name']:<20}{'/'.join(counter['labels']):<40}{counter['value']:>14}")
+        for timing in snapshot["timings"]:
+            print(f"  {timing['name']:<20}{'/'.join(timing['labels']):<40}{timing['count']:>8} "
+                  f"mean {timing['mean'] * 1000:>8.1f} ms  max {timing['max'] * 1000:>8.1f} ms")
+        for gauge in snapshot["gauges"]:
+            print(f"  {gauge['name']:<20}{'/'.join(gauge['labels']):<40}{gauge['value']:>14}")
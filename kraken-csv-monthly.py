@@ -1,11 +1,10 @@
-import subprocess
-import pandas as pd
 import os
 import glob
-import requests
-import zipfile
+import shutil
 import calendar
 from termcolor import colored
+from catalog_backend import get_catalog
+from compressed_files import open_raw, plain_name
 from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
 
@@ -13,6 +12,7 @@ from datetime import date, timedelta, datetime
 STORAGE_PATH_DAILY = "/Volumes/rawPriceData/kraken/daily"
 STORAGE_PATH_MONTHLY = "/Volumes/rawPriceData/kraken/monthly"
 DATABASE_NAME = "kraken_csvs"
+EXCHANGE = "kraken"
 
 
 MARKET_TYPES = {
@@ -21,63 +21,12 @@ MARKET_TYPES = {
 
 # Function to run SQL commands and return the result
 def run_sql_command(sql_command):
-    cmd = [
-        "mysql",
-        "--login-path=client",
-        "-e",
-        sql_command,
-        DATABASE_NAME
-    ]
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print("Error executing SQL command:", e)
-        print("Command:", e.cmd)
-        print("Return Code:", e.returncode)
-        print("Output:", e.output)
-        print("Error Output:", e.stderr)
-        raise
+    return get_catalog(DATABASE_NAME).run_sql(sql_command)
 
 
 #-----------------------------------------------------------------------------------------------------------#
 
 
-# Function to get the list of downloaded records from the database
-def get_downloaded_records_from_db_monthly():
-    sql_command = "SELECT market, trading_pair, date FROM monthly;"
-    downloaded_records = run_sql_command(sql_command)
-    if downloaded_records:
-        # Parse the output into a list of tuples (market, trading_pair, date)
-        return [tuple(line.split("\t")) for line in downloaded_records.split("\n")[1:] if line]
-    else:
-        print("a")
-        return []
-
-
-# Function to get the list of downloaded records from the database
-def get_downloaded_records_from_db_daily():
-    sql_command = "SELECT market, trading_pair, date, first_csv FROM daily;"
-    downloaded_records = run_sql_command(sql_command)
-    if downloaded_records:
-        # Parse the output into a list of tuples (market, trading_pair, date, first_csv)
-        return [tuple(line.split("\t")) for line in downloaded_records.split("\n")[1:] if line]
-    else:
-        print("No daily records found.")
-        return []
-
-
-
-# Function to delete the database record for files not found
-def delete_record_from_db_monthly(market, trading_pair, date_str):
-    sql_command = f"""
-    DELETE FROM monthly
-    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND date = '{date_str}';
-    """
-    run_sql_command(sql_command)
-    print(colored(f"Deleted from DB: {record}", 'yellow'))
-
-
 # Function to delete the database record for files not found
 def delete_record_from_db_daily(market, trading_pair, month):
     # Assuming 'month' is in 'YYYY-MM' format
@@ -86,7 +35,7 @@ def delete_record_from_db_daily(market, trading_pair, month):
 
     sql_command = f"""
     DELETE FROM daily
-    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND date >= '{start_date}' AND date <= '{end_date}';
+    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND period_start BETWEEN '{start_date}' AND '{end_date}';
     """
     print(f"Attempting to delete from DB: Market: {market}, Trading Pair: {trading_pair}, Month: {month}")
     run_sql_command(sql_command)
@@ -108,7 +57,8 @@ def scan_daily_storage_for_csv_files(STORAGE_PATH_DAILY):
     print("Scanning daily storage for CSV files...")
     files_info = []  # Holds information about the files
     for root, dirs, files in os.walk(STORAGE_PATH_DAILY):
-        for file in files:
+        # Kept archives and recompressed files count as the CSV they hold
+        for file in map(plain_name, files):
             if file.endswith('.csv'):
                 parts = file.replace('-trades', '').split('-')
                 symbol = parts[0]
@@ -125,7 +75,8 @@ def scan_daily_storage_for_csv_files(STORAGE_PATH_DAILY):
 def scan_monthly_storage_for_csv_files(STORAGE_PATH_MONTHLY):
     files_info = []  # Holds information about the files
     for root, dirs, files in os.walk(STORAGE_PATH_MONTHLY):
-        for file in files:
+        # Kept archives and recompressed files count as the CSV they hold
+        for file in map(plain_name, files):
             if file.endswith('.csv'):
                 parts = file.replace('-trades', '').split('-')
                 symbol = parts[0]
@@ -152,11 +103,19 @@ def first_csv():
         return set()
 
 
+# Stored daily files of a month in day order, plain CSVs and recompressed ones alike
+def daily_files(market, symbol, month):
+    daily_files_pattern = os.path.join(STORAGE_PATH_DAILY, market, symbol, f"{symbol}-trades-{month}-*.csv*")
+    return sorted(f for f in glob.glob(daily_files_pattern) if plain_name(f).endswith('.csv'))
+
+
 # Function for deleting data off of the HDD
 def delete_csv_from_HDD(market, symbol, month):
-    daily_files_pattern = os.path.join(STORAGE_PATH_DAILY, market, symbol, f"{symbol}-trades-{month}-*.csv")
-    for f in glob.glob(daily_files_pattern):
+    for f in daily_files(market, symbol, month):
         os.remove(f)
+        # Minute seek index of the file, see seek_index.py
+        if os.path.exists(f + ".minutes.npz"):
+            os.remove(f + ".minutes.npz")
 
 
 def update_first_csv_in_db(market, trading_pair, month):
@@ -164,16 +123,16 @@ def update_first_csv_in_db(market, trading_pair, month):
     sql_command = f"""
     UPDATE monthly
     SET first_csv = 1
-    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND date LIKE '{month}%';
+    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND period_start = '{month}-01';
     """
     run_sql_command(sql_command)
     print(colored(f"Updated first_csv in DB for {market}, {trading_pair}, month: {month}", 'green'))
 
 
 def count_lines_in_file(file_path):
-    """Counts the number of lines in a given file."""
-    with open(file_path, 'r') as file:
-        return sum(1 for _ in file)
+    """Counts the number of lines in a given file, decompressing it if it is stored compressed."""
+    with open_raw(file_path) as file:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: file.read(1 << 20), b""))
 
 
 #-----------------------------------------------------------------------------------------------------------#
@@ -181,25 +140,21 @@ def count_lines_in_file(file_path):
 
 # Function to identify complete months or months with first_csv file
 def identify_complete_months(files_info, first_csv_months):
+    # Deferred, numpy is only needed once there is something to roll up
+    from coverage_index import CoverageIndex
+
     print("Identifying complete months...")
-    trading_pair_dates = {}
-    for market, symbol, date_str in files_info:
-        key = (market, symbol)
-        if key not in trading_pair_dates:
-            trading_pair_dates[key] = []
-        trading_pair_dates[key].append(date_str)
+    coverage = CoverageIndex.from_records(EXCHANGE, files_info)
+    months_on_disk = {(market, symbol, date_str[:7]) for market, symbol, date_str in files_info}
 
     complete_months = {}
-    for key, dates in trading_pair_dates.items():
-        print(f"Checking complete months for {key} with {len(dates)} dates.")
-        dates = set(dates)
-        months = {date[:7] for date in dates}  # Extract YYYY-MM
-        for month in months:
-            complete_month = all(f"{month}-{day:02d}" in dates for day in range(1, calendar.monthrange(int(month[:4]), int(month[5:]))[1] + 1))
-            if complete_month or (key[0], key[1], month) in first_csv_months:
-                if key not in complete_months:
-                    complete_months[key] = []
-                complete_months[key].append(month)
+    for exchange, market, symbol in coverage.keys():
+        key = (market, symbol)
+        months = set(coverage.complete_months((exchange, market, symbol)))
+        # The first csv month starts at listing, so it never fills up but is still rolled up
+        months |= {m[2] for m in first_csv_months if m[:2] == key and m in months_on_disk}
+        if months:
+            complete_months[key] = sorted(months)
 
     print(f"Identified complete months for {len(complete_months.keys())} trading pairs.")
     return complete_months
@@ -215,7 +170,6 @@ def aggregate_to_monthly(market, symbol, month, first_csv_months, max_retries=3)
     monthly_dir_path = os.path.join(STORAGE_PATH_MONTHLY, market, symbol)
     os.makedirs(monthly_dir_path, exist_ok=True)
 
-    daily_files_pattern = os.path.join(STORAGE_PATH_DAILY, market, symbol, f"{symbol}-trades-{month}-*.csv")
     monthly_file_path = os.path.join(monthly_dir_path, f"{symbol}-trades-{month}.csv")
 
     # Determine if this month should be marked as first_csv
@@ -225,14 +179,13 @@ def aggregate_to_monthly(market, symbol, month, first_csv_months, max_retries=3)
     while attempt < max_retries:
         try:
             total_daily_lines = 0
-            with open(monthly_file_path, 'w') as monthly_file:
-                for daily_file in glob.glob(daily_files_pattern):
+            with open(monthly_file_path, 'wb') as monthly_file:
+                for daily_file in daily_files(market, symbol, month):
                     line_count = count_lines_in_file(daily_file)
                     total_daily_lines += line_count
 
-                    with open(daily_file, 'r') as df:
-                        for line in df:
-                            monthly_file.write(line)
+                    with open_raw(daily_file) as df:
+                        shutil.copyfileobj(df, monthly_file, 1 << 20)
 
             # Verify if all lines were written to the monthly file
             total_monthly_lines = count_lines_in_file(monthly_file_path)
@@ -290,20 +243,9 @@ if __name__ == "__main__":
     # Get the list of downloaded files from the storage
     files_in_storage_monthly = scan_monthly_storage_for_csv_files(STORAGE_PATH_MONTHLY)
 
-    # Get the list of downloaded records from the database
-    downloaded_records_db_monthly = get_downloaded_records_from_db_monthly()
-
-
-    # Delete records from the database that are not present in storage
-    for record in downloaded_records_db_monthly:
-        if (record[0], record[1], record[2]) not in [(f[0], f[1], f[2]) for f in files_in_storage_monthly]:
-            delete_record_from_db_monthly(*record)
-
-
-    # Insert new records for files present in storage but not in the database
-    for file_info in files_in_storage_monthly:
-        if (file_info[0], file_info[1], file_info[2]) not in [(r[0], r[1], r[2]) for r in downloaded_records_db_monthly]:
-            insert_new_file_record_monthly(*file_info, False)
+    # Bring the database in line with the files present in storage
+    inserted, deleted = get_catalog(DATABASE_NAME).reconcile("monthly", files_in_storage_monthly)
+    print(colored(f"Reconciled monthly records: {inserted} inserted, {deleted} deleted", 'yellow'))
 
 
     # Use threading to download files
@@ -1,17 +1,22 @@
 import subprocess
-import pandas as pd
 import os
-import glob
-import requests
-import zipfile
 import time
 from termcolor import colored
+from catalog_backend import get_catalog
+from compressed_files import plain_name
+from negative_cache import get_negative_cache
+from symbol_lifecycle import SymbolLifecycle
+from symbol_universe import fetch_json, compact_kraken_asset_pairs
 from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
 
+# pandas, requests and numpy (coverage_index) are imported where they are used,
+# importing this module does no I/O and stays cheap for cron runs
+
 # Constants
 STORAGE_PATH = "/Volumes/rawPriceData/kraken/daily"
 DATABASE_NAME = "kraken_csvs"
+EXCHANGE = "kraken"
 BASE_URL = "https://api.kraken.com/0/public"
 
 
@@ -21,47 +26,21 @@ MARKET_TYPES = {
 
 # Function to run SQL commands and return the result
 def run_sql_command(sql_command):
-    cmd = [
-        "mysql",
-        "--login-path=client",
-        "-e",
-        sql_command,
-        DATABASE_NAME
-    ]
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print("MySQL error:", e.stderr)
-        raise  # Optionally re-raise the error if you want to stop the script
-
-
-#-----------------------------------------------------------------------------------------------------------#
+    return get_catalog(DATABASE_NAME).run_sql(sql_command)
 
-# Returns all monthlys which are dailys that have been aggregated
-def get_aggregated_monthly_records():
-    sql_command = "SELECT market, trading_pair, date FROM monthly;"
-    aggregated_records = run_sql_command(sql_command)
-    return [tuple(line.split("\t")) for line in aggregated_records.split("\n")[1:]]
 
+# Day coverage of the daily and monthly tables, built once per run and kept current on insert
+COVERAGE = None
 
-# Function to get the list of downloaded records from the database
-def get_downloaded_records_from_db():
-    sql_command = "SELECT market, trading_pair, date FROM daily;"
-    downloaded_records = run_sql_command(sql_command)
-    # Parse the output into a list of tuples (market, trading_pair, date)
-    return [tuple(line.split("\t")) for line in downloaded_records.split("\n")[1:]]
+def get_coverage():
+    global COVERAGE
+    if COVERAGE is None:
+        from coverage_index import CoverageIndex
+        COVERAGE = CoverageIndex.from_catalog(get_catalog(DATABASE_NAME), EXCHANGE)
+    return COVERAGE
 
 
-# Function to delete the database record for files not found
-def delete_record_from_db(market, trading_pair, date_str):
-    sql_command = f"""
-    DELETE FROM daily
-    WHERE market = '{market}' AND trading_pair = '{trading_pair}' AND date = '{date_str}';
-    """
-    print(colored(f"Deleted from DB: {record}", 'yellow'))
-    run_sql_command(sql_command)
-
+#-----------------------------------------------------------------------------------------------------------#
 
 # Function to insert new file records into the database
 def insert_new_file_record(market, trading_pair, date_str):
@@ -71,7 +50,6 @@ def insert_new_file_record(market, trading_pair, date_str):
     INSERT INTO daily (market, trading_pair, date, normalized, inserted_to_psql, is_delisted, first_csv)
     VALUES ('{market}', '{formatted_trading_pair}', '{date_str}', '0', '0', '0', '0');
     """
-
     try:
         run_sql_command(sql_command)
         print(colored(f"Data inserted {market}, {formatted_trading_pair}, {date_str}", 'cyan'))
@@ -81,6 +59,9 @@ def insert_new_file_record(market, trading_pair, date_str):
         else:
             raise
 
+    if COVERAGE is not None:
+        COVERAGE.add_days((EXCHANGE, market, formatted_trading_pair), [date_str])
+
 
 
 
@@ -89,7 +70,7 @@ def update_first_csv(market, trading_pair):
     find_oldest_sql = f"""
     SELECT date FROM daily
     WHERE market = '{market}' AND trading_pair = '{trading_pair}'
-    ORDER BY date ASC
+    ORDER BY period_start ASC
     LIMIT 1;
     """
     oldest_date_result = run_sql_command(find_oldest_sql)
@@ -114,7 +95,8 @@ def update_first_csv(market, trading_pair):
 def scan_storage_for_csv_files(storage_path):
     files_info = []  # Holds information about the files
     for root, dirs, files in os.walk(storage_path):
-        for file in files:
+        # Kept archives and recompressed files count as the CSV they hold
+        for file in map(plain_name, files):
             if file.endswith('.csv'):
                 parts = file.replace('-trades', '').split('-')
                 symbol = parts[0]
@@ -133,7 +115,7 @@ def get_first_csv_daily(market, symbol):
     sql_command = f"""
     SELECT date FROM daily
     WHERE market = '{market}' AND trading_pair = '{symbol}' AND first_csv = '1'
-    ORDER BY date ASC
+    ORDER BY period_start ASC
     LIMIT 1;
     """
     result = run_sql_command(sql_command)
@@ -143,7 +125,7 @@ def get_first_csv_daily(market, symbol):
 def get_first_csv_monthly(market, symbol):
     sql_command = f"""SELECT date FROM monthly
     WHERE market = '{market}' AND trading_pair = '{symbol}' AND first_csv = '1'
-    ORDER BY date ASC
+    ORDER BY period_start ASC
     LIMIT 1;"""
     result = run_sql_command(sql_command)
     return result.split('\n')[1].strip() if result else None
@@ -191,14 +173,10 @@ def collect_download_tasks():
     for market_type in MARKET_TYPES.keys():
         symbols = get_all_symbols(market_type)
         for symbol in symbols:
-            downloaded_dates = get_downloaded_dates_for_symbol(market_type, symbol)
-            current_date = date.today().replace(day=1)
+            start_date = date.today().replace(day=1)
             end_date = date.today() - timedelta(days=1)
-            while current_date <= end_date:
-                date_str = current_date.strftime('%Y-%m-%d')
-                if date_str not in downloaded_dates:
-                    tasks.append((symbol, market_type, date_str))
-                current_date += timedelta(days=1)
+            for missing_date in get_coverage().missing_days((EXCHANGE, market_type, symbol.replace("/", "")), start_date, end_date):
+                tasks.append((symbol, market_type, missing_date.strftime('%Y-%m-%d')))
     return tasks
 
 
@@ -206,32 +184,32 @@ def collect_download_tasks():
 
 
 def get_all_symbols(market_type):
-    url = BASE_URL + "/AssetPairs"
-    response = requests.get(url)
+    import requests
 
-    if response.status_code == 200:
-        data = response.json()['result']
-        formatted_pairs = []
+    url = BASE_URL + "/AssetPairs"
+    try:
+        data = fetch_json(url, extract=compact_kraken_asset_pairs)['result']
+    except (requests.RequestException, ValueError) as e:
+        print(f"Failed to retrieve spot data: {e}")
+        return None
 
-        for pair_name, pair_info in data.items():
-            if pair_name.endswith('.d'):
-                continue
+    formatted_pairs = []
+    for pair_name, pair_info in data.items():
+        if pair_name.endswith('.d'):
+            continue
 
-            base = pair_info.get('base').replace('XBT', 'BTC')
-            quote = pair_info.get('quote').replace('XBT', 'BTC')
+        base = pair_info.get('base').replace('XBT', 'BTC')
+        quote = pair_info.get('quote').replace('XBT', 'BTC')
 
-            if 'wsname' in pair_info:
-                formatted_pair = pair_info['wsname'].replace('XBT', 'BTC')
-            else:
-                formatted_pair = f"{base}/{quote}"
+        if 'wsname' in pair_info:
+            formatted_pair = pair_info['wsname'].replace('XBT', 'BTC')
+        else:
+            formatted_pair = f"{base}/{quote}"
 
-            formatted_pairs.append(formatted_pair)
+        formatted_pairs.append(formatted_pair)
 
-        print("Retrieved Kraken Spot Products:", formatted_pairs)
-        return formatted_pairs
-    else:
-        print(f"Failed to retrieve spot data: {response.status_code}")
-        return None
+    print("Retrieved Kraken Spot Products:", formatted_pairs)
+    return formatted_pairs
 
 
 
@@ -239,12 +217,16 @@ def get_all_symbols(market_type):
 
 
 def download_file(symbol, market, date_str, max_retries=3):
-    downloaded_records = get_downloaded_records_from_db()
-    record = (market, symbol, date_str)
+    import pandas as pd
+    import http_pool
 
-    if record in [(r[0], r[1], r[2]) for r in downloaded_records]:
+    if get_coverage().is_covered((EXCHANGE, market, symbol.replace("/", "")), date_str):
         return "Data already downloaded"
 
+    # Skip pairs/days Kraken already told us it doesn't have
+    if get_negative_cache().is_known_missing(EXCHANGE, market, symbol, date_str):
+        return "Known missing"
+
     date_obj = datetime.strptime(date_str, '%Y-%m-%d')
     unix_timestamp_start = int(date_obj.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
     unix_timestamp_end = unix_timestamp_start + 86400  # End of day
@@ -255,16 +237,20 @@ def download_file(symbol, market, date_str, max_retries=3):
 
     since = unix_timestamp_start
     all_trades_collected = False
+    unknown_pair = False
     trades_data = []
 
     api_symbol = symbol.replace('XBT', 'BTC')
 
     while not all_trades_collected and max_retries > 0:
         try:
-            response = requests.get(f"{BASE_URL}/Trades?pair={api_symbol}&since={since}")
+            response = http_pool.get(f"{BASE_URL}/Trades?pair={api_symbol}&since={since}")
             if response.status_code == 200:
                 data = response.json()
-                if 'result' in data and data['result'][symbol]:
+                if any('Unknown asset pair' in error for error in data.get('error', [])):
+                    unknown_pair = True
+                    all_trades_collected = True
+                elif 'result' in data and data['result'][symbol]:
                     trades = data['result'][symbol]
                     last = int(data['result']['last'])
 
@@ -289,6 +275,11 @@ def download_file(symbol, market, date_str, max_retries=3):
             print(f"Attempt {max_retries}: Error encountered while downloading data for {symbol} on {date_str}: {e}")
             max_retries -= 1
 
+    # Out of retries before reaching the end of the day, a partial day must not be saved as complete
+    if not all_trades_collected:
+        print(colored(f"Request failed for {symbol} on {date_str}.", 'red'))
+        return "Request failed"
+
     # Process and save all trades for the day
     if trades_data:
         full_day_trades = pd.concat(trades_data, ignore_index=True)
@@ -324,6 +315,8 @@ def download_file(symbol, market, date_str, max_retries=3):
             return "Data downloaded and saved"
     else:
         # No trades data was collected, return "Failed to download data"
+        if unknown_pair:
+            get_negative_cache().record_missing(EXCHANGE, market, symbol, date_str, response.status_code)
         print(f"Failed to download data for {symbol} on {date_str}.")
         return "Failed to download data"
 
@@ -332,73 +325,86 @@ def download_file(symbol, market, date_str, max_retries=3):
 
 
 def process_symbols(market_type, executor):
-    symbols = get_all_symbols(market_type)
-    aggregated_monthly_records = get_aggregated_monthly_records()
-    aggregated_months = {(record[0], record[1], record[2][:7]) for record in aggregated_monthly_records}
-
-    for symbol in symbols:
-        earliest_first_csv_date_str = get_all_first_csv_dates(market_type, symbol.replace("/", ""))
-        earliest_first_csv_date = datetime.strptime(earliest_first_csv_date_str, '%Y-%m-%d') if earliest_first_csv_date_str else None
-        current_date = datetime.combine(date.today() - timedelta(days=1), datetime.min.time())
+    from coverage_index import EPOCH as COVERAGE_EPOCH
+
+    symbols = get_all_symbols(market_type) or []
+    lifecycle = SymbolLifecycle(get_catalog(DATABASE_NAME))
+    lifecycle.observe(market_type, symbols)
+    coverage = get_coverage()
+
+    for symbol, last_day in lifecycle.plan(market_type, symbols):
+        trading_pair = symbol.replace("/", "")
+        earliest_first_csv_date_str = get_all_first_csv_dates(market_type, trading_pair)
+        # Walk back no further than the first csv, or the start of the coverage bitmaps
+        start_date = datetime.strptime(earliest_first_csv_date_str, '%Y-%m-%d').date() if earliest_first_csv_date_str else COVERAGE_EPOCH
+        end_date = date.today() - timedelta(days=1)
+        if last_day:
+            # Final pass for a delisted symbol, bounded to the weeks before it disappeared
+            end_date = min(last_day, end_date)
+            start_date = max(start_date, lifecycle.backfill_start(last_day))
         no_new_data_days = 0
-        downloaded_dates = set(get_downloaded_dates_for_symbol(market_type, symbol.replace("/", "")))
+        failed = False
 
-        while True:
+        # Newest first. Downloaded days and aggregated months are already set in the bitmap.
+        missing_dates = coverage.missing_days((EXCHANGE, market_type, trading_pair), start_date, end_date)
+        for current_date in reversed(missing_dates):
             date_str = current_date.strftime('%Y-%m-%d')
-            month_str = current_date.strftime('%Y-%m')
-
-            # Skip processing for dates earlier than the earliest first_csv date
-            if earliest_first_csv_date and current_date < earliest_first_csv_date:
-                break
-
-            if (market_type, symbol.replace("/", ""), month_str) in aggregated_months:
-                print(f"Skipping {date_str} for {symbol} as monthly data already aggregated.")
-                current_date = current_date.replace(day=1) - timedelta(days=1)
-                continue
-
-            if date_str not in downloaded_dates:
-                retry_count = 0
-                while retry_count < 2:
-                    result = download_file(symbol, market_type, date_str)
 
-                    if result == "No new data":
-                        print('a.1')
-                        time.sleep(3)  # Wait for 3 seconds before retrying
-                        retry_count += 1
-
-                    elif result == "Data downloaded and saved":
-                        print('b')
+            retry_count = 0
+            request_failures = 0
+            while retry_count < 2:
+                result = download_file(symbol, market_type, date_str)
+
+                if result == "Known missing":
+                    retry_count = 2  # Nothing to retry, counts as a day without data
+                    break
+
+                elif result == "No new data":
+                    print('a.1')
+                    time.sleep(3)  # Wait for 3 seconds before retrying
+                    retry_count += 1
+
+                elif result == "Data downloaded and saved":
+                    print('b')
+                    no_new_data_days = 0
+                    break
+
+                elif result == "Failed to download data":
+                    time.sleep(3)  # Wait for 3 seconds
+                    print('c')
+                    result = download_file(symbol, market_type, date_str)  # Retry download
+                    if result == "Data downloaded and saved":
                         no_new_data_days = 0
-                        downloaded_dates.add(date_str)
                         break
+                    elif result == "No new data":
+                        print('a.2')
+                        retry_count += 1
 
-                    elif result == "Failed to download data":
-                        time.sleep(3)  # Wait for 3 seconds
-                        print('c')
-                        result = download_file(symbol, market_type, date_str)  # Retry download
-                        if result == "Data downloaded and saved":
-                            no_new_data_days = 0
-                            downloaded_dates.add(date_str)
-                            break
-                        elif result == "No new data":
-                            print('a.2')
-                            retry_count += 1
-
-                    else:
-                        print('d')
+                elif result == "Request failed":
+                    # Throttled or a server error, which says nothing about whether the day has data
+                    request_failures += 1
+                    if request_failures == 2:
                         break
+                    time.sleep(3)
 
-                if retry_count == 2:
-                    no_new_data_days += 1
-                    if no_new_data_days >= 3:
-                        # Update the first CSV flag if three consecutive days with no new data
-                        update_first_csv(market_type, symbol.replace("/", ""))
-                        break
+                else:
+                    print('d')
+                    break
+
+            if result == "Request failed":
+                failed = True
+                continue
 
-            current_date -= timedelta(days=1)
+            if retry_count == 2:
+                no_new_data_days += 1
+                if no_new_data_days >= 3:
+                    # Update the first CSV flag if three consecutive days with no new data
+                    update_first_csv(market_type, trading_pair)
+                    break
 
-            if current_date < datetime.strptime('2000-01-01', '%Y-%m-%d'):  # Safety check
-                break
+        # A failed day would be skipped for good once the backfill is closed
+        if last_day and not failed:
+            lifecycle.finish_backfill(market_type, symbol)
 
 
 #-----------------------------------------------------------------------------------------------------------#
@@ -409,23 +415,13 @@ if __name__ == "__main__":
     # Get the list of downloaded files from the storage
     files_in_storage = scan_storage_for_csv_files(STORAGE_PATH)
 
-    # Get the list of downloaded records from the database
-    downloaded_records_db = get_downloaded_records_from_db()
-
-    # Returns all monthly csv files
-    aggregated_monthly_records = get_aggregated_monthly_records()
-
-    # Delete records from the database that are not present in storage
-    for record in downloaded_records_db:
-        if (record[0], record[1], record[2]) not in [(f[0], f[1], f[2]) for f in files_in_storage]:
-            delete_record_from_db(*record)
-
-    # Insert new records for files present in storage but not in the database
-    for file_info in files_in_storage:
-        if (file_info[0], file_info[1], file_info[2]) not in [(r[0], r[1], r[2]) for r in downloaded_records_db]:
-            insert_new_file_record(*file_info)
+    # Bring the database in line with the files present in storage
+    inserted, deleted = get_catalog(DATABASE_NAME).reconcile("daily", files_in_storage)
+    print(colored(f"Reconciled daily records: {inserted} inserted, {deleted} deleted", 'yellow'))
 
     # Use threading to download files
     with ThreadPoolExecutor(max_workers=1) as executor:
         for market_type in MARKET_TYPES.keys():
             process_symbols(market_type, executor)
+
+    get_negative_cache().report()
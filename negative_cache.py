@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import threading
+import time
+import calendar
+from datetime import date, datetime
+from termcolor import colored
+
+NEGATIVE_CACHE_PATH = os.getenv(
+    'NEGATIVE_CACHE_PATH',
+    os.path.join(os.getenv('CATALOG_SQLITE_DIR', os.path.expanduser("~/.readysetliqd")), "negative_cache.sqlite3")
+)
+
+# (max age of the period in days, seconds a miss is trusted for). Older periods are permanent.
+DEFAULT_TTL_POLICY = [
+    (1, 60 * 60),            # yesterday, the exchange may simply not have published yet
+    (7, 6 * 60 * 60),
+    (45, 24 * 60 * 60),
+]
+
+
+# Last day covered by a 'YYYY-MM-DD' or 'YYYY-MM' period
+def period_end(period):
+    if len(period) == 7:
+        year, month = int(period[:4]), int(period[5:7])
+        return date(year, month, calendar.monthrange(year, month)[1])
+    return datetime.strptime(period[:10], '%Y-%m-%d').date()
+
+
+# Remembers archives the exchange answered "not found" for, so later runs don't ask again
+class NegativeCache:
+
+    def __init__(self, path=None, ttl_policy=None):
+        self.path = path or NEGATIVE_CACHE_PATH
+        self.ttl_policy = ttl_policy or DEFAULT_TTL_POLICY
+        self.lock = threading.Lock()
+        self.avoided = 0
+        self.recorded = 0
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS negative_cache (
+            exchange TEXT NOT NULL,
+            market TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            period TEXT NOT NULL,
+            status INTEGER NULL,
+            checked_at REAL NOT NULL,
+            expires_at REAL NULL,
+            PRIMARY KEY (exchange, market, symbol, period)
+        );""")
+        # Everything is loaded up front, lookups never touch the disk
+        self.entries = {
+            (row[0], row[1], row[2], row[3]): row[4]
+            for row in self.connection.execute(
+                "SELECT exchange, market, symbol, period, expires_at FROM negative_cache;")
+        }
+
+    # Seconds a miss for this period stays trusted, None when it is permanent
+    def ttl_for(self, period, today=None):
+        age = ((today or date.today()) - period_end(period)).days
+        for max_age, ttl in self.ttl_policy:
+            if age <= max_age:
+                return ttl
+        return None
+
+    def is_known_missing(self, exchange, market, symbol, period):
+        key = (exchange, market, symbol.replace('/', ''), period)
+        with self.lock:
+            if key not in self.entries:
+                return False
+            expires_at = self.entries[key]
+            if expires_at is not None and expires_at < time.time():
+                del self.entries[key]
+                return False
+            self.avoided += 1
+            return True
+
+    def record_missing(self, exchange, market, symbol, period, status=404):
+        key = (exchange, market, symbol.replace('/', ''), period)
+        now = time.time()
+        ttl = self.ttl_for(period)
+        expires_at = now + ttl if ttl is not None else None
+        with self.lock:
+            self.entries[key] = expires_at
+            self.recorded += 1
+            self.connection.execute(
+                "INSERT OR REPLACE INTO negative_cache VALUES (?, ?, ?, ?, ?, ?, ?);",
+                (*key, status, now, expires_at))
+
+    # Drop a miss, e.g. once the file has turned up after all
+    def forget(self, exchange, market, symbol, period):
+        key = (exchange, market, symbol.replace('/', ''), period)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.connection.execute(
+                "DELETE FROM negative_cache WHERE exchange = ? AND market = ? AND symbol = ? AND period = ?;", key)
+
+    def prune(self):
+        with self.lock:
+            now = time.time()
+            self.entries = {k: v for k, v in self.entries.items() if v is None or v >= now}
+            self.connection.execute(
+                "DELETE FROM negative_cache WHERE expires_at IS NOT NULL AND expires_at < ?;", (now,))
+
+    def report(self):
+        print(colored(
+            f"Negative cache: {self.avoided} requests avoided, {self.recorded} new misses recorded "
+            f"({len(self.entries)} known).", 'magenta'))
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+_negative_cache = None
+_negative_cache_lock = threading.Lock()
+
+
+def get_negative_cache():
+    global _negative_cache
+    with _negative_cache_lock:
+        if _negative_cache is None:
+            _negative_cache = NegativeCache()
+            _negative_cache.prune()
+        return _negative_cache
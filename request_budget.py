@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+# Share of each published limit we allow ourselves, the rest is headroom for other clients on the same IP
+BUDGET_SAFETY = float(os.getenv('BUDGET_SAFETY', 0.8))
+# Download bandwidth for the whole process in bytes/sec, 0 for no cap
+BUDGET_BYTES_PER_SEC = float(os.getenv('BUDGET_BYTES_PER_SEC', 0))
+
+# host: (request weight, per seconds) as published by the exchange
+HOST_LIMITS = {
+    "api.binance.com": (6000, 60),
+    "fapi.binance.com": (2400, 60),
+    "dapi.binance.com": (2400, 60),
+    "data.binance.vision": (3000, 60),
+    "api.bybit.com": (600, 5),
+    "public.bybit.com": (3000, 60),
+    "api.kraken.com": (1, 1),
+    "www.bitstamp.net": (10000, 600),
+}
+# Weight of the endpoints that cost more than 1
+REQUEST_WEIGHTS = {
+    ("api.binance.com", "/api/v3/exchangeInfo"): 20,
+}
+# Weight the exchange says this IP has used in the current window
+USED_WEIGHT_HEADERS = ("X-MBX-USED-WEIGHT-1M", "X-MBX-USED-WEIGHT")
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+        self.waited = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Blocks until `amount` fits (or the bucket is full, for amounts larger than it), then takes it.
+    # wait=False takes it right away and leaves the bucket in debt, later callers pay for it.
+    def acquire(self, amount, wait=True):
+        need = min(amount, self.capacity)
+        with self.condition:
+            start = now = time.monotonic()
+            self.refill(now)
+            while wait and (self.tokens < need or now < self.paused_until):
+                self.condition.wait(max(self.paused_until - now, (need - self.tokens) / self.rate))
+                now = time.monotonic()
+                self.refill(now)
+            self.tokens -= amount
+            self.waited += now - start
+
+    # The server's own count wins when it says we used more than we think
+    def sync(self, available):
+        with self.condition:
+            self.refill(time.monotonic())
+            self.tokens = min(self.tokens, available)
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0)
+
+    def snapshot(self):
+        with self.condition:
+            self.refill(time.monotonic())
+            return {"available": round(self.tokens, 1), "capacity": round(self.capacity, 1),
+                    "paused_s": round(max(self.paused_until - time.monotonic(), 0), 1), "waited_s": round(self.waited, 1)}
+
+
+# Request-weight buckets per host plus one bytes/sec bucket for the process, every request through
+# http_pool takes from them first. Binance's used-weight headers and Retry-After resync the buckets,
+# so bursts from discovery and archive downloads together can't push an IP past its limit.
+class BudgetManager:
+
+    def __init__(self, limits=HOST_LIMITS, weights=REQUEST_WEIGHTS, safety=BUDGET_SAFETY, bytes_per_sec=BUDGET_BYTES_PER_SEC):
+        self.limits = limits
+        self.weights = weights
+        self.safety = safety
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.used_weight = {}
+        # One second of burst, so bulk downloads can't hold the uplink for long
+        self.bandwidth = TokenBucket(bytes_per_sec, bytes_per_sec) if bytes_per_sec > 0 else None
+        self.bytes = 0
+
+    # None for hosts without a known limit
+    def bucket(self, host):
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None and host in self.limits:
+                weight, seconds = self.limits[host]
+                capacity = max(weight * self.safety, 1)
+                bucket = self.buckets[host] = TokenBucket(capacity / seconds, capacity)
+            return bucket
+
+    def acquire(self, url):
+        parts = urlsplit(url)
+        bucket = self.bucket(parts.netloc)
+        if bucket is not None:
+            bucket.acquire(self.weights.get((parts.netloc, parts.path), 1))
+
+    def observe(self, url, response):
+        host = urlsplit(url).netloc
+        bucket = self.bucket(host)
+        if bucket is None:
+            return
+        headers = getattr(response, 'headers', None) or {}
+        for header in USED_WEIGHT_HEADERS:
+            if headers.get(header) is not None:
+                used = int(headers[header])
+                self.used_weight[host] = used
+                bucket.sync(self.limits[host][0] * self.safety - used)
+                break
+        if response.status_code in (418, 429):
+            retry_after = headers.get('Retry-After')
+            bucket.pause(float(retry_after) if retry_after and retry_after.isdigit() else self.limits[host][1])
+
+    # Throttling the exchange reported in a successful answer: nothing more until the bucket refills
+    def penalize(self, url):
+        bucket = self.bucket(urlsplit(url).netloc)
+        if bucket is not None:
+            bucket.pause(0)
+
+    # Streamed bodies wait for bandwidth, small answers read in one go are charged without waiting
+    def consume_bytes(self, size, wait=True):
+        with self.lock:
+            self.bytes += size
+        if self.bandwidth is not None:
+            self.bandwidth.acquire(size, wait)
+
+    def snapshot(self):
+        with self.lock:
+            buckets = dict(self.buckets)
+            used_weight = dict(self.used_weight)
+        hosts = {}
+        for host, bucket in sorted(buckets.items()):
+            hosts[host] = bucket.snapshot()
+            if host in used_weight:
+                hosts[host]["used_weight"] = used_weight[host]
+        return {"hosts": hosts, "bytes": self.bytes,
+                "bandwidth": self.bandwidth.snapshot() if self.bandwidth is not None else None}
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_budget():
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = BudgetManager()
+        return _budget
@@ -0,0 +1,162 @@
+import os
+import math
+import heapq
+import time
+import itertools
+import threading
+from datetime import date, timedelta
+
+from negative_cache import period_end
+
+# Priority keys are in seconds of queue time, lower runs first: a unit whose key is 600 lower goes
+# ahead of one that has been waiting up to 600s longer. Waiting is the aging, so backfill still moves.
+RECENT_DAYS = int(os.getenv('PRIORITY_RECENT_DAYS', 3))
+BACKFILL_DELAY = float(os.getenv('PRIORITY_BACKFILL_DELAY', 6 * 60 * 60))   # backfill behind recent periods
+RECENCY_WEIGHT = float(os.getenv('PRIORITY_RECENCY_WEIGHT', 10 * 60))      # per day of age of the newest period
+VOLUME_WEIGHT = float(os.getenv('PRIORITY_VOLUME_WEIGHT', 30 * 60))        # per 10x of the symbol's average file size
+FAIR_SHARE = float(os.getenv('PRIORITY_FAIR_SHARE', 10 * 60))              # per unit already running in the same lane
+
+RECENT = "recent"
+BACKFILL = "backfill"
+
+
+# A run of consecutive periods of one symbol, newest first, worked on by one worker. A symbol's backfill
+# is the follow_up of its recent unit and is only queued once that one finished, so the walk stays in order.
+class Unit:
+
+    def __init__(self, adapter, market, symbol, periods, last_day=None, priority_class=RECENT, volume=None):
+        self.adapter = adapter
+        self.market = market
+        self.symbol = symbol
+        self.periods = periods
+        self.last_day = last_day
+        self.priority_class = priority_class
+        self.volume = volume
+        self.follow_up = None
+        # Walk state handed on to the follow-up
+        self.empty_streak = 0
+        self.has_data = None
+        self.failed = False
+        # Set when the walk ended here (start of history, stop requested, error), the follow-up is dropped
+        self.stopped = False
+        self.enqueued_at = None
+
+    @property
+    def lane(self):
+        return self.adapter.name, self.market
+
+    # Days between the newest period and today
+    def age(self, today=None):
+        if not self.periods:
+            return 0
+        return max(((today or date.today()) - period_end(self.periods[0])).days, 0)
+
+
+# Recent unit, with the older periods chained as its backfill follow-up (or just one of them)
+def make_units(adapter, market, symbol, periods, last_day=None, volume=None, recent_days=RECENT_DAYS, today=None):
+    cutoff = (today or date.today()) - timedelta(days=recent_days)
+    recent = [period for period in periods if period_end(period) >= cutoff]
+    backfill = periods[len(recent):]
+    if not backfill:
+        return Unit(adapter, market, symbol, recent, last_day, RECENT, volume)
+    backfill_unit = Unit(adapter, market, symbol, backfill, last_day, BACKFILL, volume)
+    if not recent:
+        return backfill_unit
+    unit = Unit(adapter, market, symbol, recent, last_day, RECENT, volume)
+    unit.follow_up = backfill_unit
+    return unit
+
+
+# Hands out units by priority, one heap per (feed, market) lane. Each pick takes the lane with the lowest
+# head key plus a fair-share penalty for the units it already has running, never more than a feed's
+# capacity or `workers` in total at once, so nothing waits in the executor's FIFO. Producers (the planners) register so next() knows when nothing else can arrive.
+class PriorityScheduler:
+
+    def __init__(self, workers=None, metrics=None, backfill_delay=BACKFILL_DELAY, recency_weight=RECENCY_WEIGHT,
+                 volume_weight=VOLUME_WEIGHT, fair_share=FAIR_SHARE):
+        self.workers = workers
+        self.metrics = metrics
+        self.backfill_delay = backfill_delay
+        self.recency_weight = recency_weight
+        self.volume_weight = volume_weight
+        self.fair_share = fair_share
+        self.condition = threading.Condition()
+        self.lanes = {}
+        self.running = {}
+        self.feed_running = {}
+        self.capacity = {}
+        self.producers = 0
+        self.sequence = itertools.count()
+        self.queued = {RECENT: 0, BACKFILL: 0}
+
+    def key(self, unit):
+        key = unit.enqueued_at + self.recency_weight * unit.age()
+        if unit.priority_class == BACKFILL:
+            key += self.backfill_delay
+        if unit.volume:
+            key -= self.volume_weight * math.log10(1 + unit.volume)
+        return key
+
+    def set_capacity(self, feed, limit):
+        with self.condition:
+            self.capacity[feed] = limit
+
+    def add_producer(self):
+        with self.condition:
+            self.producers += 1
+
+    def producer_done(self):
+        with self.condition:
+            self.producers -= 1
+            self.condition.notify_all()
+
+    def push(self, unit):
+        with self.condition:
+            unit.enqueued_at = time.time()
+            heapq.heappush(self.lanes.setdefault(unit.lane, []), (self.key(unit), next(self.sequence), unit))
+            self.count(unit.priority_class, 1)
+            self.condition.notify_all()
+
+    # Blocks until a unit can start, None once producers are done and nothing is queued or running
+    def next(self):
+        with self.condition:
+            while True:
+                best = None
+                lanes = self.lanes.items()
+                if self.workers is not None and sum(self.feed_running.values()) >= self.workers:
+                    lanes = ()
+                for lane, heap in lanes:
+                    feed = lane[0]
+                    if not heap or self.feed_running.get(feed, 0) >= self.capacity.get(feed, 1):
+                        continue
+                    score = heap[0][0] + self.fair_share * self.running.get(lane, 0)
+                    if best is None or score < best[0]:
+                        best = (score, lane)
+
+                if best is not None:
+                    lane = best[1]
+                    unit = heapq.heappop(self.lanes[lane])[2]
+                    self.running[lane] = self.running.get(lane, 0) + 1
+                    self.feed_running[lane[0]] = self.feed_running.get(lane[0], 0) + 1
+                    if self.metrics is not None:
+                        self.metrics.observe("queue_latency", time.time() - unit.enqueued_at, unit.priority_class)
+                        self.metrics.incr("dispatched", lane[0], unit.priority_class)
+                    self.count(unit.priority_class, -1)
+                    return unit
+
+                if not self.producers and not any(self.running.values()) and not any(self.lanes.values()):
+                    return None
+                self.condition.wait()
+
+    def done(self, unit):
+        with self.condition:
+            self.running[unit.lane] -= 1
+            self.feed_running[unit.lane[0]] -= 1
+            if unit.follow_up is not None and not unit.stopped:
+                self.push(unit.follow_up)
+            self.condition.notify_all()
+
+    def count(self, priority_class, change):
+        self.queued[priority_class] += change
+        if self.metrics is not None:
+            self.metrics.gauge("queued", self.queued[priority_class], priority_class)
@@ -0,0 +1,212 @@
+import os
+import time
+import argparse
+import threading
+from termcolor import colored
+
+from compressed_files import is_empty, open_raw
+from trade_normalizer import LAYOUTS, has_header, read_raw, schema, to_table
+
+SEEK_INDEX_SUFFIX = ".minutes.npz"
+# Build the index right after a file is fetched, instead of on its first read
+SEEK_INDEX_ON_WRITE = os.getenv('SEEK_INDEX_ON_WRITE', '1') == '1'
+# Bytes parsed at a time while indexing, memory stays flat for multi-GB monthly files
+INDEX_CHUNK = 64 << 20
+
+
+# Offsets are into the decompressed CSV when the file is kept compressed
+def index_path(csv_path):
+    return csv_path + SEEK_INDEX_SUFFIX
+
+
+# Lines of a raw CSV block in the common schema
+def parse_block(data, exchange, market, first_row=0):
+    import pyarrow as pa
+
+    if not data:
+        return schema().empty_table()
+    return to_table(LAYOUTS[exchange](read_raw(pa.BufferReader(data), skip_rows=0), market, first_row))
+
+
+# Byte offset of the first trade, past the header line if there is one
+def data_offset(path):
+    if is_empty(path) or not has_header(path):
+        return 0
+    with open_raw(path) as file:
+        return len(file.readline())
+
+
+# (offset, bytes) of whole lines of a raw CSV, INDEX_CHUNK at a time, header skipped
+def iter_blocks(path, chunk=None):
+    position = data_offset(path)
+    with open_raw(path) as file:
+        file.seek(position)
+        pending = b""
+        while True:
+            data = file.read(chunk or INDEX_CHUNK)
+            block = pending + data
+            if not block:
+                return
+            cut = block.rfind(b"\n") + 1 if data else len(block)
+            if not cut:
+                pending = block
+                continue
+            block, pending = block[:cut], block[cut:]
+            yield position, block
+            position += len(block)
+
+
+# Sidecar of a raw trade CSV: for every minute with trades, the byte offset and row number of its first
+# line. A time range is then one seek and one read of the bytes between two minutes. Files that aren't
+# in time order (Bitstamp snapshots come newest first) get an unordered index and are read in full.
+class SeekIndex:
+
+    def __init__(self, minutes, offsets, rows, data_start, size, mtime_ns, ordered):
+        self.minutes = minutes
+        self.offsets = offsets
+        self.rows = rows
+        self.data_start = data_start
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.ordered = ordered
+
+    @classmethod
+    def build(cls, path, exchange, market):
+        import numpy as np
+
+        stat = os.stat(path)
+        minutes, offsets, rows = [], [], []
+        ordered = True
+        last_minute = None
+        row = 0
+        data_start = data_offset(path)
+        for position, block in iter_blocks(path):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            starts = np.concatenate(([0], newlines + 1))
+            starts = starts[starts < len(block)]
+            block_minutes = parse_block(block, exchange, market)["time"].to_numpy() // 60000
+            if len(block_minutes) != len(starts):
+                # Blank or quoted multi-line rows, offsets can't be trusted
+                ordered = False
+                break
+            if len(block_minutes):
+                previous = np.concatenate(([last_minute if last_minute is not None else block_minutes[0] - 1],
+                                           block_minutes[:-1]))
+                if (block_minutes < previous).any():
+                    ordered = False
+                    break
+                first = np.flatnonzero(block_minutes != previous)
+                minutes.append(block_minutes[first])
+                offsets.append(starts[first] + position)
+                rows.append(first + row)
+                last_minute = block_minutes[-1]
+            row += len(starts)
+
+        def joined(parts):
+            return np.concatenate(parts).astype(np.int64) if parts and ordered else np.empty(0, np.int64)
+
+        return cls(joined(minutes), joined(offsets), joined(rows), data_start, stat.st_size, stat.st_mtime_ns, ordered)
+
+    # None when missing or written for an earlier version of the file
+    @classmethod
+    def load(cls, path):
+        import numpy as np
+
+        try:
+            stat = os.stat(path)
+            with np.load(index_path(path)) as data:
+                index = cls(data["minutes"], data["offsets"], data["rows"], int(data["data_start"]),
+                            int(data["size"]), int(data["mtime_ns"]), bool(data["ordered"]))
+        except (OSError, KeyError, ValueError):
+            return None
+        if (index.size, index.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return index
+
+    def save(self, path):
+        import numpy as np
+
+        temp = f"{index_path(path)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as file:
+            np.savez(file, minutes=self.minutes, offsets=self.offsets, rows=self.rows, data_start=self.data_start,
+                     size=self.size, mtime_ns=self.mtime_ns, ordered=self.ordered)
+        os.replace(temp, index_path(path))
+
+    # (start offset, end offset, row number at start) of the bytes holding [start_ms, end_ms). The end is
+    # None when the range runs to the end of the file.
+    def byte_range(self, start_ms, end_ms):
+        import numpy as np
+
+        first = np.searchsorted(self.minutes, start_ms // 60000, side='right') - 1
+        last = np.searchsorted(self.minutes, -(-end_ms // 60000), side='left')
+        start, row = (self.offsets[first], self.rows[first]) if first >= 0 else (self.data_start, 0)
+        end = int(max(self.offsets[last], start)) if last < len(self.offsets) else None
+        return int(start), end, int(row)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+# The file's index, built and saved next to it on first use. Read-only storage keeps it in memory only.
+# Loaded indexes stay in memory for the process, until the file changes.
+def get_index(path, exchange, market):
+    stat = os.stat(path)
+    with _indexes_lock:
+        index = _indexes.get(path)
+    if index is not None and (index.size, index.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+        return index
+    index = SeekIndex.load(path)
+    if index is None:
+        index = SeekIndex.build(path, exchange, market)
+        try:
+            index.save(path)
+        except OSError:
+            pass
+    with _indexes_lock:
+        _indexes[path] = index
+    return index
+
+
+# Trades of a raw CSV in [start_ms, end_ms) as a common schema table
+def read_range(path, exchange, market, start_ms, end_ms):
+    import pyarrow.compute as pc
+
+    index = get_index(path, exchange, market)
+    if index.ordered:
+        start, end, row = index.byte_range(start_ms, end_ms)
+        with open_raw(path) as file:
+            # A compressed file is decompressed up to the start and no further than the end
+            file.seek(start)
+            table = parse_block(file.read(end - start) if end is not None else file.read(), exchange, market, row)
+    else:
+        with open_raw(path) as file:
+            file.seek(index.data_start)
+            table = parse_block(file.read(), exchange, market)
+    time_column = table["time"]
+    return table.filter(pc.and_(pc.greater_equal(time_column, start_ms), pc.less(time_column, end_ms)))
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    from exchange_adapters import ADAPTERS, select_adapters
+
+    parser = argparse.ArgumentParser(description="Build the minute seek indexes of the raw trade CSVs.")
+    parser.add_argument("exchanges", nargs="*",
+                        help=f"Exchanges or feeds, default all. Feeds: {', '.join(ADAPTERS)}")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    args = parser.parse_args()
+
+    for adapter_class in select_adapters(args.exchanges):
+        adapter = adapter_class(args.storage_root)
+        started = time.time()
+        built = 0
+        for market, pair, period in adapter.scan_storage():
+            path = adapter.find_file(market, pair, period)
+            if path is not None and SeekIndex.load(path) is None:
+                SeekIndex.build(path, adapter.exchange, market).save(path)
+                built += 1
+        print(colored(f"{adapter.name}: {built} seek indexes built in {time.time() - started:.1f}s", 'green'))
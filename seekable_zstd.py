@@ -0,0 +1,278 @@
+import io
+import os
+import time
+import random
+import struct
+import argparse
+import bisect
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from termcolor import colored
+
+from compressed_files import codec_of, open_raw
+from seek_index import SEEK_INDEX_ON_WRITE, SeekIndex, index_path
+
+# Decompressed bytes per independent frame: a range read decompresses at most one extra frame at each end
+ZSTD_FRAME_SIZE = int(os.getenv('ZSTD_FRAME_SIZE', 4 << 20))
+ZSTD_LEVEL = int(os.getenv('ZSTD_LEVEL', 9))
+# Files whose period started more than this many days ago are cold and get recompressed
+RECOMPRESS_COLD_DAYS = int(os.getenv('RECOMPRESS_COLD_DAYS', 35))
+RECOMPRESS_WORKERS = int(os.getenv('RECOMPRESS_WORKERS', 4))
+
+# Seek table of the zstd seekable format (contrib/seekable_format in the zstd repo): a skippable frame at
+# the end of the file listing every frame's compressed and decompressed size, so other tools can read it too
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+FOOTER = struct.Struct("<IBI")
+ENTRY = struct.Struct("<II")
+
+
+# ([compressed offsets], [decompressed offsets]) of the frames, each with a final end offset, or None when
+# the file has no seek table
+def read_seek_table(path):
+    with open(path, 'rb') as file:
+        size = file.seek(0, os.SEEK_END)
+        if size < FOOTER.size + 8:
+            return None
+        file.seek(size - FOOTER.size)
+        frames, descriptor, magic = FOOTER.unpack(file.read(FOOTER.size))
+        if magic != SEEKABLE_MAGIC:
+            return None
+        entry_size = ENTRY.size + (4 if descriptor & 0x80 else 0)
+        file.seek(size - FOOTER.size - frames * entry_size)
+        entries = file.read(frames * entry_size)
+    compressed, decompressed = [0], [0]
+    for frame in range(frames):
+        compressed_size, decompressed_size = ENTRY.unpack_from(entries, frame * entry_size)
+        compressed.append(compressed[-1] + compressed_size)
+        decompressed.append(decompressed[-1] + decompressed_size)
+    return compressed, decompressed
+
+
+# Compresses a binary stream of CSV lines into independent frames of about ZSTD_FRAME_SIZE, cut at line
+# ends, followed by the seek table. Returns the decompressed size.
+def write_seekable(source, target, frame_size=None, level=None):
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(level=level or ZSTD_LEVEL)
+    entries = []
+    pending = b""
+    with open(target, 'wb') as out:
+        while True:
+            data = source.read(frame_size or ZSTD_FRAME_SIZE)
+            block = pending + data
+            if not block:
+                break
+            cut = block.rfind(b"\n") + 1 if data else len(block)
+            if not cut:
+                pending = block
+                continue
+            block, pending = block[:cut], block[cut:]
+            frame = compressor.compress(block)
+            out.write(frame)
+            entries.append((len(frame), len(block)))
+        table = b"".join(ENTRY.pack(*entry) for entry in entries) + FOOTER.pack(len(entries), 0, SEEKABLE_MAGIC)
+        out.write(struct.pack("<II", SKIPPABLE_MAGIC, len(table)) + table)
+    return sum(entry[1] for entry in entries)
+
+
+# Read-only file over a seekable .zst. seek() is free, and read() decompresses only the frames it touches
+# (the last one is kept for the next read).
+class SeekableZstdFile(io.RawIOBase):
+
+    def __init__(self, path, table):
+        import zstandard
+
+        super().__init__()
+        self.file = open(path, 'rb')
+        self.compressed, self.decompressed = table
+        self.size = self.decompressed[-1]
+        self.position = 0
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.frame = None
+        self.frame_data = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def load_frame(self, frame):
+        if frame != self.frame:
+            self.file.seek(self.compressed[frame])
+            data = self.file.read(self.compressed[frame + 1] - self.compressed[frame])
+            self.frame_data = self.decompressor.decompress(data)
+            self.frame = frame
+        return self.frame_data
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        parts = []
+        while self.position < end:
+            frame = bisect.bisect_right(self.decompressed, self.position) - 1
+            data = self.load_frame(frame)
+            start = self.position - self.decompressed[frame]
+            part = data[start:start + end - self.position]
+            parts.append(part)
+            self.position += len(part)
+        return b"".join(parts)
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Rewrites one record's stored file as a seekable .csv.zst next to it and removes the original. The
+# minute seek index carries over as is, its offsets are into the same decompressed bytes. Returns
+# (stored bytes before, after), or None when the file already was zstd.
+def recompress_file(adapter, market, pair, period):
+    source = adapter.find_file(market, pair, period)
+    if source is None:
+        raise FileNotFoundError(adapter.file_path(market, pair, period))
+    if codec_of(source) == "zstd":
+        return None
+    target = adapter.file_path(market, pair, period) + ".zst"
+    temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open_raw(source) as file:
+        written = write_seekable(file, temp)
+    table = read_seek_table(temp)
+    if table is None or table[1][-1] != written:
+        os.remove(temp)
+        raise ValueError(f"{temp}: seek table does not add up")
+    index = SeekIndex.load(source)
+    os.replace(temp, target)
+    before = os.path.getsize(source)
+    os.remove(source)
+    if os.path.exists(index_path(source)):
+        os.remove(index_path(source))
+    if index is not None:
+        stat = os.stat(target)
+        index.size, index.mtime_ns = stat.st_size, stat.st_mtime_ns
+        index.save(target)
+    elif SEEK_INDEX_ON_WRITE:
+        SeekIndex.build(target, adapter.exchange, market).save(target)
+    return before, os.path.getsize(target)
+
+
+# Recompresses an adapter's cold files, plain or kept archives, in parallel and records their codec and new size
+def recompress_adapter(adapter, cold_days=RECOMPRESS_COLD_DAYS, workers=RECOMPRESS_WORKERS, limit=None, metrics=None):
+    before = (datetime.now() - timedelta(days=cold_days)).strftime('%Y-%m-%d')
+    records = [tuple(record[:3]) for record in adapter.catalog.get_cold_records(adapter.table, before)][:limit]
+    if not records:
+        return 0
+    started = time.time()
+    done = []
+    converted = old_bytes = new_bytes = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(recompress_file, adapter, *record): record for record in records}
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                sizes = future.result()
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                print(colored(f"{adapter.name}: could not recompress {' '.join(record)}: {e}", 'red'))
+                failed += 1
+                continue
+            path = adapter.find_file(*record)
+            if sizes is not None:
+                converted += 1
+                old_bytes += sizes[0]
+                new_bytes += sizes[1]
+            done.append(record + ("zstd", os.path.getsize(path)))
+    adapter.catalog.set_codecs(adapter.table, done)
+
+    elapsed = time.time() - started
+    if metrics is not None:
+        metrics.incr("recompressed_files", adapter.name, value=converted)
+        metrics.incr("recompressed_saved_bytes", adapter.name, value=old_bytes - new_bytes)
+    ratio = f", {new_bytes / old_bytes:.0%} of the stored size" if old_bytes else ""
+    print(colored(f"{adapter.name}: recompressed {converted} files in {elapsed:.1f}s{ratio}, {failed} failed",
+                  'green' if not failed else 'yellow'))
+    return converted
+
+
+# Compression ratio and range-read latency of one plain CSV against its seekable zstd copy, written to a
+# temporary file next to it
+def benchmark(adapter, market, pair, period, reads=50, hours=1):
+    from seek_index import get_index, read_range
+
+    source = adapter.file_path(market, pair, period)
+    target = f"{source}.{os.getpid()}.bench.zst"
+    try:
+        started = time.time()
+        with open(source, 'rb') as file:
+            write_seekable(file, target)
+        write_seconds = time.time() - started
+        plain, packed = os.path.getsize(source), os.path.getsize(target)
+        print(colored(f"{os.path.basename(source)}: {plain / 2**20:.1f} MB -> {packed / 2**20:.1f} MB "
+                      f"({plain / packed:.1f}x) in {write_seconds:.1f}s, {len(read_seek_table(target)[0]) - 1} frames",
+                      'cyan'))
+        span_start, span_end = adapter.period_span(period)
+        first_ms = int((span_start - datetime(1970, 1, 1)).total_seconds() * 1000)
+        last_ms = int((span_end - datetime(1970, 1, 1)).total_seconds() * 1000) - hours * 3600000
+        windows = [random.randint(first_ms, max(first_ms, last_ms)) for _ in range(reads)]
+        for label, path in (("csv", source), ("zstd", target)):
+            get_index(path, adapter.exchange, market)
+            started = time.time()
+            rows = sum(read_range(path, adapter.exchange, market, start, start + hours * 3600000).num_rows
+                       for start in windows)
+            elapsed = (time.time() - started) / reads
+            print(colored(f"  {label:<5}{hours}h range read: {elapsed * 1000:.1f} ms ({rows // reads} trades)", 'green'))
+    finally:
+        for path in (target, index_path(target)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    from exchange_adapters import ADAPTERS, select_adapters
+
+    parser = argparse.ArgumentParser(description="Recompress cold raw trade files as seekable zstd.")
+    parser.add_argument("exchanges", nargs="*",
+                        help=f"Exchanges or feeds, default all. Feeds: {', '.join(ADAPTERS)}")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    parser.add_argument("--cold-days", type=int, default=RECOMPRESS_COLD_DAYS,
+                        help="Only files whose period started this many days ago or more.")
+    parser.add_argument("--workers", type=int, default=RECOMPRESS_WORKERS, help="Files recompressed at once.")
+    parser.add_argument("--limit", type=int, help="At most this many files per feed.")
+    parser.add_argument("--benchmark", nargs=3, metavar=("MARKET", "SYMBOL", "PERIOD"),
+                        help="Compare one plain CSV with a seekable zstd copy instead, changing nothing.")
+    args = parser.parse_args()
+
+    for adapter_class in select_adapters(args.exchanges):
+        adapter = adapter_class(args.storage_root)
+        if args.benchmark:
+            market, symbol, period = args.benchmark
+            benchmark(adapter, market, adapter.trading_pair(symbol), period)
+        else:
+            recompress_adapter(adapter, cold_days=args.cold_days, workers=args.workers, limit=args.limit)
@@ -0,0 +1,143 @@
+import os
+import time
+import argparse
+import threading
+from termcolor import colored
+
+from catalog_schema import SHARD_LEASE_TABLE
+from work_queue import lease_owner
+
+# Seconds a shard stays leased without a heartbeat, heartbeats go out every third of it
+SHARD_LEASE_TTL = int(os.getenv('SHARD_LEASE_TTL', 120))
+
+
+# (feed, market, trading_pair) shards of the ingest work, leased through a table in each exchange's catalog
+# so several nodes (or processes) sharing the catalog never download the same symbol at the same time.
+# Claims are INSERT IGNORE + a conditional UPDATE, both atomic on MySQL and SQLite; the row then says who won.
+# A node that dies stops heartbeating and its shards go to the others once the lease expires.
+class ShardLeases:
+
+    def __init__(self, owner=None, ttl=SHARD_LEASE_TTL):
+        self.owner = owner or lease_owner()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.catalogs = {}
+        self.claimed = 0
+        self.lost = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # Claims up to `limit` of the given trading pairs, skipping shards another node holds and those
+    # finished after `since` (this run already has them covered). Returns (claimed, skipped).
+    def claim(self, catalog, feed, market, pairs, limit, since=None):
+        now = time.time()
+        with self.lock:
+            self.catalogs[catalog.database_name] = catalog
+        rows = catalog.query(
+            f"SELECT trading_pair, owner, expires_at, completed_at FROM {SHARD_LEASE_TABLE} WHERE feed = ? AND market = ?;",
+            (feed, market))
+        taken = {
+            pair for pair, owner, expires_at, completed_at in rows
+            if (owner != self.owner and float(expires_at) > now)
+            or (since is not None and completed_at is not None and float(completed_at) > since)
+        }
+        candidates = [pair for pair in pairs if pair not in taken][:limit]
+        skipped = [pair for pair in pairs if pair in taken]
+        if not candidates:
+            return [], skipped
+
+        placeholders = ", ".join("?" for _ in candidates)
+        expires_at = now + self.ttl
+        catalog.execute_many([
+            (f"{catalog.insert_ignore} INTO {SHARD_LEASE_TABLE} "
+             f"(feed, market, trading_pair, owner, expires_at, heartbeat_at) VALUES "
+             + ", ".join("(?, ?, ?, ?, ?, ?)" for _ in candidates) + ";",
+             [value for pair in candidates for value in (feed, market, pair, self.owner, expires_at, now)]),
+            (f"UPDATE {SHARD_LEASE_TABLE} SET owner = ?, expires_at = ?, heartbeat_at = ? "
+             f"WHERE feed = ? AND market = ? AND trading_pair IN ({placeholders}) AND (owner = ? OR expires_at < ?);",
+             [self.owner, expires_at, now, feed, market, *candidates, self.owner, now]),
+        ])
+        won = {row[0] for row in catalog.query(
+            f"SELECT trading_pair FROM {SHARD_LEASE_TABLE} "
+            f"WHERE feed = ? AND market = ? AND owner = ? AND trading_pair IN ({placeholders});",
+            (feed, market, self.owner, *candidates))}
+        claimed = [pair for pair in candidates if pair in won]
+        with self.lock:
+            self.claimed += len(claimed)
+            self.lost += len(candidates) - len(claimed)
+        return claimed, skipped + [pair for pair in candidates if pair not in won]
+
+    # Hand a shard back, marked finished when the symbol was worked through
+    def release(self, catalog, feed, market, pair, completed=True):
+        catalog.execute(
+            f"UPDATE {SHARD_LEASE_TABLE} SET expires_at = 0, completed_at = ? "
+            f"WHERE feed = ? AND market = ? AND trading_pair = ? AND owner = ?;",
+            (time.time() if completed else None, feed, market, pair, self.owner))
+
+    def heartbeat(self):
+        now = time.time()
+        with self.lock:
+            catalogs = list(self.catalogs.values())
+        for catalog in catalogs:
+            catalog.execute(
+                f"UPDATE {SHARD_LEASE_TABLE} SET expires_at = ?, heartbeat_at = ? WHERE owner = ? AND expires_at > 0;",
+                (now + self.ttl, now, self.owner))
+
+    def run_heartbeat(self):
+        while not self.stop_event.wait(self.ttl / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(colored(f"Shard heartbeat failed: {e}", 'red'))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run_heartbeat, name="shard-heartbeat", daemon=True)
+        self.thread.start()
+
+    # Leases still held go back unfinished, so other nodes can take them right away
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            catalogs = list(self.catalogs.values())
+        for catalog in catalogs:
+            catalog.execute(
+                f"UPDATE {SHARD_LEASE_TABLE} SET expires_at = 0 WHERE owner = ? AND expires_at > 0;", (self.owner,))
+
+    def report(self):
+        print(colored(f"Shards: {self.claimed} claimed by {self.owner}, {self.lost} lost to other nodes.", 'magenta'))
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Who holds what, per feed and market
+def print_leases(catalog):
+    now = time.time()
+    rows = catalog.query(f"SELECT feed, market, owner, expires_at FROM {SHARD_LEASE_TABLE};")
+    held = {}
+    for feed, market, owner, expires_at in rows:
+        if float(expires_at) > now:
+            key = (feed, market, owner)
+            held[key] = held.get(key, 0) + 1
+    print(colored(f"{catalog.database_name}: {len(rows)} shards known, {sum(held.values())} leased", 'cyan'))
+    for (feed, market, owner), count in sorted(held.items()):
+        print(f"  {feed:<18}{market:<10}{owner:<40}{count:>6}")
+
+
+# Main logic
+if __name__ == "__main__":
+    from exchange_adapters import ADAPTERS, select_adapters
+
+    parser = argparse.ArgumentParser(description="Show the shard leases held by ingest nodes.")
+    parser.add_argument("exchanges", nargs="*",
+                        help=f"Exchanges or feeds, default all. Feeds: {', '.join(ADAPTERS)}")
+    args = parser.parse_args()
+
+    catalogs = {}
+    for adapter_class in select_adapters(args.exchanges):
+        adapter = adapter_class()
+        catalogs[adapter.database_name] = adapter.catalog
+    for database_name, catalog in sorted(catalogs.items()):
+        print_leases(catalog)
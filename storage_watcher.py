@@ -0,0 +1,316 @@
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import argparse
+import threading
+from termcolor import colored
+
+from compressed_files import plain_name
+
+# Seconds events are coalesced for before the catalog is touched, and the batch size that flushes early
+FLUSH_INTERVAL = float(os.getenv('WATCH_FLUSH_INTERVAL', 2))
+FLUSH_BATCH = 5000
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class WatchUnavailable(Exception):
+    pass
+
+
+# Recursive watch over a set of directory trees through the raw inotify syscalls (Linux, no dependency).
+# poll() returns (kind, path) with kind "added", "removed" or "overflow".
+class InotifyWatch:
+
+    def __init__(self, roots):
+        import ctypes
+        import ctypes.util
+
+        if not sys.platform.startswith("linux"):
+            raise WatchUnavailable("inotify is Linux only")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatchUnavailable(os.strerror(ctypes.get_errno()))
+        self.ctypes = ctypes
+        self.paths = {}
+        self.pending = []
+        for root in roots:
+            os.makedirs(root, exist_ok=True)
+            self.add_tree(root, report_files=False)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = self.ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchUnavailable("out of inotify watches, raise fs.inotify.max_user_watches")
+            if error != errno.ENOENT:
+                raise WatchUnavailable(f"{path}: {os.strerror(error)}")
+            return
+        self.paths[wd] = path
+
+    # Files already in a new directory were created before its watch existed, report them as added
+    def add_tree(self, root, report_files=True):
+        for directory, dirs, files in os.walk(root):
+            self.add_watch(directory)
+            if report_files:
+                self.pending += [("added", os.path.join(directory, file)) for file in files]
+
+    def poll(self, timeout):
+        events, self.pending = self.pending, []
+        if events:
+            timeout = 0
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return events
+        try:
+            data = os.read(self.fd, 1 << 20)
+        except BlockingIOError:
+            return events
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append(("overflow", None))
+                continue
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            directory = self.paths.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+                elif mask & IN_MOVED_FROM:
+                    # Whatever was under it is gone as far as this tree is concerned
+                    events.append(("overflow", None))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                events.append(("added", path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append(("removed", path))
+        # Files found in directories created during this read
+        events += self.pending
+        self.pending = []
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Same interface on top of the optional watchdog package (FSEvents on macOS)
+class WatchdogWatch:
+
+    def __init__(self, roots):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            raise WatchUnavailable("no inotify and the watchdog package is not installed")
+
+        self.lock = threading.Lock()
+        self.events = []
+        self.ready = threading.Event()
+        watch = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                with watch.lock:
+                    if event.event_type in ("created", "modified", "closed"):
+                        watch.events.append(("added", event.src_path))
+                    elif event.event_type == "deleted":
+                        watch.events.append(("removed", event.src_path))
+                    elif event.event_type == "moved":
+                        watch.events.append(("removed", event.src_path))
+                        watch.events.append(("added", event.dest_path))
+                watch.ready.set()
+
+        self.observer = Observer()
+        for root in roots:
+            os.makedirs(root, exist_ok=True)
+            self.observer.schedule(Handler(), root, recursive=True)
+        self.observer.start()
+
+    def poll(self, timeout):
+        self.ready.wait(timeout)
+        with self.lock:
+            events, self.events = self.events, []
+            self.ready.clear()
+        return events
+
+    def close(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+def open_watch(roots):
+    try:
+        return InotifyWatch(roots)
+    except WatchUnavailable:
+        return WatchdogWatch(roots)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Keeps the catalogs of a set of adapters in line with their storage roots from filesystem events.
+# A full scan + reconcile runs when the watch starts (events were missed while it was down) and
+# after an event queue overflow; everything else is applied incrementally in coalesced batches.
+class StorageWatcher:
+
+    def __init__(self, adapters, flush_interval=FLUSH_INTERVAL, metrics=None):
+        self.adapters = sorted(adapters, key=lambda adapter: len(adapter.storage_path), reverse=True)
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+        self.pending = {}
+        self.stop_event = threading.Event()
+        self.watch = None
+        self.thread = None
+        self.full_scans = 0
+        self.applied = 0
+
+    def adapter_for(self, path):
+        for adapter in self.adapters:
+            if path.startswith(adapter.storage_path + os.sep):
+                return adapter
+        return None
+
+    # (adapter, (market, trading_pair, period)) for a file event, None for temp files and the like
+    def parse(self, path):
+        adapter = self.adapter_for(path)
+        if adapter is None:
+            return None
+        rel_parts = os.path.relpath(path, adapter.storage_path).split(os.sep)
+        parsed = adapter.parse_filename(plain_name(rel_parts[-1]))
+        if parsed is None or len(rel_parts) < 2:
+            return None
+        return adapter, (rel_parts[0], parsed[0], parsed[1])
+
+    def full_scan(self):
+        self.pending.clear()
+        for adapter in self.adapters:
+            inserted, deleted = adapter.reconcile()
+            print(colored(f"{adapter.name}: full scan, {inserted} inserted, {deleted} deleted", 'yellow'))
+        self.full_scans += 1
+
+    def handle(self, events):
+        for kind, path in events:
+            if kind == "overflow":
+                print(colored("Filesystem event queue overflowed, falling back to a full scan.", 'red'))
+                self.full_scan()
+                continue
+            parsed = self.parse(path)
+            if parsed is not None:
+                # Last event per file wins, so create+delete bursts cancel out
+                self.pending[(parsed[0].name, parsed[1])] = (parsed[0], parsed[1], kind, path)
+
+    def flush(self):
+        if not self.pending:
+            return
+        batches = {}
+        for adapter, record, kind, path in self.pending.values():
+            added, removed = batches.setdefault(adapter.name, (adapter, [], []))[1:]
+            # Trust the filesystem over the event order. Any stored form of the record counts: extracting or
+            # decompressing an archive removes the file the last event was about.
+            found = adapter.find_file(*record)
+            try:
+                if found is None:
+                    raise FileNotFoundError(path)
+                added.append(record + (os.path.getsize(found),))
+            except OSError:
+                removed.append(record)
+        self.pending.clear()
+        for adapter, added, removed in batches.values():
+            adapter.apply_changes(added, removed)
+            self.applied += len(added) + len(removed)
+            if self.metrics is not None:
+                self.metrics.incr("watch_added", adapter.name, value=len(added))
+                self.metrics.incr("watch_removed", adapter.name, value=len(removed))
+            print(colored(f"{adapter.name}: catalog +{len(added)} -{len(removed)} from filesystem events", 'cyan'))
+
+    def start(self):
+        self.watch = open_watch([adapter.storage_path for adapter in self.adapters])
+        # Watches are in place before the scan, so nothing written during it is lost
+        self.full_scan()
+        self.thread = threading.Thread(target=self.run, name="storage-watcher", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        last_flush = time.time()
+        while not self.stop_event.is_set():
+            try:
+                self.handle(self.watch.poll(self.flush_interval / 2))
+                if len(self.pending) >= FLUSH_BATCH or time.time() - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = time.time()
+            except Exception as e:
+                print(colored(f"Storage watcher error: {e}, restarting the watch.", 'red'))
+                self.restart()
+        self.flush()
+
+    def restart(self):
+        try:
+            self.watch.close()
+        except Exception:
+            pass
+        self.watch = open_watch([adapter.storage_path for adapter in self.adapters])
+        self.full_scan()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.watch is not None:
+            self.watch.close()
+
+    def status(self):
+        return {"backend": type(self.watch).__name__, "full_scans": self.full_scans,
+                "applied": self.applied, "pending": len(self.pending)}
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    from exchange_adapters import ADAPTERS, select_adapters
+
+    parser = argparse.ArgumentParser(description="Keep the catalogs in line with storage from filesystem events.")
+    parser.add_argument("exchanges", nargs="*",
+                        help=f"Exchanges or feeds to watch, default all. Feeds: {', '.join(ADAPTERS)}")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    parser.add_argument("--flush-interval", type=float, default=FLUSH_INTERVAL)
+    args = parser.parse_args()
+
+    watcher = StorageWatcher([adapter_class(args.storage_root) for adapter_class in select_adapters(args.exchanges)],
+                             flush_interval=args.flush_interval)
+    watcher.start()
+    try:
+        while watcher.thread.is_alive():
+            watcher.thread.join(1)
+    except KeyboardInterrupt:
+        watcher.stop()
@@ -0,0 +1,158 @@
+from datetime import date, timedelta
+from termcolor import colored
+
+from catalog_schema import CATALOG_TABLES, LIFECYCLE_TABLE
+
+# A delisted symbol gets one last pass over this many days before its last sighting
+DELISTED_BACKFILL_DAYS = 31
+
+# If more than this share of listed symbols vanishes at once, assume a bad API answer, not a mass delisting
+MAX_DELISTED_FRACTION = 0.5
+
+
+# Tracks listing/delisting per (market, trading_pair) by diffing each run's exchange symbol
+# list against the last one stored in the catalog, and keeps `is_delisted` in sync
+class SymbolLifecycle:
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.tables = list(CATALOG_TABLES.get(catalog.database_name, {"daily": "daily", "monthly": "monthly"}))
+
+    def load(self, market):
+        rows = self.catalog.query(
+            f"""SELECT trading_pair, symbol, status, listed_on, last_seen, delisted_on, backfill_done
+            FROM {LIFECYCLE_TABLE} WHERE market = ?;""",
+            (market,))
+        return {
+            row[0]: {
+                "symbol": row[1],
+                "status": row[2],
+                "listed_on": row[3],
+                "last_seen": row[4],
+                "delisted_on": row[5],
+                "backfill_done": str(row[6]) == "1",
+            }
+            for row in rows
+        }
+
+    def _set_is_delisted(self, market, trading_pairs, is_delisted):
+        statements = []
+        trading_pairs = sorted(trading_pairs)
+        for start in range(0, len(trading_pairs), 500):
+            batch = trading_pairs[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            for table in self.tables:
+                statements.append((
+                    f"UPDATE {table} SET is_delisted = ? WHERE market = ? AND trading_pair IN ({placeholders});",
+                    (int(is_delisted), market, *batch)))
+        return statements
+
+    # Diff the exchange's current symbols for a market against the stored snapshot. inactive_symbols
+    # are ones the exchange still lists but doesn't trade (halted, settled), they count as delisted.
+    # Returns (listed, relisted, delisted) trading pairs, or None if the list was not trusted.
+    def observe(self, market, symbols, today=None, inactive_symbols=()):
+        if not symbols:
+            print(colored(f"No symbols returned for {market}, leaving the lifecycle snapshot untouched.", 'red'))
+            return None
+
+        today = (today or date.today()).isoformat()
+        current = {symbol.replace('/', ''): symbol for symbol in symbols}
+        known = self.load(market)
+        listed_before = [pair for pair, record in known.items() if record["status"] == "listed"]
+
+        listed = sorted(pair for pair in current if pair not in known)
+        relisted = sorted(pair for pair in current if pair in known and known[pair]["status"] == "delisted")
+        delisted = sorted(pair for pair in listed_before if pair not in current)
+        inactive = {symbol.replace('/', ''): symbol for symbol in inactive_symbols}
+        never_listed = sorted(pair for pair in inactive if pair not in known and pair not in current)
+
+        if listed_before and len(delisted) > MAX_DELISTED_FRACTION * len(listed_before):
+            print(colored(
+                f"{len(delisted)} of {len(listed_before)} {market} symbols vanished at once, "
+                f"ignoring this symbol list.", 'red'))
+            return None
+
+        # Symbols present on the very first snapshot were listed at some unknown earlier date
+        listed_on = today if known else None
+        statements = []
+        for pair in listed:
+            statements.append((
+                f"""{self.catalog.insert_ignore} INTO {LIFECYCLE_TABLE}
+                (market, trading_pair, symbol, status, listed_on, last_seen, delisted_on, backfill_done)
+                VALUES (?, ?, ?, 'listed', ?, ?, NULL, 0);""",
+                (market, pair, current[pair], listed_on, today)))
+        seen = sorted(set(current) - set(listed))
+        for start in range(0, len(seen), 500):
+            batch = seen[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            statements.append((
+                f"UPDATE {LIFECYCLE_TABLE} SET last_seen = ? WHERE market = ? AND trading_pair IN ({placeholders});",
+                (today, market, *batch)))
+        for pair in never_listed:
+            statements.append((
+                f"""{self.catalog.insert_ignore} INTO {LIFECYCLE_TABLE}
+                (market, trading_pair, symbol, status, listed_on, last_seen, delisted_on, backfill_done)
+                VALUES (?, ?, ?, 'delisted', NULL, NULL, ?, 0);""",
+                (market, pair, inactive[pair], today)))
+        for pair in relisted:
+            statements.append((
+                f"""UPDATE {LIFECYCLE_TABLE} SET status = 'listed', delisted_on = NULL, backfill_done = 0
+                WHERE market = ? AND trading_pair = ?;""",
+                (market, pair)))
+        for pair in delisted:
+            statements.append((
+                f"UPDATE {LIFECYCLE_TABLE} SET status = 'delisted', delisted_on = ? WHERE market = ? AND trading_pair = ?;",
+                (today, market, pair)))
+        statements += self._set_is_delisted(market, delisted + never_listed, True)
+        statements += self._set_is_delisted(market, relisted, False)
+        self.catalog.execute_many(statements)
+
+        if listed and known:
+            print(colored(f"Newly listed on {market}: {listed}", 'green'))
+        if relisted:
+            print(colored(f"Relisted on {market}: {relisted}", 'green'))
+        if delisted:
+            print(colored(f"Delisted from {market}: {delisted}", 'yellow'))
+        return listed, relisted, delisted
+
+    # (symbol, last_day) pairs to work on. last_day is None for live symbols and the last day a
+    # delisted symbol was seen while its final backfill is pending; finished delisted symbols are dropped.
+    def plan(self, market, symbols):
+        known = self.load(market)
+        planned = []
+        skipped = 0
+        for symbol in symbols:
+            record = known.get(symbol.replace('/', ''))
+            if record is None or record["status"] == "listed":
+                planned.append((symbol, None))
+            elif not record["backfill_done"]:
+                planned.append((symbol, self.last_day(record)))
+            else:
+                skipped += 1
+
+        # Delisted symbols drop out of the exchange list, they still get their final pass
+        listed_pairs = {symbol.replace('/', '') for symbol in symbols}
+        for pair, record in sorted(known.items()):
+            if record["status"] == "delisted" and not record["backfill_done"] and pair not in listed_pairs:
+                planned.append((record["symbol"], self.last_day(record)))
+
+        if skipped:
+            print(colored(f"Skipping {skipped} delisted {market} symbols with their final backfill done.", 'yellow'))
+        return planned
+
+    def last_day(self, record):
+        last_seen = record["last_seen"] or record["delisted_on"]
+        return date.fromisoformat(str(last_seen)[:10]) if last_seen else date.today() - timedelta(days=1)
+
+    # First day of the bounded final backfill window for a delisted symbol
+    def backfill_start(self, last_day):
+        return last_day - timedelta(days=DELISTED_BACKFILL_DAYS)
+
+    def finish_backfill(self, market, symbol):
+        pair = symbol.replace('/', '')
+        statements = [(
+            f"UPDATE {LIFECYCLE_TABLE} SET backfill_done = 1 WHERE market = ? AND trading_pair = ?;",
+            (market, pair))]
+        # Files fetched during the final pass were inserted as live, flag them too
+        statements += self._set_is_delisted(market, [pair], True)
+        self.catalog.execute_many(statements)
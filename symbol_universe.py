@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from termcolor import colored
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX, processes just don't coordinate refreshes
+    fcntl = None
+
+SYMBOL_CACHE_DIR = os.getenv(
+    'SYMBOL_CACHE_DIR',
+    os.path.join(os.getenv('CATALOG_SQLITE_DIR', os.path.expanduser("~/.readysetliqd")), "symbol_cache")
+)
+SYMBOL_UNIVERSE_TTL = int(os.getenv('SYMBOL_UNIVERSE_TTL', 60 * 60))
+
+# url+extract name -> (fetched_at, data), shared by every caller in the process
+_memo = {}
+_memo_lock = threading.Lock()
+_key_locks = {}
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# exchangeInfo is several MB, the scripts only ever look at these fields
+def compact_binance_exchange_info(data):
+    fields = ('symbol', 'status', 'contractType', 'contractStatus')
+    return {"symbols": [{k: s[k] for k in fields if k in s} for s in data['symbols']]}
+
+
+# Error answers raise so they are never cached
+def compact_bybit_tickers(data):
+    if data.get('retCode') != 0:
+        raise ValueError(f"API returned error: {data.get('retMsg', 'No error message')}")
+    if 'list' not in data.get('result', {}):
+        raise ValueError(f"Unexpected JSON structure in 'result': {data}")
+    return {
+        "retCode": data['retCode'],
+        "retMsg": data.get('retMsg'),
+        "result": {"list": [{"symbol": item['symbol']} for item in data['result']['list']]},
+    }
+
+
+def compact_kraken_asset_pairs(data):
+    fields = ('base', 'quote', 'wsname')
+    return {
+        "error": data.get('error', []),
+        "result": {name: {k: info[k] for k in fields if k in info} for name, info in data.get('result', {}).items()},
+    }
+
+
+def compact_bitstamp_pairs(data):
+    return [{"url_symbol": pair['url_symbol'], "trading": pair['trading']} for pair in data]
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def cache_key(url, name):
+    return hashlib.sha1(f"{url}|{name or ''}".encode()).hexdigest()
+
+
+def read_entry(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_entry(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+
+
+class _ProcessLock:
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.handle = open(self.path, 'w')
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+
+
+def revalidate(url, entry, extract, timeout):
+    import http_pool
+
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    response = http_pool.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and entry:
+        entry['fetched_at'] = time.time()
+        return entry, False
+    response.raise_for_status()
+    data = response.json()
+    return {
+        "url": url,
+        "fetched_at": time.time(),
+        "etag": response.headers.get('ETag'),
+        "last_modified": response.headers.get('Last-Modified'),
+        "data": extract(data) if extract else data,
+    }, True
+
+
+# GET a JSON symbol-list endpoint through the in-process memo and the on-disk cache.
+# Fresh entries are returned as-is, stale ones are revalidated with ETag/If-Modified-Since,
+# and a stale copy is served if the exchange can't be reached. `extract` shrinks the payload
+# before it is cached so later runs don't parse the full response again.
+def fetch_json(url, ttl=None, extract=None, timeout=30):
+    ttl = SYMBOL_UNIVERSE_TTL if ttl is None else ttl
+    key = cache_key(url, extract.__name__ if extract else None)
+
+    with _memo_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Concurrent callers for the same URL wait for a single fetch
+    with key_lock:
+        memo = _memo.get(key)
+        if memo and time.time() - memo[0] < ttl:
+            return memo[1]
+
+        path = os.path.join(SYMBOL_CACHE_DIR, f"{key}.json")
+        with _ProcessLock(path + ".lock"):
+            entry = read_entry(path)
+            if entry and time.time() - entry['fetched_at'] < ttl:
+                _memo[key] = (entry['fetched_at'], entry['data'])
+                return entry['data']
+
+            # Deferred, a fresh cache hit never needs requests
+            import requests
+
+            try:
+                entry, changed = revalidate(url, entry, extract, timeout)
+            except (requests.RequestException, ValueError) as e:
+                if entry is None:
+                    raise
+                print(colored(f"Serving stale symbol list for {url}: {e}", 'yellow'))
+                _memo[key] = (time.time(), entry['data'])
+                return entry['data']
+
+            write_entry(path, entry)
+            if not changed:
+                print(f"Symbol list unchanged for {url}")
+            _memo[key] = (entry['fetched_at'], entry['data'])
+            return entry['data']
+
+
+def clear_memo():
+    with _memo_lock:
+        _memo.clear()
@@ -0,0 +1,187 @@
+import os
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from termcolor import colored
+
+# Decoded trades kept in memory, in bytes of Arrow buffers. 0 turns the cache off.
+TRADE_CACHE_BYTES = int(os.getenv('TRADE_CACHE_BYTES', 2 << 30))
+# Optional second tier on local SSD: tables evicted from memory are written there as uncompressed Arrow
+# IPC (Feather v2) files, read back memory-mapped
+TRADE_CACHE_SPILL_DIR = os.getenv('TRADE_CACHE_SPILL_DIR', '')
+TRADE_CACHE_SPILL_BYTES = int(os.getenv('TRADE_CACHE_SPILL_BYTES', 50 << 30))
+
+
+# File of a (key, digest) pair in the spill tier. The digest is part of the name, so a file written for
+# an older version of the trades is never read again and just ages out.
+def spill_name(key, digest):
+    return hashlib.sha1(repr((key, digest)).encode()).hexdigest() + ".arrow"
+
+
+# LRU of whole-period trade tables keyed by (exchange, market, symbol, period, columns), bounded by bytes.
+# Every entry carries the digest its file had in the catalog when it was decoded; a lookup with another
+# digest (the file was downloaded again, recompressed or normalized) drops the entry.
+class TradeCache:
+
+    def __init__(self, max_bytes=TRADE_CACHE_BYTES, spill_dir=TRADE_CACHE_SPILL_DIR, spill_bytes=TRADE_CACHE_SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir or None
+        self.spill_bytes = spill_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.spilled = OrderedDict()
+        self.spilled_bytes = 0
+        self.hits = self.spill_hits = self.misses = self.evictions = self.invalidations = 0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            # Files from earlier sessions, oldest first
+            found = []
+            for name in os.listdir(self.spill_dir):
+                if name.endswith(".arrow"):
+                    stat = os.stat(os.path.join(self.spill_dir, name))
+                    found.append((stat.st_mtime, name, stat.st_size))
+            for _, name, size in sorted(found):
+                self.spilled[name] = size
+                self.spilled_bytes += size
+
+    def get(self, key, digest):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == digest:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+                self.bytes -= entry[2]
+                self.invalidations += 1
+            name = spill_name(key, digest)
+            if name not in self.spilled:
+                self.misses += 1
+                return None
+            self.spilled.move_to_end(name)
+        try:
+            table = self.read_spilled(name)
+        except OSError:
+            with self.lock:
+                self.spilled_bytes -= self.spilled.pop(name, 0)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.spill_hits += 1
+        self.put(key, digest, table, spill=False)
+        return table
+
+    def put(self, key, digest, table, spill=True):
+        size = table.nbytes
+        if size > self.max_bytes:
+            if spill:
+                self.spill(key, digest, table)
+            return
+        evicted = []
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self.entries[key] = (digest, table, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, (old_digest, old_table, old_size) = self.entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+                evicted.append((old_key, old_digest, old_table))
+        if spill:
+            for old_key, old_digest, old_table in evicted:
+                self.spill(old_key, old_digest, old_table)
+
+    # Returns the cached table, else decodes it with loader() and caches it
+    def load(self, key, digest, loader):
+        table = self.get(key, digest)
+        if table is None:
+            table = loader()
+            self.put(key, digest, table)
+        return table
+
+    def read_spilled(self, name):
+        import pyarrow.feather as feather
+
+        return feather.read_table(os.path.join(self.spill_dir, name), memory_map=True)
+
+    def spill(self, key, digest, table):
+        import pyarrow.feather as feather
+
+        if self.spill_dir is None:
+            return
+        name = spill_name(key, digest)
+        with self.lock:
+            if name in self.spilled:
+                self.spilled.move_to_end(name)
+                return
+        path = os.path.join(self.spill_dir, name)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            feather.write_feather(table, temp, compression="uncompressed")
+            os.replace(temp, path)
+        except OSError as e:
+            print(colored(f"Trade cache: could not spill to {self.spill_dir}: {e}", 'yellow'))
+            return
+        removed = []
+        with self.lock:
+            self.spilled[name] = os.path.getsize(path)
+            self.spilled_bytes += self.spilled[name]
+            while self.spilled_bytes > self.spill_bytes and len(self.spilled) > 1:
+                old_name, old_size = self.spilled.popitem(last=False)
+                self.spilled_bytes -= old_size
+                removed.append(old_name)
+        for old_name in removed:
+            try:
+                os.remove(os.path.join(self.spill_dir, old_name))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "spill_hits": self.spill_hits, "misses": self.misses,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "spilled": len(self.spilled), "spilled_bytes": self.spilled_bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_trade_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TradeCache()
+        return _cache
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or empty the trade cache's spill tier.")
+    parser.add_argument("--clear", action="store_true", help="Delete every spilled table.")
+    args = parser.parse_args()
+
+    if not TRADE_CACHE_SPILL_DIR:
+        print(colored("TRADE_CACHE_SPILL_DIR is not set, there is no spill tier.", 'yellow'))
+    else:
+        cache = TradeCache(max_bytes=0)
+        print(colored(f"{TRADE_CACHE_SPILL_DIR}: {len(cache.spilled)} tables, "
+                      f"{cache.spilled_bytes / 2**20:.1f} MB of {TRADE_CACHE_SPILL_BYTES / 2**20:.0f} MB", 'cyan'))
+        if args.clear:
+            for name in cache.spilled:
+                os.remove(os.path.join(TRADE_CACHE_SPILL_DIR, name))
+            print(colored(f"Removed {len(cache.spilled)} tables.", 'green'))
@@ -0,0 +1,218 @@
+import os
+import time
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from termcolor import colored
+
+from seek_index import read_range
+from trade_cache import TRADE_CACHE_BYTES, get_trade_cache
+from trade_normalizer import COLUMNS, parquet_path, schema
+
+# Longest period a file can start before the range it contributes to (a monthly archive)
+MAX_SPAN = timedelta(days=32)
+DATASET_READ_WORKERS = int(os.getenv('DATASET_READ_WORKERS', 8))
+
+
+def as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(value)
+
+
+def to_ms(value):
+    return int((value - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+# One catalog record seen through the dataset: where its trades are and which [start, end) they cover.
+# The digest is what the catalog says about the stored file (size, codec, normalized), it changes when
+# the file is downloaded again, recompressed or normalized.
+class TradeFile:
+
+    def __init__(self, adapter, market, pair, period, normalized, digest=None):
+        self.adapter = adapter
+        self.market = market
+        self.pair = pair
+        self.period = period
+        self.normalized = normalized
+        self.digest = digest
+        self.start, self.end = adapter.period_span(period)
+
+    # Same year/month as the Parquet copy's path: the period's, even for a snapshot reaching into the month before
+    @property
+    def partition(self):
+        return self.adapter.exchange, self.market, self.pair, int(self.period[:4]), int(self.period[5:7])
+
+    @property
+    def source(self):
+        return parquet_path(self.adapter, self.market, self.pair, self.period) if self.normalized else self.csv_path
+
+    # The raw file as stored, possibly a kept archive
+    @property
+    def csv_path(self):
+        return self.adapter.find_file(self.market, self.pair, self.period) or \
+            self.adapter.file_path(self.market, self.pair, self.period)
+
+    # Common schema table of the trades in [start_ms, end_ms). A read of the whole period goes through the
+    # trade cache (trade_cache.py); a partial one is served from it when the period is there, else read
+    # directly.
+    def read(self, start_ms, end_ms, columns):
+        import pyarrow.compute as pc
+
+        if not TRADE_CACHE_BYTES:
+            return self.read_file(start_ms, end_ms, columns)
+        cache = get_trade_cache()
+        cached_columns = tuple(dict.fromkeys(list(columns) + ["time"]))
+        key = (self.adapter.exchange, self.market, self.pair, self.period, cached_columns)
+        if start_ms <= to_ms(self.start) and end_ms >= to_ms(self.end):
+            table = cache.load(key, self.digest, lambda: self.read_file(None, None, cached_columns))
+        else:
+            table = cache.get(key, self.digest)
+            if table is None:
+                return self.read_file(start_ms, end_ms, columns)
+        time_column = table["time"]
+        table = table.filter(pc.and_(pc.greater_equal(time_column, start_ms), pc.less(time_column, end_ms)))
+        return table.select(list(columns))
+
+    # Row-group pruned from the Parquet copy when there is one, else one seek into the raw file through its
+    # minute index. No bounds reads the whole file.
+    def read_file(self, start_ms, end_ms, columns):
+        import pyarrow.parquet as pq
+
+        if start_ms is None:
+            start_ms, end_ms = -2 ** 63, 2 ** 63 - 1
+        path = self.source
+        if self.normalized and os.path.exists(path):
+            return pq.read_table(path, columns=list(columns),
+                                 filters=[("time", ">=", start_ms), ("time", "<", end_ms)])
+        return read_range(self.csv_path, self.adapter.exchange, self.market, start_ms, end_ms).select(list(columns))
+
+
+# Keeps the coarsest files: a monthly archive wins over the daily files of its month, files of the same
+# granularity (Bitstamp snapshots) all stay and overlap. Oldest first.
+def stitch(files):
+    chosen = []
+    for candidate in sorted(files, key=lambda f: (f.start - f.end, f.start)):
+        if not any(f.start <= candidate.start and candidate.end <= f.end for f in chosen):
+            chosen.append(candidate)
+    return sorted(chosen, key=lambda f: (f.start, f.end))
+
+
+def overlapping(files):
+    return any(later.start < earlier.end for earlier, later in zip(files, files[1:]))
+
+
+# Every exchange's trades as one dataset partitioned by exchange/market/symbol/year/month. Partitions are
+# pruned from the catalogs' period_start index before any file is opened, and the daily/monthly (or
+# daily/hourly) feeds of an exchange are stitched together, so a range is read from whichever files
+# hold it. Normalized records are read from their Parquet copy, the others from the raw CSV.
+class TradeDataset:
+
+    def __init__(self, exchanges=None, storage_root=None):
+        from exchange_adapters import select_adapters
+
+        self.feeds = {}
+        for adapter_class in select_adapters(exchanges):
+            adapter = adapter_class(storage_root)
+            self.feeds.setdefault(adapter.exchange, []).append(adapter)
+
+    # Stitched files overlapping [start, end), only those of the given exchange/market/symbol when given
+    def files(self, start, end, exchange=None, market=None, symbol=None):
+        start, end = as_datetime(start), as_datetime(end)
+        pair = symbol.replace('/', '') if symbol else None
+        by_symbol = {}
+        for feed_exchange, adapters in self.feeds.items():
+            if exchange is not None and feed_exchange != exchange:
+                continue
+            for adapter in adapters:
+                rows = adapter.catalog.get_records_between(
+                    adapter.table, (start - MAX_SPAN).strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), market, pair)
+                for row_market, row_pair, period, normalized, size, codec in rows:
+                    normalized = normalized not in (None, 0, '0')
+                    found = TradeFile(adapter, row_market, row_pair, period, normalized, (size, codec, normalized))
+                    if found.start < end and found.end > start:
+                        by_symbol.setdefault((feed_exchange, row_market, row_pair), []).append(found)
+        return {key: stitch(files) for key, files in sorted(by_symbol.items())}
+
+    # {(exchange, market, symbol, year, month): [files]} after pruning and stitching
+    def partitions(self, start, end, exchange=None, market=None, symbol=None):
+        partitions = {}
+        for files in self.files(start, end, exchange, market, symbol).values():
+            for found in files:
+                partitions.setdefault(found.partition, []).append(found)
+        return partitions
+
+    # One symbol's trades in [start, end) as a pyarrow Table in time order. Overlapping snapshots are
+    # de-duplicated on trade_id.
+    def read(self, exchange, market, symbol, start, end, columns=COLUMNS, workers=DATASET_READ_WORKERS):
+        import numpy as np
+        import pyarrow as pa
+
+        start, end = as_datetime(start), as_datetime(end)
+        files = self.files(start, end, exchange, market, symbol).get((exchange, market, symbol.replace('/', '')), [])
+        dedupe = overlapping(files)
+        needed = list(dict.fromkeys(list(columns) + (["trade_id", "time"] if dedupe else [])))
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(lambda f: f.read(start_ms, end_ms, needed), files))
+        if not tables:
+            return schema().empty_table().select(list(columns))
+        table = pa.concat_tables(tables)
+        if dedupe:
+            table = table.sort_by("time")
+            _, first = np.unique(table["trade_id"].to_numpy(), return_index=True)
+            table = table.take(np.sort(first))
+        return table.select(list(columns))
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def get_dataset(exchange, storage_root=None):
+    with _datasets_lock:
+        dataset = _datasets.get((exchange, storage_root))
+        if dataset is None:
+            dataset = _datasets[(exchange, storage_root)] = TradeDataset([exchange], storage_root)
+        return dataset
+
+
+# Trades of one symbol in [start, end) (dates, datetimes or ISO strings), time ordered, as a DataFrame or,
+# with as_numpy, a {column: array} dict
+def load_trades(exchange, market, symbol, start, end, columns=COLUMNS, as_numpy=False, storage_root=None):
+    table = get_dataset(exchange, storage_root).read(exchange, market, symbol, start, end, columns=columns)
+    if as_numpy:
+        return {name: table[name].to_numpy() for name in table.column_names}
+    return table.to_pandas()
+
+
+# Main logic
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read one symbol's trades over a time range from the stitched dataset.")
+    parser.add_argument("exchange")
+    parser.add_argument("market")
+    parser.add_argument("symbol")
+    parser.add_argument("start", help="YYYY-MM-DD[ HH:MM]")
+    parser.add_argument("end", help="YYYY-MM-DD[ HH:MM], exclusive")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    parser.add_argument("--partitions", action="store_true", help="Only list the partitions and files it would read.")
+    args = parser.parse_args()
+
+    dataset = TradeDataset([args.exchange], args.storage_root)
+    if args.partitions:
+        for partition, files in dataset.partitions(args.start, args.end, args.exchange, args.market, args.symbol).items():
+            exchange, market, symbol, year, month = partition
+            print(colored(f"exchange={exchange}/market={market}/symbol={symbol}/year={year}/month={month:02}", 'cyan'))
+            for found in files:
+                print(f"  {found.adapter.granularity:<8}{found.period:<18}{found.source}")
+    else:
+        started = time.time()
+        trades = load_trades(args.exchange, args.market, args.symbol, args.start, args.end, storage_root=args.storage_root)
+        print(colored(f"{len(trades)} trades in {time.time() - started:.2f}s", 'green'))
+        print(trades.head())
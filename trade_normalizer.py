@@ -0,0 +1,223 @@
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from termcolor import colored
+
+from compressed_files import codec_of, first_line, is_empty, open_raw
+
+# Where the Parquet copies go, default <storage root>/parquet, Hive-partitioned by exchange/market/symbol/year/month
+PARQUET_ROOT = os.getenv('PARQUET_ROOT')
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd')
+# Rows per row group: big enough for fast scans, small enough that a day of a quiet pair is one group
+ROW_GROUP_SIZE = int(os.getenv('PARQUET_ROW_GROUP_SIZE', 1 << 20))
+NORMALIZE_WORKERS = int(os.getenv('NORMALIZE_WORKERS', os.cpu_count() or 4))
+# Catalog rows flipped per batch, so an interrupted run keeps most of its progress
+FLAG_BATCH = 500
+
+# Common typed schema of every normalized file
+COLUMNS = ("trade_id", "price", "qty", "time", "is_buyer_maker")
+
+
+def schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("trade_id", pa.int64()),
+        ("price", pa.float64()),
+        ("qty", pa.float64()),
+        ("time", pa.int64()),              # ms since the epoch
+        ("is_buyer_maker", pa.bool_()),
+    ])
+
+
+def has_header(path):
+    first_cell = first_line(path).decode(errors='replace').split(',')[0].strip()
+    try:
+        float(first_cell)
+        return False
+    except ValueError:
+        return bool(first_cell)
+
+
+# A raw CSV as columns f0, f1, ... from a path (stream-decompressed when kept compressed), or from a
+# file-like block of it (no header there)
+def read_raw(source, skip_rows=None):
+    import pyarrow.csv as pv
+
+    if skip_rows is None:
+        skip_rows = int(has_header(source))
+    if isinstance(source, str) and codec_of(source):
+        with open_raw(source) as file:
+            return read_raw(file, skip_rows)
+    return pv.read_csv(
+        source,
+        read_options=pv.ReadOptions(autogenerate_column_names=True, skip_rows=skip_rows, use_threads=False),
+        convert_options=pv.ConvertOptions(strings_can_be_null=False),
+    )
+
+
+#-----------------------------------------------------------------------------------------------------------#
+# One reader per raw layout, as written by the adapters and the per-exchange scripts. Each takes the raw
+# table (columns f0, f1, ...), plus the row number its first line has in the file, and returns the columns
+# of the common schema.
+
+
+# id, price, qty, quote_qty, time, is_buyer_maker[, is_best_match]; spot times are in µs from 2025 on
+def binance_columns(raw, market, first_row=0):
+    import pyarrow.compute as pc
+
+    time_column = raw["f4"].cast("int64")
+    if len(time_column) and pc.max(time_column).as_py() > 10 ** 14:
+        time_column = pc.divide(time_column, 1000)
+    return raw["f0"], raw["f1"], raw["f2"], time_column, raw["f5"]
+
+
+# bybit-daily-csv.py's reshuffle leaves spot as id, price, qty, time ms, is_sell. Derivatives become
+# timestamp s, side, size, symbol, <price overwritten by the is-sell step>, tickDirection, trdMatchID,
+# grossValue, homeNotional, foreignNotional: the price comes back from the notionals, and with only a
+# UUID match id the trade_id is the row number in the file. Archives kept as .csv.gz never went through
+# the reshuffle and are put in the same order here.
+def bybit_columns(raw, market, first_row=0):
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if raw.num_rows and not pa.types.is_boolean(raw["f4"].type):
+        is_sell = pc.equal(pc.utf8_lower(raw["f4"].cast("string")), "sell")
+        raw = pa.table([raw["f0"], raw["f2"], raw["f3"], raw["f1"], is_sell] + raw.columns[5:], names=raw.column_names)
+    if raw.num_columns < 9:
+        return raw["f0"], raw["f1"], raw["f2"], raw["f3"], raw["f4"]
+    home, foreign = raw["f8"].cast("float64"), raw["f9"].cast("float64")
+    price = pc.divide(home, foreign) if market == "inverse" else pc.divide(foreign, home)
+    time_column = pc.round(pc.multiply(raw["f0"].cast("float64"), 1000))
+    is_buyer_maker = pc.equal(pc.utf8_lower(raw["f1"].cast("string")), "sell")
+    trade_id = pa.array(np.arange(first_row, first_row + raw.num_rows, dtype=np.int64))
+    return trade_id, price, raw["f2"], time_column, is_buyer_maker
+
+
+# trade_id, price, qty, time ms, isbuyermaker
+def kraken_columns(raw, market, first_row=0):
+    return raw["f0"], raw["f1"], raw["f2"], raw["f3"], raw["f4"]
+
+
+# Transactions reordered by process_and_store_data: type (0 buy, 1 sell), amount, date s, tid, price
+def bitstamp_columns(raw, market, first_row=0):
+    import pyarrow.compute as pc
+
+    return (raw["f3"], raw["f4"], raw["f1"], pc.multiply(raw["f2"].cast("int64"), 1000),
+            pc.equal(raw["f0"].cast("int64"), 1))
+
+
+LAYOUTS = {
+    "binance": binance_columns,
+    "bybit": bybit_columns,
+    "kraken": kraken_columns,
+    "bitstamp": bitstamp_columns,
+}
+
+
+def to_table(columns):
+    import pyarrow as pa
+
+    target = schema()
+    return pa.Table.from_arrays(
+        [column.cast(field.type) for column, field in zip(columns, target)], schema=target)
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def parquet_root(adapter):
+    return PARQUET_ROOT or os.path.join(os.path.dirname(os.path.dirname(adapter.storage_path)), "parquet")
+
+
+# Daily and monthly copies of a symbol share the month's partition, told apart by their file name
+def parquet_path(adapter, market, pair, period):
+    name = os.path.splitext(os.path.basename(adapter.file_path(market, pair, period)))[0] + ".parquet"
+    return os.path.join(parquet_root(adapter), f"exchange={adapter.exchange}", f"market={market}",
+                        f"symbol={adapter.trading_pair(pair)}", f"year={period[:4]}", f"month={period[5:7]}", name)
+
+
+# Raw CSV of one catalog record to Parquet, written to a temp file and renamed. Returns (rows, csv bytes, parquet bytes).
+def normalize_file(adapter, market, pair, period):
+    import pyarrow.parquet as pq
+
+    source = adapter.find_file(market, pair, period)
+    if source is None:
+        raise FileNotFoundError(adapter.file_path(market, pair, period))
+    target = parquet_path(adapter, market, pair, period)
+    if not is_empty(source):
+        table = to_table(LAYOUTS[adapter.exchange](read_raw(source), market))
+    else:
+        # Placeholder for a day without trades
+        table = schema().empty_table()
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(table, temp, row_group_size=ROW_GROUP_SIZE, compression=PARQUET_COMPRESSION)
+    os.replace(temp, target)
+    return table.num_rows, os.path.getsize(source), os.path.getsize(target)
+
+
+# Converts every catalog record of an adapter not normalized yet (all of them with force), in parallel
+# across files, and flips `normalized` as they land. Records whose raw file is gone are left alone.
+def normalize_adapter(adapter, workers=NORMALIZE_WORKERS, force=False, limit=None, metrics=None):
+    records = adapter.catalog.get_records(adapter.table) if force else adapter.catalog.get_unnormalized(adapter.table)
+    records = [tuple(record[:3]) for record in records][:limit]
+    if not records:
+        return 0
+    started = time.time()
+    done = []
+    converted = rows = csv_bytes = parquet_bytes = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(normalize_file, adapter, *record): record for record in records}
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                file_rows, file_csv, file_parquet = future.result()
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                print(colored(f"{adapter.name}: could not normalize {' '.join(record)}: {e}", 'red'))
+                failed += 1
+                continue
+            converted += 1
+            rows += file_rows
+            csv_bytes += file_csv
+            parquet_bytes += file_parquet
+            done.append(record)
+            if len(done) >= FLAG_BATCH:
+                adapter.catalog.set_normalized(adapter.table, done)
+                done = []
+    if done:
+        adapter.catalog.set_normalized(adapter.table, done)
+
+    elapsed = time.time() - started
+    if metrics is not None:
+        metrics.incr("normalized_files", adapter.name, value=converted)
+        metrics.incr("normalized_rows", adapter.name, value=rows)
+    ratio = f", {parquet_bytes / csv_bytes:.0%} of the CSV size" if csv_bytes else ""
+    print(colored(f"{adapter.name}: normalized {converted} files, {rows} trades in {elapsed:.1f}s"
+                  f"{ratio}, {failed} failed", 'green' if not failed else 'yellow'))
+    return converted
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+# Main logic
+if __name__ == "__main__":
+    from exchange_adapters import ADAPTERS, select_adapters
+
+    parser = argparse.ArgumentParser(description="Convert raw trade CSVs to typed Parquet and flip `normalized`.")
+    parser.add_argument("exchanges", nargs="*",
+                        help=f"Exchanges or feeds, default all. Feeds: {', '.join(ADAPTERS)}")
+    parser.add_argument("--storage-root", help="Root holding <exchange>/<daily|monthly|hourly>, default STORAGE_ROOT.")
+    parser.add_argument("--workers", type=int, default=NORMALIZE_WORKERS, help="Files converted at once.")
+    parser.add_argument("--force", action="store_true", help="Convert again files already normalized.")
+    parser.add_argument("--limit", type=int, help="At most this many files per feed.")
+    args = parser.parse_args()
+
+    for adapter_class in select_adapters(args.exchanges):
+        normalize_adapter(adapter_class(args.storage_root), workers=args.workers, force=args.force, limit=args.limit)
@@ -0,0 +1,192 @@
+import os
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from termcolor import colored
+
+WORK_QUEUE_PATH = os.getenv(
+    'WORK_QUEUE_PATH',
+    os.path.join(os.getenv('CATALOG_SQLITE_DIR', os.path.expanduser("~/.readysetliqd")), "work_queue.sqlite3")
+)
+# Seconds a lease survives without a heartbeat, i.e. how long a crashed worker's tasks stay blocked
+LEASE_SECONDS = int(os.getenv('WORK_QUEUE_LEASE', 600))
+# Finished tasks are kept this long for the record, then pruned
+DONE_RETENTION = 7 * 24 * 60 * 60
+
+PENDING = "pending"
+IN_FLIGHT = "in-flight"
+DONE = "done"
+FAILED = "failed"
+NOT_FOUND = "not-found"
+STATES = (PENDING, IN_FLIGHT, DONE, FAILED, NOT_FOUND)
+
+
+def lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Durable (feed, market, symbol, period) download tasks. A run enqueues what it planned, workers lease
+# a symbol's tasks, finish them one by one (each finish renews the rest of the lease) and release what
+# they did not reach. A worker that dies leaves its leases to expire, the next run or --resume takes over.
+class WorkQueue:
+
+    def __init__(self, path=None, lease_seconds=LEASE_SECONDS):
+        self.path = path or WORK_QUEUE_PATH
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            feed TEXT NOT NULL,
+            market TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            period TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT NULL,
+            lease_expires REAL NULL,
+            enqueued_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            last_error TEXT NULL,
+            PRIMARY KEY (feed, market, symbol, period)
+        );""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (feed, state);")
+
+    # Already queued or in flight: left alone. Finished before: back to pending (the period was planned
+    # again, so it is still not on disk). Returns the number of tasks that became pending.
+    def enqueue(self, feed, tasks):
+        now = time.time()
+        with self.lock:
+            before = self.connection.total_changes
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE;")
+                self.connection.executemany("""
+                    INSERT INTO tasks (feed, market, symbol, period, state, attempts, enqueued_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+                    ON CONFLICT (feed, market, symbol, period) DO UPDATE
+                    SET state = excluded.state, attempts = 0, last_error = NULL, updated_at = excluded.updated_at
+                    WHERE tasks.state IN (?, ?, ?);""",
+                    [(feed, market, symbol, period, PENDING, now, now, DONE, FAILED, NOT_FOUND)
+                     for market, symbol, period in tasks])
+                return self.connection.total_changes - before
+
+    # Claims a symbol's pending tasks (only the given periods, if any), and those whose lease ran out.
+    # Newest period first.
+    def lease(self, feed, market, symbol, owner, periods=None):
+        now = time.time()
+        wanted = set(periods) if periods is not None else None
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE;")
+                claimable = [row[0] for row in self.connection.execute("""
+                    SELECT period FROM tasks
+                    WHERE feed = ? AND market = ? AND symbol = ?
+                    AND (state = ? OR (state = ? AND lease_expires < ?))
+                    ORDER BY period DESC;""", (feed, market, symbol, PENDING, IN_FLIGHT, now))]
+                claimed = [period for period in claimable if wanted is None or period in wanted]
+                self.connection.executemany("""
+                    UPDATE tasks SET state = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?
+                    WHERE feed = ? AND market = ? AND symbol = ? AND period = ?;""",
+                    [(IN_FLIGHT, owner, now + self.lease_seconds, now, feed, market, symbol, period) for period in claimed])
+        return claimed
+
+    def finish(self, feed, market, symbol, period, state, owner, error=None):
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE;")
+                self.connection.execute("""
+                    UPDATE tasks SET state = ?, lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ?
+                    WHERE feed = ? AND market = ? AND symbol = ? AND period = ?;""",
+                    (state, error, now, feed, market, symbol, period))
+                # Heartbeat for the symbol's remaining tasks
+                self.connection.execute("""
+                    UPDATE tasks SET lease_expires = ?
+                    WHERE feed = ? AND market = ? AND symbol = ? AND state = ? AND lease_owner = ?;""",
+                    (now + self.lease_seconds, feed, market, symbol, IN_FLIGHT, owner))
+
+    # Hands back what a worker leased but did not get to
+    def release(self, feed, market, symbol, owner):
+        with self.lock:
+            self.connection.execute("""
+                UPDATE tasks SET state = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                WHERE feed = ? AND market = ? AND symbol = ? AND state = ? AND lease_owner = ?;""",
+                (PENDING, time.time(), feed, market, symbol, IN_FLIGHT, owner))
+
+    # The walk found the start of the symbol's history before `period`, older ones were never going to exist
+    def drop(self, feed, market, symbol, owner, period):
+        with self.lock:
+            self.connection.execute("""
+                DELETE FROM tasks
+                WHERE feed = ? AND market = ? AND symbol = ? AND period < ?
+                AND (state = ? OR (state = ? AND lease_owner = ?));""",
+                (feed, market, symbol, period, PENDING, IN_FLIGHT, owner))
+
+    # {(market, symbol): [period, ...] newest first} with work left: pending, or leased by a worker
+    # that stopped heartbeating
+    def pending(self, feed, market=None):
+        work = {}
+        with self.lock:
+            for market, symbol, period in self.connection.execute("""
+                    SELECT market, symbol, period FROM tasks
+                    WHERE feed = ? AND (? IS NULL OR market = ?) AND (state = ? OR (state = ? AND lease_expires < ?))
+                    ORDER BY market, symbol, period DESC;""", (feed, market, market, PENDING, IN_FLIGHT, time.time())):
+                work.setdefault((market, symbol), []).append(period)
+        return work
+
+    def retry_failed(self, feed=None):
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE tasks SET state = ?, attempts = 0, updated_at = ? WHERE state = ? AND (? IS NULL OR feed = ?);",
+                (PENDING, time.time(), FAILED, feed, feed))
+            return cursor.rowcount
+
+    def counts(self):
+        counts = {}
+        with self.lock:
+            for feed, state, count in self.connection.execute(
+                    "SELECT feed, state, COUNT(*) FROM tasks GROUP BY feed, state ORDER BY feed;"):
+                counts.setdefault(feed, dict.fromkeys(STATES, 0))[state] = count
+        return counts
+
+    def prune(self, retention=DONE_RETENTION):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM tasks WHERE state IN (?, ?) AND updated_at < ?;", (DONE, NOT_FOUND, time.time() - retention))
+
+    def report(self):
+        for feed, states in self.counts().items():
+            print(colored(f"Work queue {feed}: " + ", ".join(f"{count} {state}" for state, count in states.items()), 'magenta'))
+
+
+#-----------------------------------------------------------------------------------------------------------#
+
+
+_work_queue = None
+_work_queue_lock = threading.Lock()
+
+
+def get_work_queue():
+    global _work_queue
+    with _work_queue_lock:
+        if _work_queue is None:
+            _work_queue = WorkQueue()
+            _work_queue.prune()
+        return _work_queue
+
+
+# Main logic
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the download work queue. Resume with `python ingest.py --resume`.")
+    parser.add_argument("--retry-failed", nargs="?", const="", metavar="FEED", help="Put failed tasks back to pending.")
+    args = parser.parse_args()
+
+    queue = get_work_queue()
+    if args.retry_failed is not None:
+        print(colored(f"{queue.retry_failed(args.retry_failed or None)} failed tasks back to pending", 'yellow'))
+    queue.report()